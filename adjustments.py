@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 22:40
+"""
+图像色调调整(亮度/对比度/伽马/色阶/灰度)以及直方图,
+直接在 QImage 的像素缓冲区上用 numpy 向量化计算,不复制像素数据.
+亮度/对比度/伽马/色阶都是逐通道的单调映射,合并成一张 256 项的查找表
+"""
+import numpy as np
+from PySide6.QtGui import QImage
+
+# 按行分块处理,限制超大图像上的临时内存
+CHUNK_ROWS = 256
+# 计算直方图时最多采样的像素数
+HISTOGRAM_SAMPLES = 512 * 512
+
+
+class Adjustments:
+    """
+    一组色调调整参数
+    """
+    __slots__ = ("brightness", "contrast", "gamma", "black", "white", "grayscale")
+
+    def __init__(self, brightness=0, contrast=0, gamma=1.0, black=0, white=255, grayscale=False):
+        """
+        :param brightness: 亮度 -100 ~ 100
+        :param contrast: 对比度 -100 ~ 100
+        :param gamma: 伽马 0.1 ~ 3.0
+        :param black: 色阶黑场 0 ~ 254
+        :param white: 色阶白场 1 ~ 255
+        :param grayscale: 是否转为灰度
+        """
+        self.brightness = brightness
+        self.contrast = contrast
+        self.gamma = gamma
+        self.black = black
+        self.white = white
+        self.grayscale = grayscale
+
+    def is_identity(self):
+        return (self.brightness == 0 and self.contrast == 0 and self.gamma == 1.0 and self.black == 0
+                and self.white == 255 and not self.grayscale)
+
+    def copy(self):
+        return Adjustments(self.brightness, self.contrast, self.gamma, self.black, self.white, self.grayscale)
+
+
+def build_lut(adjustments):
+    """
+    把色阶/伽马/对比度/亮度依次合并成一张查找表
+    :param adjustments: Adjustments
+    :return: uint8 数组,长度 256
+    """
+    x = np.arange(256, dtype=np.float32)
+    x = np.clip((x - adjustments.black) * 255 / max(adjustments.white - adjustments.black, 1), 0, 255)
+    x = 255 * (x / 255) ** (1 / max(adjustments.gamma, 0.01))
+    # 对比度以中间灰为中心缩放,-100 时为纯灰, 100 时放大 4 倍
+    x = (x - 127.5) * ((100 + adjustments.contrast) / 100) ** 2 + 127.5
+    x = x + adjustments.brightness * 2.55
+    return np.clip(x + 0.5, 0, 255).astype(np.uint8)
+
+
+def pixel_view(image):
+    """
+    QImage 像素缓冲区的 numpy 视图(不复制),修改视图即修改图像
+    :param image: Format_RGBA8888 格式的 QImage,字节顺序固定为 R,G,B,A
+    :return: (高, 宽, 4) 的 uint8 数组
+    """
+    width, height = image.width(), image.height()
+    buffer = np.frombuffer(image.bits(), np.uint8, count=image.bytesPerLine() * height)
+    # 每一行末尾可能有对齐用的填充字节
+    return buffer.reshape(height, image.bytesPerLine())[:, :width * 4].reshape(height, width, 4)
+
+
+def _luma(rgb):
+    """
+    BT.601 亮度,使用整数运算
+    :param rgb: (..., 3) uint8 数组
+    :return: uint8 数组
+    """
+    rgb = rgb.astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def apply_adjustments(image, adjustments):
+    """
+    对图像应用色调调整
+    :param image: QImage
+    :param adjustments: Adjustments,为 None 或者不做任何调整时直接返回原图
+    :return: 调整后的 QImage(Format_RGBA8888)
+    """
+    if adjustments is None or adjustments.is_identity():
+        return image
+    # convertToFormat 返回新的图像,之后在它的缓冲区上原地修改
+    result = image.convertToFormat(QImage.Format.Format_RGBA8888)
+    pixels = pixel_view(result)
+    lut = build_lut(adjustments)
+    for start in range(0, result.height(), CHUNK_ROWS):
+        rgb = pixels[start:start + CHUNK_ROWS, :, :3]
+        if adjustments.grayscale:
+            rgb[...] = _luma(rgb)[..., np.newaxis]
+        rgb[...] = lut[rgb]
+    return result
+
+
+def histogram(image, max_samples=HISTOGRAM_SAMPLES):
+    """
+    计算 R/G/B/亮度 的直方图,大图像按步长采样
+    :param image: QImage
+    :param max_samples: 最多采样的像素数
+    :return: (4, 256) 的数组,依次为 R, G, B, 亮度
+    """
+    if image.format() != QImage.Format.Format_RGBA8888:
+        image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+    pixels = pixel_view(image)
+    step = max(int((image.width() * image.height() / max_samples) ** 0.5), 1)
+    rgb = pixels[::step, ::step, :3]
+    channels = [rgb[..., 0], rgb[..., 1], rgb[..., 2], _luma(rgb)]
+    return np.stack([np.bincount(channel.ravel(), minlength=256) for channel in channels])
@@ -0,0 +1,272 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 22:10
+"""
+动图(GIF/WebP 等)播放以及多页图像(TIFF 等)翻页.
+帧在后台线程中按预览尺寸提前解码,放入有容量上限的帧缓存,
+全部帧都能放进缓存时循环播放不再重复解码;缩略图仍然只显示第一帧
+"""
+import threading
+from collections import OrderedDict
+
+from PySide6.QtCore import Qt, QThread, QTimer, Signal
+from PySide6.QtGui import QImageReader, QPixmap
+from PySide6.QtWidgets import QGraphicsPixmapItem
+
+from ingest import open_image_reader
+
+# 帧缓存的容量上限
+DEFAULT_FRAME_CACHE_BYTES = 96 * 1024 * 1024
+# 没有帧间隔信息时的默认间隔(毫秒)
+DEFAULT_FRAME_DELAY = 100
+# 帧间隔的下限,避免间隔过小的动图占满 CPU
+MIN_FRAME_DELAY = 20
+# 多页图像只预先解码当前页前后的页数
+PAGE_AHEAD = 2
+
+
+def read_frame_info(path):
+    """
+    读取图像的帧信息,只读取文件头
+    :param path:
+    :return: (是否为动图, 帧数/页数),帧数未知时为 0
+    """
+    with open_image_reader(path) as reader:
+        return reader.supportsAnimation(), max(reader.imageCount(), 0)
+
+
+def is_multi_frame(path):
+    animated, count = read_frame_info(path)
+    return count > 1 or (animated and count == 0)
+
+
+class FrameDecoder(QThread):
+    """
+    后台帧解码线程,从当前需要的帧开始向后解码,直到帧缓存放满.
+    动图的帧依赖前面的帧合成,只能顺序读取(向前跳转时从头读取);
+    多页图像的每一页是独立的,可以直接跳转
+    """
+    # 一帧解码完成 帧序号
+    frame_decoded = Signal(int)
+
+    def __init__(self, path, size, animated, max_bytes=DEFAULT_FRAME_CACHE_BYTES, parent=None):
+        """
+        :param path: 图像路径
+        :param size: 帧缩放到的尺寸(保持宽高比适配该尺寸) QSize
+        :param animated: 是否为动图,否则按多页图像处理
+        :param max_bytes: 帧缓存的容量上限
+        :param parent:
+        """
+        super().__init__(parent)
+        self.path = path
+        self.size = size
+        self.animated = animated
+        self.max_frames = max(2, max_bytes // max(size.width() * size.height() * 4, 1))
+        self.cond = threading.Condition()
+        # 帧序号 -> (QImage, 帧间隔 毫秒)
+        self.frames = OrderedDict()
+        # 帧数,未知时为 0,解码到末尾后确定
+        self.frame_count = 0
+        # 当前需要的帧
+        self.wanted = 0
+        self._reader = None
+        # 顺序读取时下一次 read 得到的帧序号
+        self._next = 0
+        self._isRunning = True
+
+    def frame(self, index):
+        """
+        :param index: 帧序号
+        :return: (QImage, 帧间隔),还没有解码时返回 None
+        """
+        with self.cond:
+            return self.frames.get(index)
+
+    def request(self, index):
+        """
+        设置当前需要的帧,解码线程从该帧开始向后解码
+        :param index:
+        :return:
+        """
+        with self.cond:
+            self.wanted = index
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self._isRunning = False
+            self.cond.notify()
+
+    def _window(self):
+        """
+        需要缓存的帧序号,全部帧都能放进缓存时为所有帧
+        :return:
+        """
+        count = self.frame_count
+        if not self.animated:
+            last = self.wanted + PAGE_AHEAD
+            return range(max(self.wanted - 1, 0), min(last, count - 1) + 1 if count else last + 1)
+        if count and count <= self.max_frames:
+            return range(count)
+        indexes = [self.wanted + i for i in range(self.max_frames)]
+        return [i % count for i in indexes] if count else indexes
+
+    def _next_index(self):
+        for index in self._window():
+            if index not in self.frames:
+                return index
+        return None
+
+    def run(self):
+        while True:
+            with self.cond:
+                index = self._next_index()
+                while self._isRunning and index is None:
+                    self.cond.wait()
+                    index = self._next_index()
+                if not self._isRunning:
+                    break
+            image, delay = self._read(index)
+            with self.cond:
+                if image is None:
+                    # 读到末尾,确定帧数
+                    if not self.frame_count:
+                        self.frame_count = max(index, 1)
+                    else:
+                        # 无法解码的帧用上一帧代替,避免反复重试
+                        previous = self.frames.get(index - 1)
+                        self.frames[index] = previous or (None, DEFAULT_FRAME_DELAY)
+                else:
+                    window = set(self._window())
+                    self.frames[index] = (image, delay)
+                    # 淘汰不在窗口中的帧
+                    for key in [key for key in self.frames if key not in window]:
+                        del self.frames[key]
+            self.frame_decoded.emit(index)
+        self._reader = None
+
+    def _open(self):
+        self._reader = QImageReader(self.path)
+        self._reader.setAutoTransform(True)
+        self._next = 0
+
+    def _read(self, index):
+        """
+        解码一帧
+        :param index:
+        :return: (QImage, 帧间隔),超出帧数或者解码失败时返回 (None, 0)
+        """
+        if self._reader is None or (self.animated and index < self._next):
+            self._open()
+        if not self.animated:
+            if not self._reader.jumpToImage(index):
+                return None, 0
+        else:
+            # 跳过中间的帧(仍然需要解码才能合成后面的帧)
+            while self._next < index:
+                if self._reader.read().isNull():
+                    return None, 0
+                self._next += 1
+            self._next += 1
+        source = self._reader.size()
+        if source.isValid() and not source.isEmpty():
+            self._reader.setScaledSize(source.scaled(self.size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = self._reader.read()
+        if image.isNull():
+            return None, 0
+        if image.size() != self._reader.scaledSize():
+            # 不支持缩放解码的格式
+            image = image.scaled(self.size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        delay = self._reader.nextImageDelay()
+        return image, max(delay, MIN_FRAME_DELAY) if delay > 0 else DEFAULT_FRAME_DELAY
+
+
+class AnimatedImageItem(QGraphicsPixmapItem):
+    """
+    预览区中的动图/多页图像图形项.
+    动图按帧间隔自动播放,多页图像默认停在第一页,通过 show_frame 翻页
+    """
+
+    def __init__(self, path, first_frame, size, parent=None):
+        """
+        :param path: 图像路径
+        :param first_frame: 第一帧 QPixmap(已经缓存的预览图),解码线程完成之前先显示
+        :param size: 帧缩放到的尺寸 QSize
+        :param parent:
+        """
+        super().__init__(first_frame, parent)
+        self.path = path
+        self.animated, count = read_frame_info(path)
+        self.index = 0
+        # 等待解码的帧,解码完成后立即显示
+        self.pending = None
+        self.playing = self.animated
+        self.decoder = FrameDecoder(path, size, self.animated)
+        self.decoder.frame_count = count
+        self.decoder.frame_decoded.connect(self._on_frame_decoded)
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._advance)
+        self.decoder.start()
+        if self.playing:
+            self.timer.start(DEFAULT_FRAME_DELAY)
+
+    def frame_count(self):
+        return self.decoder.frame_count
+
+    def show_frame(self, index):
+        """
+        显示某一帧/页
+        :param index: 帧序号,超出范围时循环
+        :return: 是否已经显示,还没有解码时解码完成后显示
+        """
+        count = self.decoder.frame_count
+        if count:
+            index %= count
+        elif index < 0:
+            return False
+        self.decoder.request(index)
+        frame = self.decoder.frame(index)
+        if frame is None:
+            self.pending = index
+            return False
+        self.pending = None
+        self.index = index
+        if frame[0] is not None:
+            self.setPixmap(QPixmap.fromImage(frame[0]))
+        if self.playing:
+            self.timer.start(frame[1])
+        return True
+
+    def set_playing(self, playing):
+        """
+        播放/暂停,只对动图有效
+        :param playing:
+        :return:
+        """
+        self.playing = playing and self.animated
+        if self.playing:
+            self.timer.start(0)
+        else:
+            self.timer.stop()
+
+    def _advance(self):
+        count = self.decoder.frame_count
+        self.show_frame(self.index + 1 if not count or self.index + 1 < count else 0)
+
+    def _on_frame_decoded(self, index):
+        count = self.decoder.frame_count
+        # 帧数未知时可能请求了末尾之后的帧,确定帧数之后从头播放
+        if self.pending is not None and (index == self.pending or (count and self.pending >= count)):
+            self.show_frame(self.pending)
+
+    def release(self):
+        """
+        图形项从场景中移除前调用,停止播放以及解码线程
+        :return:
+        """
+        self.timer.stop()
+        self.decoder.frame_decoded.disconnect(self._on_frame_decoded)
+        self.decoder.stop()
+        self.decoder.wait()
@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 21:40
+"""
+持久化的标注存储: 每张图像的标注序列化后保存在数据目录下的单个 SQLite 文件中,
+预览图像时按需读取,修改后在后台线程中写入
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PySide6.QtCore import QSize
+
+from annotations import decode_records, encode_records
+from util import get_data_dir
+
+
+class AnnotationStore:
+    """
+    key 为图像的绝对路径,图像文件被修改之后标注仍然保留
+    """
+    # 批量写入时每批最多处理的条目数
+    WRITE_BATCH = 64
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: 标注文件路径,默认放在用户数据目录下
+        """
+        self.db_path = db_path or os.path.join(get_data_dir(), "annotations.db")
+        # sqlite 连接在多个线程中共享,需要加锁
+        self.lock = threading.Lock()
+        self.conn = self._connect()
+        # 后台写入队列
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="AnnotationStoreWriter", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        # 标注是用户数据,文件损坏时不能像缓存一样删除重建,直接抛出异常
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS annotations (
+                path TEXT PRIMARY KEY,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        return conn
+
+    def load(self, path):
+        """
+        读取一张图像的标注
+        :param path: 图像路径
+        :return: (记录坐标对应的原图尺寸 QSize, 标注记录列表),没有标注时返回 None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT width, height, data FROM annotations WHERE path=?",
+                                    (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        return QSize(row[0], row[1]), decode_records(row[2])
+
+    def load_encoded(self, path):
+        """
+        读取一张图像序列化后的标注,用于传给批处理的子进程
+        :param path:
+        :return: (宽, 高, 序列化后的数据),没有标注时返回 None
+        """
+        with self.lock:
+            return self.conn.execute("SELECT width, height, data FROM annotations WHERE path=?",
+                                     (os.path.abspath(path),)).fetchone()
+
+    def paths(self, root=None):
+        """
+        有标注的图像路径
+        :param root: 只返回该目录下的图像,为 None 时返回全部
+        :return: 图像路径列表
+        """
+        with self.lock:
+            if root is None:
+                rows = self.conn.execute("SELECT path FROM annotations ORDER BY path").fetchall()
+            else:
+                prefix = os.path.join(os.path.abspath(root), "")
+                rows = self.conn.execute("SELECT path FROM annotations WHERE substr(path, 1, ?)=? ORDER BY path",
+                                         (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def save(self, path, size, records):
+        """
+        异步写入一张图像的标注,在调用线程中序列化,保证写入的是调用时的内容
+        :param path: 图像路径
+        :param size: 记录坐标对应的原图尺寸 QSize
+        :param records: 标注记录列表,为空时删除
+        :return:
+        """
+        if not records:
+            self.delete(path)
+            return
+        self._queue.put(("put", os.path.abspath(path), size.width(), size.height(), encode_records(records)))
+
+    def delete(self, path):
+        self._queue.put(("delete", os.path.abspath(path)))
+
+    def _write_loop(self):
+        while True:
+            ops = [self._queue.get()]
+            # 尽量把积压的操作合并到一个事务中
+            while len(ops) < self.WRITE_BATCH:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(op is None for op in ops)
+            try:
+                self._apply([op for op in ops if op is not None])
+            except sqlite3.Error as e:
+                print(f"标注写入失败: {e}")
+            for _ in ops:
+                self._queue.task_done()
+            if stop:
+                break
+
+    def _apply(self, ops):
+        if not ops:
+            return
+        # 同一张图像只需要写入最后一次的内容
+        latest = {}
+        for op in ops:
+            latest[op[1]] = op
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for op in latest.values():
+                    if op[0] == "put":
+                        self.conn.execute("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?, ?)",
+                                          (*op[1:], now))
+                    else:
+                        self.conn.execute("DELETE FROM annotations WHERE path=?", (op[1],))
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def flush(self):
+        """
+        等待所有排队的写入完成
+        :return:
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,546 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 21:10
+"""
+预览区的标注(画笔轨迹/文字)以及撤销历史.
+标注以紧凑的记录保存,坐标使用原图的像素坐标,与场景无关:
+预览图刷新/切换图像时场景中的图形项会被清除,需要时再从记录重新创建,
+导出时直接把记录绘制到原图上
+"""
+import struct
+import sys
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+
+from PySide6.QtCore import QPointF, QRectF
+from PySide6.QtGui import QColor, QFont, QImage, QPainter, QPainterPath, QPalette, QPen, QPolygonF, QTextDocument, \
+    QUndoCommand, QUndoStack, QAbstractTextDocumentLayout
+from PySide6.QtWidgets import QGraphicsItem, QGraphicsPathItem, QGraphicsTextItem
+
+# 每张图像最多保留的撤销步数
+UNDO_LIMIT = 100
+# 所有图像的标注记录占用的内存上限,超出时清除最久没有查看的图像的撤销历史
+MAX_HISTORY_BYTES = 64 * 1024 * 1024
+# 间隔小于该时间(秒)且画笔相同的连续笔画合并为一个撤销步骤
+MERGE_INTERVAL = 1.0
+# 序列化格式的版本
+FORMAT_VERSION = 1
+
+_STROKE_HEADER = struct.Struct("<cIfI")
+_TEXT_HEADER = struct.Struct("<cfffIfII")
+
+
+class StrokeRecord:
+    """
+    一笔画笔轨迹,points 为 [x0, y0, x1, y1, ...]
+    """
+    __slots__ = ("points", "color", "width", "__weakref__")
+
+    def __init__(self, points, color, width):
+        """
+        :param points: 轨迹点 array('f')
+        :param color: 画笔颜色 QRgb(包含透明度)
+        :param width: 画笔宽度
+        """
+        self.points = points
+        self.color = color
+        self.width = width
+
+    @classmethod
+    def from_points(cls, points, pen):
+        """
+        :param points: [(x, y), ...]
+        :param pen: QPen
+        :return:
+        """
+        flat = array("f")
+        for x, y in points:
+            flat.append(x)
+            flat.append(y)
+        return cls(flat, pen.color().rgba(), pen.widthF())
+
+    def pen(self):
+        return QPen(QColor.fromRgba(self.color), self.width)
+
+    def path(self):
+        points = self.points
+        path = QPainterPath(QPointF(points[0], points[1]))
+        for i in range(2, len(points), 2):
+            path.lineTo(points[i], points[i + 1])
+        return path
+
+    def polygon(self):
+        points = self.points
+        return QPolygonF([QPointF(points[i], points[i + 1]) for i in range(0, len(points), 2)])
+
+    @property
+    def nbytes(self):
+        return self.points.itemsize * len(self.points) + 64
+
+
+class TextRecord:
+    """
+    一段文字,text 在编辑过程中随文本框同步更新
+    """
+    __slots__ = ("x", "y", "text", "family", "point_size", "color", "text_width", "__weakref__")
+
+    def __init__(self, x, y, text, family, point_size, color, text_width=-1.0):
+        """
+        :param x: 左上角 x
+        :param y: 左上角 y
+        :param text: 文字内容
+        :param family: 字体
+        :param point_size: 字号
+        :param color: 文字颜色 QRgb
+        :param text_width: 文本框宽度, -1 表示不换行
+        """
+        self.x = x
+        self.y = y
+        self.text = text
+        self.family = family
+        self.point_size = point_size
+        self.color = color
+        self.text_width = text_width
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        :param item: QGraphicsTextItem
+        :return:
+        """
+        font = item.font()
+        return cls(item.pos().x(), item.pos().y(), item.toPlainText(), font.family(), font.pointSizeF(),
+                   item.defaultTextColor().rgba(), item.textWidth())
+
+    def font(self):
+        font = QFont(self.family)
+        font.setPointSizeF(self.point_size)
+        return font
+
+    @property
+    def nbytes(self):
+        return len(self.text) * 2 + len(self.family) * 2 + 96
+
+
+def build_item(record):
+    """
+    根据标注记录创建图形项
+    :param record: StrokeRecord 或者 TextRecord
+    :return: QGraphicsItem
+    """
+    if isinstance(record, StrokeRecord):
+        item = QGraphicsPathItem(record.path())
+        item.setPen(record.pen())
+        return item
+    item = QGraphicsTextItem(record.text)
+    item.setFont(record.font())
+    item.setDefaultTextColor(QColor.fromRgba(record.color))
+    item.setPos(record.x, record.y)
+    item.setTextWidth(record.text_width)
+    return item
+
+
+def paint_records(painter, records):
+    """
+    不经过场景直接绘制标注记录,可以在后台线程中绘制到 QImage 上
+    :param painter: QPainter,坐标系为原图像素坐标
+    :param records:
+    :return:
+    """
+    for record in records:
+        if isinstance(record, StrokeRecord):
+            painter.setPen(record.pen())
+            painter.drawPolyline(record.polygon())
+            continue
+        # 与 QGraphicsTextItem 的绘制方式保持一致
+        document = QTextDocument()
+        document.setDefaultFont(record.font())
+        document.setPlainText(record.text)
+        document.setTextWidth(record.text_width)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.ColorRole.Text, QColor.fromRgba(record.color))
+        painter.save()
+        painter.translate(record.x, record.y)
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+
+def render_annotated(image, records, image_size):
+    """
+    把标注记录绘制到原图上
+    :param image: 原图 QImage(已经应用 EXIF 旋转)
+    :param records: 标注记录列表
+    :param image_size: 记录坐标对应的原图尺寸 QSize
+    :return: QImage,没有标注时返回原图
+    """
+    if not records:
+        return image
+    image = image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    # 读取到的尺寸与记录时不一致(例如文件头中没有尺寸)时按比例映射
+    painter.scale(image.width() / max(image_size.width(), 1), image.height() / max(image_size.height(), 1))
+    paint_records(painter, records)
+    painter.end()
+    return image
+
+
+def encode_records(records):
+    """
+    把标注记录序列化为紧凑的二进制格式(小端),轨迹点直接保存 float32 数组
+    :param records:
+    :return: bytes
+    """
+    chunks = [bytes([FORMAT_VERSION])]
+    for record in records:
+        if isinstance(record, StrokeRecord):
+            points = record.points
+            if sys.byteorder == "big":
+                points = array("f", points)
+                points.byteswap()
+            chunks.append(_STROKE_HEADER.pack(b"S", record.color, record.width, len(points)))
+            chunks.append(points.tobytes())
+        else:
+            family, text = record.family.encode("utf-8"), record.text.encode("utf-8")
+            chunks.append(_TEXT_HEADER.pack(b"T", record.x, record.y, record.point_size, record.color,
+                                            record.text_width, len(family), len(text)))
+            chunks.append(family)
+            chunks.append(text)
+    return b"".join(chunks)
+
+
+def decode_records(data):
+    """
+    encode_records 的逆过程
+    :param data: bytes
+    :return: 标注记录列表,格式不支持时返回空列表
+    """
+    if not data or data[0] != FORMAT_VERSION:
+        return []
+    records = []
+    offset = 1
+    while offset < len(data):
+        if data[offset:offset + 1] == b"S":
+            _, color, width, count = _STROKE_HEADER.unpack_from(data, offset)
+            offset += _STROKE_HEADER.size
+            points = array("f")
+            points.frombytes(data[offset:offset + count * 4])
+            if sys.byteorder == "big":
+                points.byteswap()
+            offset += count * 4
+            records.append(StrokeRecord(points, color, width))
+        else:
+            _, x, y, point_size, color, text_width, family_len, text_len = _TEXT_HEADER.unpack_from(data, offset)
+            offset += _TEXT_HEADER.size
+            family = data[offset:offset + family_len].decode("utf-8")
+            offset += family_len
+            text = data[offset:offset + text_len].decode("utf-8")
+            offset += text_len
+            records.append(TextRecord(x, y, text, family, point_size, color, text_width))
+    return records
+
+
+class AnnotationDocument:
+    """
+    一张图像的标注记录以及撤销栈
+    """
+
+    def __init__(self, path, size, undo_limit=UNDO_LIMIT, records=None):
+        """
+        :param path: 图像路径
+        :param size: 原图(按显示方向)的尺寸 QSize,记录的坐标以此为准
+        :param undo_limit: 最多保留的撤销步数
+        :param records: 已经保存的标注记录
+        """
+        self.path = path
+        self.size = size
+        self.records = records or []
+        # 已经被撤销/清除,只被撤销栈引用的记录,撤销步骤被丢弃后自动释放
+        self.removed = weakref.WeakValueDictionary()
+        self.stack = QUndoStack()
+        self.stack.setUndoLimit(undo_limit)
+        # 当前显示该图像标注的图层,图像没有显示时为 None
+        self.layer = None
+        # 标注变化时的回调
+        self.on_change = None
+
+    def add(self, record, item=None):
+        """
+        :param record:
+        :param item: 已经存在的图形项(例如正在编辑的文本框),为 None 时按需创建
+        :return:
+        """
+        self.records.append(record)
+        self.removed.pop(id(record), None)
+        if self.layer is not None:
+            self.layer.add(record, item)
+        self.changed()
+
+    def remove(self, record):
+        self.records.remove(record)
+        self.removed[id(record)] = record
+        if self.layer is not None:
+            self.layer.remove(record)
+        self.changed()
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def clear_history(self):
+        self.stack.clear()
+        self.removed.clear()
+
+    def nbytes(self):
+        """
+        :return: 当前的记录以及撤销历史中的记录占用的内存(估算)
+        """
+        return sum(record.nbytes for record in self.records) + sum(
+            record.nbytes for record in list(self.removed.values()))
+
+
+class AnnotationLayer(QGraphicsItem):
+    """
+    预览图上的标注图层,本身不绘制任何内容,
+    通过缩放把原图像素坐标映射到预览图的场景坐标
+    """
+
+    def __init__(self, document, scale, parent=None):
+        """
+        :param document: AnnotationDocument
+        :param scale: 预览图尺寸 / 原图尺寸
+        :param parent:
+        """
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemHasNoContents)
+        self.setScale(scale)
+        self.document = document
+        # id(记录) -> 图形项
+        self.items = {}
+        document.layer = self
+        for record in document.records:
+            self.add(record)
+
+    def boundingRect(self):
+        return QRectF()
+
+    def paint(self, painter, option, widget=None):
+        pass
+
+    def add(self, record, item=None):
+        if item is None:
+            item = build_item(record)
+        item.setParentItem(self)
+        if isinstance(record, TextRecord):
+            # 文字在添加之后仍然可以编辑
+            text_document = item.document()
+            text_document.contentsChanged.connect(lambda: self._update_text(record, text_document))
+        self.items[id(record)] = item
+
+    def _update_text(self, record, text_document):
+        record.text = text_document.toPlainText()
+        self.document.changed()
+
+    def remove(self, record):
+        item = self.items.pop(id(record), None)
+        if item is not None and item.scene() is not None:
+            item.scene().removeItem(item)
+
+    def detach(self):
+        """
+        场景被清除之前调用,之后不再更新该图层
+        :return:
+        """
+        if self.document.layer is self:
+            self.document.layer = None
+        self.items.clear()
+
+
+class AddStrokeCommand(QUndoCommand):
+    """
+    添加画笔轨迹,短时间内画笔相同的连续笔画合并为一步
+    """
+
+    def __init__(self, document, record, item=None):
+        """
+        :param document:
+        :param record: StrokeRecord
+        :param item: 绘制时的轨迹图形项,第一次执行时直接加入图层
+        """
+        super().__init__("画笔")
+        self.document = document
+        self.records = [record]
+        self.item = item
+        self.last_time = time.monotonic()
+
+    def id(self):
+        return 1
+
+    def mergeWith(self, other):
+        if other.id() != self.id() or other.document is not self.document:
+            return False
+        last, record = self.records[-1], other.records[0]
+        if (other.last_time - self.last_time > MERGE_INTERVAL or last.color != record.color
+                or last.width != record.width):
+            return False
+        self.records.extend(other.records)
+        self.last_time = other.last_time
+        return True
+
+    def undo(self):
+        for record in reversed(self.records):
+            self.document.remove(record)
+
+    def redo(self):
+        # 合并发生在第一次执行之后,这里的记录都不在文档中
+        for record in self.records:
+            self.document.add(record, self.item)
+        self.item = None
+
+
+class AddTextCommand(QUndoCommand):
+    def __init__(self, document, record, item=None):
+        """
+        :param document:
+        :param record: TextRecord
+        :param item: 正在编辑的文本框,第一次执行时直接加入图层
+        """
+        super().__init__("文字")
+        self.document = document
+        self.record = record
+        self.item = item
+
+    def undo(self):
+        self.document.remove(self.record)
+
+    def redo(self):
+        self.document.add(self.record, self.item)
+        self.item = None
+
+
+class ClearAnnotationsCommand(QUndoCommand):
+    def __init__(self, document):
+        super().__init__("清除标注")
+        self.document = document
+        self.records = list(document.records)
+
+    def undo(self):
+        for record in self.records:
+            self.document.add(record)
+
+    def redo(self):
+        for record in self.records:
+            self.document.remove(record)
+
+
+class AnnotationHistory:
+    """
+    所有图像的标注,每张图像一个撤销栈,由 QUndoGroup 切换当前的撤销栈.
+    有持久化存储时,标注在第一次预览图像时读取,修改后由 save_dirty 写入.
+    标注记录的总大小超过上限时,清除最久没有查看的图像的撤销历史,
+    已经保存的标注同时从内存中移除,再次预览时重新读取
+    """
+
+    def __init__(self, undo_group, store=None, on_change=None, undo_limit=UNDO_LIMIT, max_bytes=MAX_HISTORY_BYTES):
+        """
+        :param undo_group: QUndoGroup
+        :param store: AnnotationStore,为 None 时标注只保存在内存中
+        :param on_change: 标注变化时的回调,用于延迟保存
+        :param undo_limit: 每张图像最多保留的撤销步数
+        :param max_bytes: 标注记录占用的内存上限
+        """
+        self.undo_group = undo_group
+        self.store = store
+        self.on_change = on_change
+        self.undo_limit = undo_limit
+        self.max_bytes = max_bytes
+        # 图像路径 -> AnnotationDocument,按最近查看排序
+        self.documents = OrderedDict()
+        # 修改之后还没有保存的图像路径
+        self.dirty = set()
+
+    def get(self, path):
+        return self.documents.get(path)
+
+    def activate(self, path, size):
+        """
+        切换到某张图像的标注,没有时从存储中读取或者创建
+        :param path: 图像路径
+        :param size: 原图尺寸 QSize,已经保存的标注使用保存时的尺寸
+        :return: AnnotationDocument
+        """
+        document = self.documents.get(path)
+        if document is None:
+            loaded = self.store.load(path) if self.store is not None else None
+            records = None
+            if loaded is not None:
+                size, records = loaded
+            document = AnnotationDocument(path, size, self.undo_limit, records)
+            document.on_change = lambda: self._mark_dirty(path)
+            self.undo_group.addStack(document.stack)
+            self.documents[path] = document
+        self.documents.move_to_end(path)
+        self.undo_group.setActiveStack(document.stack)
+        self.trim()
+        return document
+
+    def _mark_dirty(self, path):
+        self.dirty.add(path)
+        if self.on_change is not None:
+            self.on_change()
+
+    def _save(self, path):
+        self.dirty.discard(path)
+        document = self.documents.get(path)
+        if self.store is not None and document is not None:
+            self.store.save(path, document.size, document.records)
+
+    def save_dirty(self):
+        """
+        把修改过的标注交给存储在后台写入
+        :return:
+        """
+        for path in list(self.dirty):
+            self._save(path)
+
+    def trim(self):
+        """
+        按最近查看的顺序清理撤销历史以及已经保存的标注,当前图像除外
+        :return:
+        """
+        total = self.nbytes()
+        for path in list(self.documents)[:-1]:
+            if total <= self.max_bytes:
+                break
+            document = self.documents[path]
+            # 已经撤销的记录只被撤销栈引用,清除撤销栈后释放
+            total -= document.nbytes()
+            document.clear_history()
+            if self.store is not None or not document.records:
+                if path in self.dirty:
+                    self._save(path)
+                self._unload(path)
+            else:
+                total += document.nbytes()
+
+    def _unload(self, path):
+        document = self.documents.pop(path, None)
+        if document is not None:
+            self.undo_group.removeStack(document.stack)
+            document.clear_history()
+
+    def discard(self, path):
+        """
+        丢弃一张图像的标注(例如图像被删除),包括已经保存的标注
+        :param path:
+        :return:
+        """
+        self._unload(path)
+        self.dirty.discard(path)
+        if self.store is not None:
+            self.store.delete(path)
+
+    def nbytes(self):
+        return sum(document.nbytes() for document in self.documents.values())
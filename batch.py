@@ -0,0 +1,266 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 17:30
+"""
+无界面的批量缩略图/预览图生成工具,
+结果写入与 GUI 相同的磁盘缓存,可以在没有显示器的服务器上预先生成;
+也可以把 GUI 中保存的标注批量绘制到原图上导出
+
+用法:
+    python batch.py 图像目录 [图像目录 ...] [--workers 8] [--edges 128 160] [--preview-edges 1024] [--max-bytes 4g]
+    python batch.py 图像目录 [图像目录 ...] --burn-in 输出目录 [--quality 90]
+"""
+import os
+
+# 必须在导入 PySide6 之前设置,保证在没有显示器的环境中可以运行
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PySide6.QtCore import Qt, QBuffer, QByteArray, QIODevice, QSize
+from PySide6.QtGui import QGuiApplication, QImageReader
+
+from annotation_store import AnnotationStore
+from annotations import decode_records, render_annotated
+from thumbnail_store import ThumbnailStore
+from util import PREVIEW_EDGES, THUMBNAIL_EDGE_BUCKETS, get_supported_img_suffix_list, iter_image_files, \
+    load_scaled_image
+
+# 每个进程中的 QGuiApplication 实例
+_app = None
+# 主进程中已经创建了 QGuiApplication 和缓存的写入线程,fork 出的子进程会继承它们的状态(锁可能处于持有状态),
+# 进程池使用 spawn 启动全新的进程
+_mp_context = multiprocessing.get_context("spawn")
+
+
+def _init_process():
+    """
+    进程池中每个进程的初始化,图像插件需要 QGuiApplication
+    :return:
+    """
+    global _app
+    if QGuiApplication.instance() is None:
+        _app = QGuiApplication([])
+
+
+def _encode(img, image_format):
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    img.save(buffer, image_format)
+    buffer.close()
+    return data.data()
+
+
+def process_image(path, edges, image_format="PNG"):
+    """
+    在子进程中生成一张图像的全部尺寸,只解码一次(按最大尺寸),
+    更小的尺寸由最大尺寸缩放得到,缩放规则与 GUI 相同(保持宽高比)
+    :param path: 图像路径
+    :param edges: 需要生成的边长列表
+    :param image_format: 编码格式
+    :return: (图像路径, [(缓存 key, 编码后的数据), ...], 错误信息)
+    """
+    edges = sorted(edges, reverse=True)
+    img = load_scaled_image(path, edges[0], edges[0])
+    if img.isNull():
+        return path, [], "解码失败"
+    entries = []
+    for edge in edges:
+        if edge != edges[0]:
+            img = img.scaled(edge, edge, Qt.AspectRatioMode.KeepAspectRatio,
+                             Qt.TransformationMode.SmoothTransformation)
+        entries.append((ThumbnailStore.make_key(path, edge), _encode(img, image_format)))
+    return path, entries, None
+
+
+def _process_job(args):
+    return process_image(*args)
+
+
+def parse_size(value):
+    """
+    解析带单位的字节数,例如 512m, 4g
+    :param value:
+    :return: 字节数
+    """
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    value = value.strip().lower().rstrip("b")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的大小: {value}")
+
+
+def run(dirs, edges, workers=None, db_path=None, force=False, max_bytes=None):
+    """
+    批量生成缩略图和预览图
+    :param dirs: 图像目录列表
+    :param edges: 需要生成的边长列表
+    :param workers: 进程数,默认为 CPU 核数
+    :param db_path: 缓存文件路径,默认与 GUI 相同
+    :param force: 是否重新生成已经缓存的图像
+    :param max_bytes: 缓存容量上限,为 0 时不淘汰,为 None 时保持缓存当前的上限.
+        修改后的上限保存在缓存文件中,GUI 也使用同样的上限,预生成的结果不会在 GUI 读取之前被淘汰
+    :return: 运行统计
+    """
+    suffixes = set(get_supported_img_suffix_list())
+    store = ThumbnailStore(db_path)
+    if store.db_path == ":memory:":
+        # 缓存文件无法打开时生成的结果无法保存,不需要继续
+        store.close()
+        raise RuntimeError("缩略图缓存文件无法打开")
+    if max_bytes is not None:
+        store.set_max_bytes(max_bytes)
+    summary = {"images": 0, "skipped": 0, "failed": 0, "bytes_written": 0, "evicted": 0, "failures": []}
+    start = time.perf_counter()
+
+    def jobs():
+        for directory in dirs:
+            for path in iter_image_files(directory, suffixes):
+                todo = [edge for edge in edges if force or not store.contains(store.make_key(path, edge))]
+                if todo:
+                    yield path, todo
+                else:
+                    summary["skipped"] += 1
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context, initializer=_init_process) as executor:
+        for path, entries, error in executor.map(_process_job, jobs(), chunksize=16):
+            if error:
+                summary["failed"] += 1
+                summary["failures"].append({"path": path, "error": error})
+                continue
+            summary["images"] += 1
+            for key, data in entries:
+                store.put_encoded(key, data)
+                summary["bytes_written"] += len(data)
+    store.close()
+    summary["evicted"] = store.evicted
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 3)
+    summary["images_per_second"] = round(summary["images"] / elapsed, 2) if elapsed > 0 else 0.0
+    return summary
+
+
+def burn_in_image(path, output_path, width, height, data, quality=-1):
+    """
+    在子进程中把标注绘制到原图上并保存
+    :param path: 图像路径
+    :param output_path: 保存路径
+    :param width: 标注坐标对应的原图宽度
+    :param height: 标注坐标对应的原图高度
+    :param data: 序列化后的标注
+    :param quality: 有损格式的质量 0-100, -1 表示默认
+    :return: (图像路径, 错误信息)
+    """
+    if os.path.abspath(output_path) == os.path.abspath(path):
+        return path, "输出路径与原图相同"
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    image = reader.read()
+    if image.isNull():
+        return path, f"解码失败: {reader.errorString()}"
+    image = render_annotated(image, decode_records(data), QSize(width, height))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if not image.save(output_path, None, quality):
+        return path, "保存失败"
+    return path, None
+
+
+def _burn_in_job(args):
+    return burn_in_image(*args)
+
+
+def burn_in(dirs, output_dir, workers=None, db_path=None, quality=-1):
+    """
+    把目录中有标注的图像批量导出,输出目录中保持与原目录相同的相对路径
+    :param dirs: 图像目录列表
+    :param output_dir: 输出目录
+    :param workers: 进程数,默认为 CPU 核数
+    :param db_path: 标注文件路径,默认与 GUI 相同
+    :param quality: 有损格式的质量 0-100, -1 表示默认
+    :return: 运行统计
+    """
+    store = AnnotationStore(db_path)
+    summary = {"images": 0, "failed": 0, "failures": []}
+    start = time.perf_counter()
+
+    def jobs():
+        for directory in dirs:
+            root = os.path.abspath(directory)
+            for path in store.paths(root):
+                row = store.load_encoded(path)
+                if row is not None:
+                    yield (path, os.path.join(output_dir, os.path.relpath(path, root)), *row, quality)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context, initializer=_init_process) as executor:
+        for path, error in executor.map(_burn_in_job, jobs(), chunksize=4):
+            if error:
+                summary["failed"] += 1
+                summary["failures"].append({"path": path, "error": error})
+            else:
+                summary["images"] += 1
+    store.close()
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 3)
+    summary["images_per_second"] = round(summary["images"] / elapsed, 2) if elapsed > 0 else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量预生成缩略图和预览图")
+    parser.add_argument("dirs", nargs="+", help="图像目录")
+    parser.add_argument("--edges", nargs="+", type=int, default=list(THUMBNAIL_EDGE_BUCKETS[2:6]),
+                        help="缩略图边长")
+    parser.add_argument("--preview-edges", nargs="*", type=int, default=list(PREVIEW_EDGES[:1]),
+                        help="预览图边长")
+    parser.add_argument("--workers", type=int, default=None, help="进程数,默认为 CPU 核数")
+    parser.add_argument("--db", default=None, help="缓存文件路径,默认与 GUI 相同")
+    parser.add_argument("--force", action="store_true", help="重新生成已经缓存的图像")
+    parser.add_argument("--max-bytes", type=parse_size, default=None,
+                        help="缓存容量上限,支持 k/m/g 单位,0 表示不淘汰;保存在缓存中,GUI 也使用该上限")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出运行统计")
+    parser.add_argument("--burn-in", metavar="OUTPUT_DIR", default=None,
+                        help="把保存的标注绘制到原图上,导出到该目录(不生成缩略图)")
+    parser.add_argument("--quality", type=int, default=-1, help="导出 JPEG 等有损格式时的质量 0-100")
+    parser.add_argument("--annotations-db", default=None, help="标注文件路径,默认与 GUI 相同")
+    args = parser.parse_args(argv)
+
+    _init_process()
+    if args.burn_in:
+        summary = burn_in(args.dirs, args.burn_in, args.workers, args.annotations_db, args.quality)
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False, indent=2))
+        else:
+            print(f"导出 {summary['images']} 张, 失败 {summary['failed']} 张, "
+                  f"耗时 {summary['seconds']} 秒, {summary['images_per_second']} 张/秒")
+            for failure in summary["failures"]:
+                print(f"  失败: {failure['path']} ({failure['error']})")
+        return 0 if summary["failed"] == 0 else 1
+
+    summary = run(args.dirs, sorted(set(args.edges + args.preview_edges)), args.workers, args.db, args.force,
+                  args.max_bytes)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"完成 {summary['images']} 张, 跳过 {summary['skipped']} 张, 失败 {summary['failed']} 张, "
+              f"写入 {summary['bytes_written'] / 1024 / 1024:.1f} MB, "
+              f"耗时 {summary['seconds']} 秒, {summary['images_per_second']} 张/秒")
+        if summary["evicted"]:
+            print(f"超出缓存容量上限,淘汰了 {summary['evicted']} 条缓存,可以用 --max-bytes 调大上限")
+        for failure in summary["failures"]:
+            print(f"  失败: {failure['path']} ({failure['error']})")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
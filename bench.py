@@ -0,0 +1,381 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 19:50
+"""
+无界面的性能基准测试,覆盖加载/缩放/切换/绘制/保存等主要路径,
+结果以 JSON 输出,便于比较不同版本之间的性能变化
+
+用法:
+    python bench.py [--count 200] [--size 4000x3000] [--formats jpg png] [--output result.json]
+    python bench.py --compare 上一次的结果.json
+"""
+import os
+
+# 必须在导入 PySide6 之前设置,保证在没有显示器的环境中可以运行
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块
+    resource = None
+
+import PySide6
+from PySide6.QtCore import Qt, QEventLoop, QPoint, QPointF, QStandardPaths
+from PySide6.QtGui import QColor, QImage, QLinearGradient, QPainter
+from PySide6.QtTest import QTest
+from PySide6.QtWidgets import QApplication
+
+# 基准测试使用独立的缓存目录,不影响也不受用户已有缓存的影响
+QStandardPaths.setTestModeEnabled(True)
+
+from q_thread import ExportWorker, ImageWorker
+from thumbnail_store import ThumbnailStore
+from util import get_cache_dir, get_data_dir
+
+
+def peak_rss_kb():
+    """
+    进程的峰值常驻内存(KB),不支持的平台返回 None
+    :return:
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上的单位是字节,Linux 上是 KB
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def summarize(samples_ms):
+    """
+    汇总耗时样本
+    :param samples_ms: 每次的耗时(毫秒)
+    :return:
+    """
+    ordered = sorted(samples_ms)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def wait_until(predicate, timeout=60.0):
+    """
+    处理事件直到条件满足
+    :param predicate: 无参数的判断函数
+    :param timeout: 超时时间(秒)
+    :return: 条件是否满足
+    """
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        QApplication.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 10)
+    return True
+
+
+def make_corpus(directory, count, width, height, formats, seed=0):
+    """
+    生成合成图像(渐变背景加随机图形,压缩特性接近照片),已经存在的文件直接复用
+    :param directory: 输出目录
+    :param count: 图像数量
+    :param width: 宽度
+    :param height: 高度
+    :param formats: 图像格式列表,按顺序轮流使用
+    :param seed: 随机种子
+    :return: 图像路径列表
+    """
+    os.makedirs(directory, exist_ok=True)
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        path = os.path.join(directory, f"img_{i:05d}_{width}x{height}.{fmt}")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        img = QImage(width, height, QImage.Format.Format_RGB32)
+        painter = QPainter(img)
+        gradient = QLinearGradient(0, 0, width, height)
+        gradient.setColorAt(0, QColor.fromHsv(rnd.randrange(360), 160, 230))
+        gradient.setColorAt(1, QColor.fromHsv(rnd.randrange(360), 200, 90))
+        painter.fillRect(img.rect(), gradient)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        for _ in range(40):
+            painter.setBrush(QColor(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 160))
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.drawEllipse(QPointF(rnd.uniform(0, width), rnd.uniform(0, height)),
+                                rnd.uniform(width / 40, width / 6), rnd.uniform(height / 40, height / 6))
+        painter.end()
+        img.save(path, None, 90)
+    return paths
+
+
+def bench_worker(paths, edge, store):
+    """
+    ImageWorker 吞吐量
+    :return:
+    """
+    worker = ImageWorker(edge, store=store)
+    worker.start()
+    start = time.perf_counter()
+    worker.request(list(enumerate(paths)))
+    wait_until(lambda: not worker.flush_timer.isActive())
+    elapsed = time.perf_counter() - start
+    worker.stop()
+    worker.wait()
+    return {"images": len(paths), "seconds": round(elapsed, 3),
+            "images_per_second": round(len(paths) / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+def bench_resized_img(browser, paths):
+    """
+    get_resized_img 冷启动(解码)/热启动(缓存命中)
+    :return:
+    """
+    width, height = browser._preview_size()
+    browser.img_resize_cache.clear()
+    results = {}
+    for name in ("cold", "warm"):
+        samples = []
+        for path in paths:
+            start = time.perf_counter()
+            browser.get_resized_img("preview", path, width, height)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = summarize(samples)
+    results["preview_size"] = [width, height]
+    return results
+
+
+def bench_resize(browser, widths, height):
+    """
+    窗口尺寸变化后重新加载缩略图(从调用 onResizeSettled 到可见缩略图全部加载完成)
+    :return:
+    """
+    samples, edges = [], []
+    for width in widths:
+        browser.resize(width, height)
+        QApplication.processEvents()
+        browser.resize_timer.stop()
+        start = time.perf_counter()
+        browser.onResizeSettled()
+        QApplication.processEvents()
+        wait_until(lambda: not browser.worker.flush_timer.isActive())
+        samples.append((time.perf_counter() - start) * 1000)
+        edges.append(browser.worker.edge)
+    return {**summarize(samples), "thumbnail_edges": edges}
+
+
+def bench_navigate(browser, count, dwell_ms):
+    """
+    切换预览图,每次切换之后停留一段时间,让后台预加载有机会完成
+    :return:
+    """
+    samples = []
+    # 之前的测试(预览图缩放)也会经过预加载器,只统计本次切换的命中率
+    browser.prefetcher.hits = browser.prefetcher.misses = 0
+    for row in range(min(count, browser.thumbnailModel.rowCount())):
+        start = time.perf_counter()
+        browser.selectRow(row)
+        samples.append((time.perf_counter() - start) * 1000)
+        deadline = time.perf_counter() + dwell_ms / 1000
+        wait_until(lambda: time.perf_counter() > deadline)
+    return {**summarize(samples), "prefetch_hit_rate": round(browser.prefetcher.hit_rate(), 3)}
+
+
+def bench_strokes(browser, strokes, points, seed=0):
+    """
+    在预览区绘制画笔轨迹,以及绘制完成后整个场景的重绘耗时
+    :return:
+    """
+    rnd = random.Random(seed)
+    view = browser.imagePreviewView
+    viewport = view.viewport()
+    width, height = viewport.width(), viewport.height()
+    samples = []
+    for _ in range(strokes):
+        browser.show_painter(True)
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        start = time.perf_counter()
+        QTest.mousePress(viewport, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.NoModifier, QPoint(int(x), int(y)))
+        for _ in range(points):
+            x = min(max(x + rnd.uniform(-8, 8), 0), width - 1)
+            y = min(max(y + rnd.uniform(-8, 8), 0), height - 1)
+            QTest.mouseMove(viewport, QPoint(int(x), int(y)))
+        QTest.mouseRelease(viewport, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.NoModifier,
+                           QPoint(int(x), int(y)))
+        samples.append((time.perf_counter() - start) * 1000)
+
+    scene = browser.imagePreviewScene
+    rect = scene.sceneRect()
+    target = QImage(int(rect.width()), int(rect.height()), QImage.Format.Format_ARGB32_Premultiplied)
+    repaint = []
+    for _ in range(5):
+        painter = QPainter(target)
+        start = time.perf_counter()
+        scene.render(painter)
+        painter.end()
+        repaint.append((time.perf_counter() - start) * 1000)
+    return {"insert": summarize(samples), "repaint": summarize(repaint), "points_per_stroke": points}
+
+
+def bench_save(browser, output_dir):
+    """
+    导出当前预览图(标注回放到原图后编码),分别测试 JPEG 和 PNG
+    :return:
+    """
+    annotations, image_size = browser.record_annotations()
+    results = {}
+    for name, suffix, quality, compression in (("jpeg_q90", "jpg", 90, -1), ("png_c6", "png", -1, 6)):
+        output_path = os.path.join(output_dir, f"export.{suffix}")
+        messages = []
+        worker = ExportWorker(browser.currentPreviewImagePath, annotations, image_size, output_path,
+                              quality, compression)
+        worker.export_finished.connect(lambda ok, message: messages.append((ok, message)))
+        start = time.perf_counter()
+        # 直接在当前线程中执行,只测量合成以及编码的耗时
+        worker.run()
+        elapsed = time.perf_counter() - start
+        ok = bool(messages and messages[0][0])
+        results[name] = {"ok": ok, "ms": round(elapsed * 1000, 3),
+                         "bytes": os.path.getsize(output_path) if ok else 0}
+    return results
+
+
+def run(args):
+    from img_browser import ImageBrowser
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    corpus_dir = args.corpus or os.path.join(tempfile.gettempdir(), "hh_img_browser_bench")
+    work_dir = tempfile.mkdtemp(prefix="hh_img_browser_bench_")
+    # 清空测试模式下的缓存目录以及上次测试保存的标注,保证冷启动的测量结果
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+    shutil.rmtree(get_data_dir(), ignore_errors=True)
+
+    results = {}
+    rss = {}
+    start = time.perf_counter()
+    paths = make_corpus(corpus_dir, args.count, width, height, args.formats)
+    results["corpus_seconds"] = round(time.perf_counter() - start, 3)
+    rss["corpus"] = peak_rss_kb()
+
+    store = ThumbnailStore(os.path.join(work_dir, "bench.db"))
+    results["worker_no_cache"] = bench_worker(paths, args.edge, None)
+    results["worker_cold_store"] = bench_worker(paths, args.edge, store)
+    store.flush()
+    results["worker_warm_store"] = bench_worker(paths, args.edge, store)
+    store.close()
+    rss["worker"] = peak_rss_kb()
+
+    browser = ImageBrowser()
+    browser.resize(1280, 800)
+    browser.show()
+    QApplication.processEvents()
+    results["get_resized_img"] = bench_resized_img(browser, paths[:args.samples])
+    rss["get_resized_img"] = peak_rss_kb()
+
+    browser.loadImages(paths)
+    wait_until(lambda: not browser.worker.flush_timer.isActive())
+    results["resize_thumbnails"] = bench_resize(browser, [960, 1600, 1280, 2200, 1280], 800)
+    rss["resize_thumbnails"] = peak_rss_kb()
+
+    results["navigate"] = bench_navigate(browser, args.samples, args.dwell)
+    rss["navigate"] = peak_rss_kb()
+
+    browser.selectRow(0)
+    browser.show_tool_bar()
+    results["strokes"] = bench_strokes(browser, args.strokes, args.stroke_points)
+    rss["strokes"] = peak_rss_kb()
+
+    results["save"] = bench_save(browser, work_dir)
+    rss["save"] = peak_rss_kb()
+
+    browser.close()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "pyside6": PySide6.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+        "peak_rss_kb": rss,
+    }
+
+
+def compare(old, new, prefix=""):
+    """
+    对比两次运行中的耗时指标
+    :param old: 旧结果
+    :param new: 新结果
+    :param prefix:
+    :return: 输出的行列表
+    """
+    lines = []
+    for key, value in new.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            lines.extend(compare(old[key], value, name + "."))
+        elif key in ("mean_ms", "p95_ms", "ms", "seconds", "images_per_second") and old.get(key):
+            change = (value - old[key]) / old[key] * 100
+            lines.append(f"{name:<50} {old[key]:>12} -> {value:>12} ({change:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图像浏览器性能基准测试")
+    parser.add_argument("--count", type=int, default=200, help="合成图像数量")
+    parser.add_argument("--size", default="4000x3000", help="合成图像尺寸 宽x高")
+    parser.add_argument("--formats", nargs="+", default=["jpg"], help="合成图像格式,按顺序轮流使用")
+    parser.add_argument("--corpus", default=None, help="合成图像目录,已有的图像会被复用")
+    parser.add_argument("--edge", type=int, default=128, help="缩略图边长")
+    parser.add_argument("--samples", type=int, default=20, help="预览图缩放/切换的测试张数")
+    parser.add_argument("--dwell", type=int, default=100, help="每次切换预览图后停留的时间(毫秒)")
+    parser.add_argument("--strokes", type=int, default=20, help="绘制的画笔轨迹数量")
+    parser.add_argument("--stroke-points", type=int, default=200, help="每条轨迹的点数")
+    parser.add_argument("--output", default=None, help="结果输出文件,默认输出到标准输出")
+    parser.add_argument("--compare", default=None, help="与之前的结果文件对比")
+    args = parser.parse_args(argv)
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fin:
+            baseline = json.load(fin)
+    # 图标等资源使用相对路径
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    app = QApplication.instance() or QApplication([])
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fout:
+            fout.write(text)
+    else:
+        print(text)
+    if baseline is not None:
+        print("\n".join(compare(baseline.get("results", {}), report["results"])), file=sys.stderr)
+    app.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
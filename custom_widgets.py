@@ -4,10 +4,16 @@
 """
 自定义相关控件
 """
-from PySide6.QtCore import Signal, Qt, QSize, QPointF, QLineF, QRectF
-from PySide6.QtGui import QPainter, QPen, QIcon, QUndoCommand, QPainterPath, QTextCursor
-from PySide6.QtWidgets import QLabel, QPushButton, QGraphicsView, QGraphicsLineItem, QGraphicsPathItem, \
-    QGraphicsTextItem
+from PySide6.QtCore import Signal, Qt, QSize, QPointF, QRectF, QRect, QPoint
+from PySide6.QtGui import QPainter, QPen, QIcon, QPainterPath, QPainterPathStroker, QTextCursor, QColor, QFont, \
+    QPolygonF
+from PySide6.QtWidgets import QPushButton, QGraphicsView, QGraphicsPathItem, QGraphicsTextItem, QListView, \
+    QStyledItemDelegate, QWidget
+
+import perf
+from annotations import AddStrokeCommand, AddTextCommand, StrokeRecord, TextRecord
+from thumbnail_model import ThumbnailListModel
+from util import simplify_points
 
 
 class MyPushButton(QPushButton):
@@ -26,61 +32,207 @@ class MyPushButton(QPushButton):
         super().resizeEvent(event)
 
 
-class ClickableImgLabel(QLabel):
+class ThumbnailDelegate(QStyledItemDelegate):
+    """
+    缩略图绘制代理,选中状态从模型的 SelectedRole 中读取
+    """
+    # 缩略图四周的留白
+    PADDING = 5
+
+    def sizeHint(self, option, index):
+        # 显示尺寸跟随视图宽度,解码尺寸(模型中的 edge)只在尺寸稳定后按档位更新
+        edge = self.parent().thumbnail_edge() + 2 * self.PADDING
+        return QSize(edge, edge)
+
+    def paint(self, painter, option, index):
+        rect = option.rect.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        target = rect
+        if pixmap is None:
+            # 还没有加载完成的缩略图显示占位色块
+            painter.fillRect(rect, QColor(235, 235, 235))
+        elif not pixmap.isNull():
+            size = pixmap.size()
+            if size.width() > rect.width() or size.height() > rect.height():
+                size = size.scaled(rect.size(), Qt.AspectRatioMode.KeepAspectRatio)
+            target = QRect(QPoint(0, 0), size)
+            target.moveCenter(rect.center())
+            painter.save()
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawPixmap(target, pixmap)
+            painter.restore()
+        if index.data(ThumbnailListModel.SelectedRole):
+            painter.save()
+            painter.setPen(QPen(Qt.gray, 3))
+            painter.drawRect(target.adjusted(1, 1, -1, -1))
+            painter.restore()
+
+
+class ThumbnailListView(QListView):
     """
-    可点击的 图像 QLabel
+    缩略图列表视图,滚动或者尺寸变化时发送当前可见的行范围
     """
-    # 定义一个点击事件的信号
-    clicked = Signal(str)
+    # (第一个可见行, 最后一个可见行)
+    visible_range_changed = Signal(int, int)
 
-    def __init__(self, path, *args, **kwargs):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setItemDelegate(ThumbnailDelegate(self))
+        # 所有行尺寸一致,视图不需要逐行计算尺寸
+        self.setUniformItemSizes(True)
+        # 视图宽度变化时重新排列,缩略图显示尺寸跟随宽度
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setVerticalScrollMode(QListView.ScrollMode.ScrollPerPixel)
+        self.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        # 滚动条一直显示,避免滚动条出现/消失导致缩略图尺寸来回变化
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.verticalScrollBar().valueChanged.connect(self.emit_visible_range)
+
+    def thumbnail_edge(self):
         """
-        :param path: 图像路径
-        :param args:
-        :param kwargs:
+        根据视图宽度计算缩略图边长
+        :return:
         """
-        super(ClickableImgLabel, self).__init__(*args, **kwargs)
-        self.path = path
-        self._is_selected = False
-        self.setFrameShape(QLabel.Box)
-        self.setLineWidth(0)
+        return max(self.viewport().width() - 2 * ThumbnailDelegate.PADDING, 1)
 
-    def mousePressEvent(self, event):
-        # 当鼠标点击时，发送 图像路径 作为信号
-        self.clicked.emit(self.path)
-        if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
-            self._is_selected = not self._is_selected
-            self.update()
+    def visible_range(self):
+        """
+        当前可见的行范围
+        :return: (first, last),没有数据时 last < first
+        """
+        model = self.model()
+        if model is None or model.rowCount() == 0:
+            return 0, -1
+        row_height = max(self.sizeHintForRow(0) + self.spacing(), 1)
+        top = self.verticalScrollBar().value()
+        first = top // row_height
+        last = (top + self.viewport().height()) // row_height
+        return first, min(last, model.rowCount() - 1)
 
-    def mouseReleaseEvent(self, event):
-        if event.button() in (Qt.LeftButton, Qt.RightButton):
-            self._is_selected = not self._is_selected
-            self.update()
-
-    def _update_line_width(self, width=4):
-        if self._is_selected:
-            self.setLineWidth(width)
-            # 更改样式
-            painter = QPainter(self)
-            pen = QPen(Qt.gray, 3)  # Change "Qt.black" to "Qt.gray"
-            painter.setPen(pen)
-            painter.drawRect(self.rect().adjusted(1, 1, -1, -1))
-        else:
-            self.setLineWidth(0)
+    def emit_visible_range(self):
+        self.visible_range_changed.emit(*self.visible_range())
+
+    @perf.timed("thumbnails.paint", "paint")
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.emit_visible_range()
+
+
+class HistogramWidget(QWidget):
+    """
+    直方图显示,亮度为灰色填充, R/G/B 为半透明折线
+    """
+    COLORS = (QColor(220, 50, 50, 160), QColor(50, 180, 50, 160), QColor(50, 90, 220, 160))
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumSize(256, 100)
+        self.counts = None
+
+    def set_histogram(self, counts):
+        """
+        :param counts: (4, 256) 的数组,依次为 R, G, B, 亮度,为 None 时清空
+        :return:
+        """
+        self.counts = None if counts is None else [list(map(float, channel)) for channel in counts]
+        self.update()
+
+    def _points(self, channel, scale):
+        width, height = self.width(), self.height()
+        return [QPointF(i * width / 255, height - value * scale) for i, value in enumerate(channel)]
 
     def paintEvent(self, event):
-        QLabel.paintEvent(self, event)
-        self._update_line_width()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(250, 250, 250))
+        if not self.counts:
+            return
+        # 开平方压缩纵轴,避免纯色区域的尖峰把其它部分压平
+        peak = max(max(channel) for channel in self.counts) ** 0.5 or 1
+        counts = [[value ** 0.5 for value in channel] for channel in self.counts]
+        scale = (self.height() - 2) / peak
+        height = self.height()
+        luma = self._points(counts[3], scale)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(150, 150, 150))
+        painter.drawPolygon(QPolygonF([QPointF(0, height)] + luma + [QPointF(self.width(), height)]))
+        painter.setBrush(Qt.NoBrush)
+        for color, channel in zip(self.COLORS, counts[:3]):
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF(self._points(channel, scale)))
+
+
+class StrokeItem(QGraphicsPathItem):
+    """
+    一笔画笔轨迹,绘制过程中增量扩展同一条 QPainterPath,
+    包围盒随新增的点增量更新,结束绘制时再对轨迹点做简化
+    """
+    # 轨迹简化的默认容差
+    SIMPLIFY_EPSILON = 0.5
+
+    def __init__(self, start_point, pen, parent=None):
+        """
+        :param start_point: 起点 QPointF
+        :param pen: 画笔
+        :param parent:
+        """
+        super().__init__(parent)
+        self.setPen(pen)
+        self.points = [(start_point.x(), start_point.y())]
+        self._path = QPainterPath(start_point)
+        self._min_x = self._max_x = start_point.x()
+        self._min_y = self._max_y = start_point.y()
 
-    @property
-    def is_selected(self):
-        return self._is_selected
+    def add_point(self, point):
+        """
+        在轨迹末尾追加一个点
+        :param point: QPointF
+        :return:
+        """
+        x, y = point.x(), point.y()
+        last_x, last_y = self.points[-1]
+        if not (self._min_x <= x <= self._max_x and self._min_y <= y <= self._max_y):
+            # 只有包围盒变大时才需要更新场景索引
+            self.prepareGeometryChange()
+            self._min_x, self._max_x = min(self._min_x, x), max(self._max_x, x)
+            self._min_y, self._max_y = min(self._min_y, y), max(self._max_y, y)
+        self.points.append((x, y))
+        self._path.lineTo(point)
+        # 只重绘新增线段所在的区域
+        half = self.pen().widthF() / 2 + 1
+        self.update(QRectF(min(x, last_x) - half, min(y, last_y) - half,
+                           abs(x - last_x) + 2 * half, abs(y - last_y) + 2 * half))
 
-    @is_selected.setter
-    def is_selected(self, value):
-        self._is_selected = value
+    def finish(self, epsilon=SIMPLIFY_EPSILON):
+        """
+        结束绘制,使用 Ramer–Douglas–Peucker 算法简化轨迹点
+        :param epsilon: 简化的容差(图形项坐标)
+        :return:
+        """
+        self.prepareGeometryChange()
+        self.points = simplify_points(self.points, epsilon)
+        self._path = QPainterPath(QPointF(*self.points[0]))
+        for x, y in self.points[1:]:
+            self._path.lineTo(x, y)
+        self.setPath(self._path)
         self.update()
 
+    def boundingRect(self):
+        half = self.pen().widthF() / 2 + 1
+        return QRectF(self._min_x - half, self._min_y - half,
+                      self._max_x - self._min_x + 2 * half, self._max_y - self._min_y + 2 * half)
+
+    def shape(self):
+        stroker = QPainterPathStroker(self.pen())
+        return stroker.createStroke(self._path)
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(self.pen())
+        painter.drawPath(self._path)
+
 
 class PaintGraphicsView(QGraphicsView):
     """
@@ -92,79 +244,82 @@ class PaintGraphicsView(QGraphicsView):
         self.parent = parent
         self.last_point = QPointF()
         self.pen = QPen(Qt.red, 1)
-        self.items = []  # 保存临时的线段对象
+        self.stroke_item = None  # 正在绘制的画笔轨迹
+        self.text_item = None  # 正在添加的文本框
+        self.edit_layer = None  # 正在绘制的标注图层
+
+    @perf.timed("preview.paint", "paint")
+    def paintEvent(self, event):
+        super().paintEvent(event)
 
     def mousePressEvent(self, event):
-        if self.parent.text_edit_button.isChecked():
-            self.initial_point = self.mapToScene(event.pos())
-            self.text_item = QGraphicsTextItem()
+        mode = self.parent.edit_mode()
+        # 标注直接画在预览图的标注图层上,图层内使用原图像素坐标
+        layer = self.parent.annotation_layer
+        if layer is None:
+            return
+        if mode == "text":
+            self.edit_layer = layer
+            self.initial_point = layer.mapFromScene(self.mapToScene(event.pos()))
+            self.text_item = QGraphicsTextItem(layer)
             self.text_item.setPlainText("请输入文字")
-            self.text_item.setFont(self.parent.text_edit_font)
+            # 字号换算到原图像素坐标,保证在屏幕上的大小不变
+            font = QFont(self.parent.text_edit_font)
+            font.setPointSizeF(font.pointSizeF() / layer.scale())
+            self.text_item.setFont(font)
             self.text_item.setDefaultTextColor(self.parent.text_edit_color)
             self.text_item.setPos(self.initial_point)
-            self.scene().addItem(self.text_item)
             self.text_item.setFocus()  # 使文本框获得焦点以便用户直接输入文本
             # 移动光标到最后
             text_cursor = self.text_item.textCursor()
             text_cursor.movePosition(QTextCursor.End)
             self.text_item.setTextCursor(text_cursor)
-        elif self.parent.color_painter_button.isChecked():
+        elif mode == "painter":
+            self.edit_layer = layer
             self.last_point = self.mapToScene(event.pos())
+            pen = QPen(self.pen)
+            pen.setWidthF(pen.widthF() / layer.scale())
+            # 每一笔只创建一个图形项
+            self.stroke_item = StrokeItem(layer.mapFromScene(self.last_point), pen, layer)
+
+    def _is_editing(self):
+        # 绘制过程中预览图被刷新时,正在绘制的图形项已经随场景一起被清除
+        return self.edit_layer is not None and self.edit_layer is self.parent.annotation_layer
 
     def mouseMoveEvent(self, event):
-        if self.parent.text_edit_button.isChecked():
-            current_point = self.mapToScene(event.pos())
+        if not self._is_editing():
+            return
+        mode = self.parent.edit_mode()
+        if mode == "text" and self.text_item is not None:
+            current_point = self.edit_layer.mapFromScene(self.mapToScene(event.pos()))
             width = current_point.x() - self.initial_point.x()
             height = current_point.y() - self.initial_point.y()
             rect = QRectF(self.initial_point.x(), self.initial_point.y(), width, height)
             self.text_item.setTextInteractionFlags(Qt.TextInteractionFlag.TextEditorInteraction)  # make the text editable
             self.text_item.setPos(rect.topLeft())
             self.text_item.setTextWidth(rect.width())
-        elif self.parent.color_painter_button.isChecked():
+        elif mode == "painter" and self.stroke_item is not None:
             current_point = self.mapToScene(event.pos())
-            line = QGraphicsLineItem(QLineF(self.last_point, current_point))
-            line.setPen(self.pen)
-            self.scene().addItem(line)  # 实时添加线段到场景
-            self.items.append(line)  # 添加线段到列表
-            self.last_point = current_point
+            if current_point != self.last_point:
+                # 实时扩展画笔轨迹
+                self.stroke_item.add_point(self.edit_layer.mapFromScene(current_point))
+                self.last_point = current_point
 
     def mouseReleaseEvent(self, event):
-        if self.parent.text_edit_button.isChecked():
+        mode = self.parent.edit_mode()
+        if not self._is_editing():
+            self.text_item = self.stroke_item = self.edit_layer = None
+            return
+        document = self.edit_layer.document
+        if mode == "text" and self.text_item is not None:
             self.parent.select_text_edit(False)
-            command = AddTextCommand(self.scene(), self.text_item)
-            self.parent.undoStack.push(command)
-        elif self.parent.color_painter_button.isChecked():
+            # 文字记录随文本框的编辑同步更新
+            command = AddTextCommand(document, TextRecord.from_item(self.text_item), self.text_item)
+            document.stack.push(command)
+        elif mode == "painter" and self.stroke_item is not None:
             self.parent.show_painter(False)
-            # 创建一个新的 AddCommand 并添加到 undoStack
-            command = AddPainterCommand(self.scene(), self.items, self.pen)
-            self.parent.undoStack.push(command)
-            self.items = []  # 清空临时列表
-
-
-class AddPainterCommand(QUndoCommand):
-    def __init__(self, scene, items, pen):
-        super().__init__()
-        self.scene = scene
-        self.items = items  # 保存线段列表和画笔样式
-        self.pen = pen
-
-    def undo(self):
-        for item in self.items:
-            self.scene.removeItem(item)
-
-    def redo(self):
-        for item in self.items:
-            self.scene.addItem(item)
-
-
-class AddTextCommand(QUndoCommand):
-    def __init__(self, scene, text_item):
-        super().__init__()
-        self.scene = scene
-        self.text_item = text_item
-
-    def undo(self):
-        self.scene.removeItem(self.text_item)
-
-    def redo(self):
-        self.scene.addItem(self.text_item)
+            self.stroke_item.finish(StrokeItem.SIMPLIFY_EPSILON / self.edit_layer.scale())
+            # 只保存简化后的轨迹点,图形项可以随时由记录重新创建
+            record = StrokeRecord.from_points(self.stroke_item.points, self.stroke_item.pen())
+            document.stack.push(AddStrokeCommand(document, record, self.stroke_item))
+        self.text_item = self.stroke_item = self.edit_layer = None
@@ -0,0 +1,135 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 18:50
+"""
+基于感知哈希(dHash)的重复/相似图像查找
+"""
+import numpy as np
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage
+
+# 默认的相似阈值: 汉明距离不超过该值的两张图像视为相似
+DEFAULT_MAX_DISTANCE = 4
+
+# 0-255 每个字节中 1 的个数,numpy 没有 bitwise_count 时使用
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(img):
+    """
+    计算图像的 64 位 dHash: 缩放到 9x8 的灰度图,比较每行相邻像素的大小.
+    直接使用已经解码好的缩略图计算,不需要再次读取文件
+    :param img: QImage
+    :return: 64 位整数,图像无效时返回 None
+    """
+    if img is None or img.isNull():
+        return None
+    small = img.scaled(9, 8, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation) \
+        .convertToFormat(QImage.Format.Format_Grayscale8)
+    stride = small.bytesPerLine()
+    pixels = np.frombuffer(small.constBits(), dtype=np.uint8, count=stride * 8).reshape(8, stride)[:, :9]
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits.ravel()).view(">u8")[0])
+
+
+def popcount64(values):
+    """
+    向量化计算 uint64 数组中每个元素的 1 的个数
+    :param values: np.uint64 数组
+    :return:
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HashIndex:
+    """
+    图像哈希索引,哈希值保存在紧凑的 np.uint64 数组中.
+    查找相似图像时使用多索引哈希: 把 64 位哈希分成 max_distance + 1 段,
+    由抽屉原理,汉明距离不超过 max_distance 的两个哈希至少有一段完全相同,
+    因此只需要在每一段取值相同的桶内向量化地计算汉明距离,不需要两两比较全部图像
+    """
+
+    def __init__(self, capacity=1024):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        # 被删除的位置标记为无效
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.paths = []
+        # 图像路径 -> 数组中的位置
+        self._slots = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, path):
+        return path in self._slots
+
+    def add(self, path, value):
+        """
+        添加或者更新图像的哈希
+        :param path:
+        :param value: 64 位哈希
+        :return:
+        """
+        slot = self._slots.get(path)
+        if slot is None:
+            slot = len(self.paths)
+            if slot == len(self.hashes):
+                self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+                self.valid = np.concatenate([self.valid, np.zeros_like(self.valid)])
+            self.paths.append(path)
+            self._slots[path] = slot
+        self.hashes[slot] = value
+        self.valid[slot] = True
+
+    def remove(self, path):
+        slot = self._slots.pop(path, None)
+        if slot is not None:
+            self.valid[slot] = False
+
+    def find_groups(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        查找相似图像分组
+        :param max_distance: 最大汉明距离
+        :return: [[图像路径, ...], ...],按组内图像数量从多到少排列,每组至少两张
+        """
+        slots = np.flatnonzero(self.valid[:len(self.paths)])
+        if len(slots) < 2:
+            return []
+        hashes = self.hashes[slots]
+        parent = list(range(len(slots)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        chunks = max_distance + 1
+        shift = 0
+        for chunk in range(chunks):
+            width = 64 // chunks + (1 if chunk < 64 % chunks else 0)
+            keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            shift += width
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            # 排序后同一个桶内的元素相邻,依次比较间隔为 1, 2, ... 的元素对
+            offset = 1
+            while offset < len(order):
+                same = np.flatnonzero(sorted_keys[offset:] == sorted_keys[:-offset])
+                if len(same) == 0:
+                    break
+                left, right = order[same], order[same + offset]
+                close = popcount64(hashes[left] ^ hashes[right]) <= max_distance
+                for i, j in zip(left[close].tolist(), right[close].tolist()):
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[root_i] = root_j
+                offset += 1
+
+        groups = {}
+        for i in range(len(slots)):
+            groups.setdefault(find(i), []).append(self.paths[slots[i]])
+        return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
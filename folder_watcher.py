@@ -0,0 +1,188 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 18:10
+"""
+监视打开的文件夹,增量更新缩略图列表
+"""
+import os
+import time
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, QFileSystemWatcher, Signal
+
+from util import iter_image_files
+
+
+class DirectoryDiffTask(QRunnable):
+    """
+    在后台线程中重新扫描发生变化的目录,与上一次的快照比较
+    """
+
+    def __init__(self, watcher, dirty, snapshots, watched, since):
+        """
+        :param watcher: FolderWatcher
+        :param dirty: 发生变化的目录列表
+        :param snapshots: 这些目录的快照 目录 -> {图像路径: (mtime_ns, size) 或 None}
+        :param watched: 已经监视的目录集合
+        :param since: 开始监视的时间(ns),没有快照的文件修改时间晚于该时间时视为被修改
+        """
+        super().__init__()
+        self.watcher = watcher
+        self.dirty = dirty
+        self.snapshots = snapshots
+        self.watched = watched
+        self.since = since
+
+    def run(self):
+        suffixes = self.watcher.suffixes
+        # 目录 -> {图像路径: (mtime_ns, size)},为 None 表示目录已经被删除
+        result = {}
+        added, removed, modified = [], [], []
+        new_dirs = []
+        for directory in self.dirty:
+            old = self.snapshots.get(directory, {})
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                result[directory] = None
+                removed.extend(old)
+                continue
+            current = {}
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.watched:
+                            # 新建的子目录,递归扫描其中的图像
+                            for path in iter_image_files(entry.path, suffixes, True, new_dirs):
+                                added.append(path)
+                                st = os.stat(path)
+                                result.setdefault(os.path.dirname(path), {})[path] = (st.st_mtime_ns, st.st_size)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1][1:].lower() in suffixes:
+                        st = entry.stat()
+                        current[entry.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+            for path, stat in current.items():
+                if path not in old:
+                    added.append(path)
+                elif old[path] is None:
+                    if stat[0] > self.since:
+                        modified.append(path)
+                elif old[path] != stat:
+                    modified.append(path)
+            removed.extend(path for path in old if path not in current)
+            result[directory] = current
+        self.watcher.diff_finished.emit(result, new_dirs, added, removed, modified)
+
+
+class FolderWatcher(QObject):
+    """
+    基于 QFileSystemWatcher 的目录监视器.
+    目录变化的通知经过去抖合并后,只重新扫描发生变化的目录,
+    与快照比较得到新增/删除/修改的图像,不需要重新加载整个文件夹.
+    初始的目录扫描结束(调用 start)之前只记录变化的目录,避免与扫描结果重复
+    """
+    # 目录变化的比较结果 (快照, 新目录, 新增, 删除, 修改),由后台线程发送
+    diff_finished = Signal(object, list, list, list, list)
+    # 图像变化 (新增的路径, 删除的路径, 修改的路径)
+    files_changed = Signal(list, list, list)
+
+    def __init__(self, root, suffixes, debounce_ms=300, parent=None):
+        """
+        :param root: 监视的根目录
+        :param suffixes: 支持的图像后缀集合
+        :param debounce_ms: 去抖时间,连续的变化通知合并为一次扫描
+        :param parent:
+        """
+        super().__init__(parent)
+        self.root = os.path.normpath(root)
+        self.suffixes = suffixes
+        self.since = time.time_ns()
+        # 目录 -> {图像路径: (mtime_ns, size) 或 None},None 表示还没有记录文件状态
+        self._snapshots = {}
+        # 正在监视的目录
+        self._watched = set()
+        self._dirty = set()
+        self._busy = False
+        self._started = False
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._on_directory_changed)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self._rescan)
+        self.diff_finished.connect(self._on_diff_finished)
+        self.watch_directories([self.root])
+
+    def watch_directories(self, directories):
+        """
+        监视目录
+        :param directories:
+        :return:
+        """
+        directories = {os.path.normpath(directory) for directory in directories} - self._watched
+        for directory in directories:
+            self._snapshots.setdefault(directory, {})
+        if directories:
+            self._watched.update(directories)
+            self.watcher.addPaths(list(directories))
+
+    def add_paths(self, paths):
+        """
+        记录目录扫描得到的图像,并监视其所在的目录
+        :param paths:
+        :return:
+        """
+        self.watch_directories({os.path.dirname(path) for path in paths})
+        for path in paths:
+            self._snapshots[os.path.normpath(os.path.dirname(path))].setdefault(path, None)
+
+    def start(self):
+        """
+        初始的目录扫描结束后开始处理变化
+        :return:
+        """
+        self._started = True
+        self._rescan()
+
+    def _on_directory_changed(self, directory):
+        self._dirty.add(os.path.normpath(directory))
+        self.debounce_timer.start()
+
+    def _rescan(self):
+        if self._busy or not self._started or not self._dirty:
+            return
+        self._busy = True
+        dirty, self._dirty = sorted(self._dirty), set()
+        # 只复制发生变化的目录的快照
+        snapshots = {directory: dict(self._snapshots.get(directory, {})) for directory in dirty}
+        self.pool.start(DirectoryDiffTask(self, dirty, snapshots, set(self._watched), self.since))
+
+    def _on_diff_finished(self, result, new_dirs, added, removed, modified):
+        self._busy = False
+        for directory, current in result.items():
+            if current is None:
+                # 目录被删除,同时移除其中的子目录
+                prefix = directory + os.sep
+                for sub_dir in [d for d in self._snapshots if d == directory or d.startswith(prefix)]:
+                    removed.extend(self._snapshots.pop(sub_dir))
+                    self._watched.discard(sub_dir)
+            else:
+                self._snapshots[directory] = current
+        self.watch_directories(new_dirs)
+        removed = list(dict.fromkeys(removed))
+        if added or removed or modified:
+            self.files_changed.emit(added, removed, modified)
+        # 扫描期间又有新的变化
+        if self._dirty:
+            self.debounce_timer.start()
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.diff_finished.disconnect(self._on_diff_finished)
+        self.pool.clear()
+        self.pool.waitForDone()
+        if self._watched:
+            self.watcher.removePaths(list(self._watched))
@@ -1,13 +1,31 @@
+import os
 import sys
+import threading
+import time
 
-from PySide6.QtCore import Qt, QDir
-from PySide6.QtGui import QPixmap, QAction, QImage, QPainter, QUndoStack, QFont, QFontDatabase, QColor
-from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog, QVBoxLayout, QScrollArea, QLabel, \
+from PySide6.QtCore import Qt, QDir, QTimer, QFileInfo, QSize
+from PySide6.QtGui import QPixmap, QAction, QUndoGroup, QFont, QFontDatabase, QColor, \
+    QKeySequence, QImageReader, QActionGroup
+from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog, QLabel, \
     QHBoxLayout, QWidget, QStatusBar, QGraphicsScene, QGraphicsPixmapItem, QSlider, QColorDialog, \
-    QComboBox
-
-from custom_widgets import ClickableImgLabel, MyPushButton, PaintGraphicsView
-from q_thread import ImageWorker
+    QComboBox, QInputDialog, QProgressDialog, QDockWidget, QTreeWidget, QTreeWidgetItem, QFormLayout, QCheckBox, \
+    QPushButton, QLineEdit
+
+import perf
+from adjustments import Adjustments, apply_adjustments, histogram
+from animation import AnimatedImageItem, is_multi_frame
+from annotation_store import AnnotationStore
+from annotations import AnnotationHistory, AnnotationLayer, ClearAnnotationsCommand
+from custom_widgets import MyPushButton, PaintGraphicsView, ThumbnailListView, HistogramWidget
+from duplicates import HashIndex
+from folder_watcher import FolderWatcher
+from metadata import MetadataStore, MetadataExtractor, SORT_KEYS
+from pixmap_cache import PixmapCache
+from q_thread import ImageWorker, PreviewPrefetcher, ExportWorker, DirectoryScanner, PRIORITY_NEAR
+from search_index import SearchIndex, index_path
+from thumbnail_model import ThumbnailListModel
+from thumbnail_store import ThumbnailStore
+from tiled_preview import TiledImageItem, should_use_tiles
 from util import *
 
 
@@ -31,20 +49,14 @@ class ImageBrowser(QMainWindow):
         self.mainWidget = QWidget()
         self.mainLayout = QHBoxLayout()
 
-        self.initToolBar()
-
-        # 左侧的垂直滚动区域
-        self.scrollWidget = QWidget()
-        self.scrollWidget.setObjectName("scrollWidget")
-        self.scrollLayout = QVBoxLayout()
-        # 不同缩略图之间有一定的间距
-        self.scrollLayout.setSpacing(10)
-        self.scrollLayout.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.scrollWidget.setLayout(self.scrollLayout)
-
-        self.scrollArea = QScrollArea()
-        self.scrollArea.setWidgetResizable(True)
-        self.scrollArea.setWidget(self.scrollWidget)
+        # 左侧的缩略图列表,只有可见的行才会加载缩略图
+        self.thumbnailModel = ThumbnailListModel(self)
+        self.thumbnailModel.thumbnails_requested.connect(self.onThumbnailsRequested)
+        self.thumbnailView = ThumbnailListView()
+        self.thumbnailView.setObjectName("thumbnailView")
+        self.thumbnailView.setModel(self.thumbnailModel)
+        self.thumbnailView.clicked.connect(self.onThumbnailClicked)
+        self.thumbnailView.visible_range_changed.connect(self.onThumbnailRangeChanged)
 
         # 右侧的预览图片显示区域
         self.imagePreviewScene = QGraphicsScene(self)
@@ -53,19 +65,72 @@ class ImageBrowser(QMainWindow):
         # 底部状态栏
         self.initStatusBar()
 
-        self.mainLayout.addWidget(self.scrollArea, 1)
+        self.mainLayout.addWidget(self.thumbnailView, 1)
         self.mainLayout.addWidget(self.imagePreviewView, 3)
         self.mainWidget.setLayout(self.mainLayout)
 
         self.setCentralWidget(self.mainWidget)
 
     def initResources(self):
-        # 当前的缩略图
-        self.current_thumbnail = None
-        # 增加图片缩放的缓存
-        self.img_resize_cache = {}
+        # 当前加载的图像列表
+        self.imageList = []
+        # 加载的全部图像(排序/筛选之前),按加载顺序保存在 dict 的 key 中 图像路径 -> None,
+        # 文件夹变化时按路径删除不需要遍历整个列表
+        self.allImages = {}
+        # 图像元数据索引,在后台并行提取
+        self.metadata_store = MetadataStore()
+        self.metadata_extractor = MetadataExtractor(self.metadata_store, parent=self)
+        self.metadata_extractor.finished.connect(self.onMetadataExtracted)
+        # 当前的排序字段/是否降序/筛选条件 {名称: (SQL 条件, 参数)}
+        self.sort_key = None
+        self.sort_descending = False
+        self.view_filters = {}
+        # 文件名/属性搜索索引,打开文件夹时保存在缓存目录下(索引文件路径为 None 时不保存)
+        self.search_index = SearchIndex()
+        self.search_index_path = None
+        # 在后台保存索引的线程
+        self.search_index_writer = None
+        self.search_query = ""
+        # 输入停止一段时间之后才执行搜索
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        # 增加图片缩放的缓存(有容量上限的 LRU 缓存)
+        self.img_resize_cache = PixmapCache()
+        # 持久化的磁盘缩略图缓存
+        self.thumbnail_store = ThumbnailStore()
         # 预览图缩放比例
         self.zoom_level = 100
+        # 当前预览图按照哪个尺寸缩放
+        self.preview_box = None
+        # 当前预览区域中的图像图形项
+        self.previewItem = None
+        # 当前预览图上的标注图层
+        self.annotation_layer = None
+        # 每张图像的色调调整 图像路径 -> Adjustments
+        self.image_adjustments = {}
+        # 未调整的预览图,作为调整时的代理图像(分块预览和动图不支持调整,为 None)
+        self.preview_source = None
+        self.preview_source_image = None
+        # 预览图当前是否显示的是调整之后的图像
+        self.preview_adjusted = False
+        # 持久化的标注,修改停止一段时间之后在后台写入
+        self.annotation_store = AnnotationStore()
+        self.annotation_save_timer = QTimer(self)
+        self.annotation_save_timer.setSingleShot(True)
+        self.annotation_save_timer.setInterval(500)
+        # 缩略图解码时顺便计算的感知哈希,用于查找重复图像
+        self.hash_index = HashIndex()
+        # 后台预加载当前图像前后的预览图
+        self.prefetcher = PreviewPrefetcher(store=self.thumbnail_store, parent=self)
+        # 切换预览图的次数以及总耗时(毫秒)
+        self.nav_count = 0
+        self.nav_total_ms = 0.0
+        # 窗口尺寸变化结束之后才重新缩放图像
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.onResizeSettled)
 
     def initMenus(self):
         # 创建菜单栏
@@ -76,18 +141,114 @@ class ImageBrowser(QMainWindow):
         self.open_action.triggered.connect(self.openImageDialog)
         self.file_menu.addAction(self.open_action)
 
+        # 打开文件夹,边扫描边加载
+        self.open_folder_action = QAction("打开文件夹", self)
+        self.open_folder_action.triggered.connect(self.openFolderDialog)
+        self.file_menu.addAction(self.open_folder_action)
+
+        # 上一张/下一张
+        self.view_menu = self.menuBar().addMenu("浏览")
+        self.prev_action = QAction("上一张", self)
+        self.prev_action.setShortcuts([QKeySequence("Left"), QKeySequence("PgUp")])
+        self.prev_action.triggered.connect(lambda: self.navigate(-1))
+        self.view_menu.addAction(self.prev_action)
+        self.next_action = QAction("下一张", self)
+        self.next_action.setShortcuts([QKeySequence("Right"), QKeySequence("PgDown")])
+        self.next_action.triggered.connect(lambda: self.navigate(1))
+        self.view_menu.addAction(self.next_action)
+        # 动图播放/暂停,多页图像翻页
+        self.play_action = QAction("播放/暂停", self)
+        self.play_action.setShortcut(QKeySequence("Space"))
+        self.play_action.triggered.connect(self.togglePlayback)
+        self.view_menu.addAction(self.play_action)
+        self.prev_page_action = QAction("上一帧/页", self)
+        self.prev_page_action.setShortcut(QKeySequence("Ctrl+PgUp"))
+        self.prev_page_action.triggered.connect(lambda: self.showFrame(-1))
+        self.view_menu.addAction(self.prev_page_action)
+        self.next_page_action = QAction("下一帧/页", self)
+        self.next_page_action.setShortcut(QKeySequence("Ctrl+PgDown"))
+        self.next_page_action.triggered.connect(lambda: self.showFrame(1))
+        self.view_menu.addAction(self.next_page_action)
+        self.view_menu.addSeparator()
+
+        # 按元数据排序/筛选
+        self.sort_menu = self.view_menu.addMenu("排序")
+        self.sort_group = QActionGroup(self)
+        for name, key in SORT_KEYS.items():
+            action = QAction(name, self, checkable=True)
+            action.setChecked(key is None)
+            action.triggered.connect(lambda checked, key=key: self.setSortKey(key))
+            self.sort_group.addAction(action)
+            self.sort_menu.addAction(action)
+        self.sort_menu.addSeparator()
+        self.sort_descending_action = QAction("降序", self, checkable=True)
+        self.sort_descending_action.toggled.connect(self.setSortDescending)
+        self.sort_menu.addAction(self.sort_descending_action)
+
+        self.filter_menu = self.view_menu.addMenu("筛选")
+        self.filter_group = QActionGroup(self)
+        self.filter_group.setExclusionPolicy(QActionGroup.ExclusionPolicy.ExclusiveOptional)
+        for name, condition in (("横向", "m.width > m.height"), ("纵向", "m.width < m.height"),
+                                ("有拍摄时间", "m.taken IS NOT NULL")):
+            action = QAction(name, self, checkable=True)
+            action.triggered.connect(lambda checked, condition=condition: self.setViewFilter(
+                "orientation", (condition, ()) if checked else None))
+            self.filter_group.addAction(action)
+            self.filter_menu.addAction(action)
+        self.filter_menu.addSeparator()
+        self.camera_filter_action = QAction("按相机...", self)
+        self.camera_filter_action.triggered.connect(self.chooseCameraFilter)
+        self.filter_menu.addAction(self.camera_filter_action)
+        self.clear_filter_action = QAction("清除筛选", self)
+        self.clear_filter_action.triggered.connect(self.clearViewFilters)
+        self.filter_menu.addAction(self.clear_filter_action)
+
+        # 菜单栏右侧的搜索框
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("搜索 例如: cat ext:png w>1920 size>2mb")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.setMinimumWidth(240)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+        self.search_edit.returnPressed.connect(self.onSearchEdited)
+        self.search_timer.timeout.connect(self.onSearchEdited)
+        self.menuBar().setCornerWidget(self.search_edit)
+        self.search_action = QAction("搜索", self)
+        self.search_action.setShortcut(QKeySequence("Ctrl+F"))
+        self.search_action.triggered.connect(self.focusSearch)
+        self.filter_menu.addAction(self.search_action)
+
+        self.view_menu.addSeparator()
+        self.duplicates_action = QAction("查找重复图像", self)
+        self.duplicates_action.triggered.connect(self.findDuplicates)
+        self.view_menu.addAction(self.duplicates_action)
+
+        # 性能监控,也可以通过环境变量 HH_PERF=1 打开
+        self.view_menu.addSeparator()
+        self.perf_action = QAction("性能监控", self, checkable=True)
+        self.perf_action.setChecked(perf.is_enabled())
+        self.perf_action.toggled.connect(self.setPerfEnabled)
+        self.view_menu.addAction(self.perf_action)
+        self.perf_export_action = QAction("导出性能跟踪...", self)
+        self.perf_export_action.triggered.connect(self.exportPerfTrace)
+        self.view_menu.addAction(self.perf_export_action)
+
         self.edit_menu = self.menuBar().addMenu('编辑')
         self.color_picker_action = QAction('工具栏', self)
         self.color_picker_action.triggered.connect(self.show_tool_bar)
         self.edit_menu.addAction(self.color_picker_action)
-
-        # 撤销/重做
-        self.undoStack = QUndoStack(self)
-        self.undo_action = self.undoStack.createUndoAction(self, '撤销')
+        self.adjustment_action = QAction('调整', self)
+        self.adjustment_action.triggered.connect(self.showAdjustmentDock)
+        self.edit_menu.addAction(self.adjustment_action)
+
+        # 撤销/重做,每张图像的标注有独立的撤销栈,切换图像时切换当前的撤销栈
+        self.undoGroup = QUndoGroup(self)
+        self.annotations = AnnotationHistory(self.undoGroup, self.annotation_store, self.annotation_save_timer.start)
+        self.annotation_save_timer.timeout.connect(self.annotations.save_dirty)
+        self.undo_action = self.undoGroup.createUndoAction(self, '撤销')
         self.undo_action.setShortcut('Ctrl+Z')
         self.edit_menu.addAction(self.undo_action)
 
-        self.redo_action = self.undoStack.createRedoAction(self, '重做')
+        self.redo_action = self.undoGroup.createRedoAction(self, '重做')
         self.redo_action.setShortcut('Shift+Ctrl+Z')
         self.edit_menu.addAction(self.redo_action)
 
@@ -112,6 +273,15 @@ class ImageBrowser(QMainWindow):
         self.zoom_slider.setValue(self.zoom_level)  # 100% as initial zoom level
         self.zoom_slider.valueChanged.connect(self.zoom_slider_moved)
         self.status_bar.addPermanentWidget(self.zoom_slider)
+        # 性能监控: 解码队列长度/缓存命中率/内存/帧耗时
+        self.perf_label = QLabel()
+        self.perf_label.setVisible(perf.is_enabled())
+        self.status_bar.insertPermanentWidget(0, self.perf_label)
+        self.perf_timer = QTimer(self)
+        self.perf_timer.setInterval(500)
+        self.perf_timer.timeout.connect(self.updatePerfOverlay)
+        if perf.is_enabled():
+            self.perf_timer.start()
 
     def initToolBar(self):
         """
@@ -142,13 +312,10 @@ class ImageBrowser(QMainWindow):
         self.color_painter_button.clicked.connect(self.show_painter)
 
         self.color_picker_button = MyPushButton("resource/icons/color_picker_icon.png")
-        self.color_picker_button.clicked.connect(lambda event: self.color_picker.show())
+        self.color_picker_button.clicked.connect(self.show_color_picker)
 
-        self.color_picker = QColorDialog(self)
         # 设置默认颜色为黑色
         self.text_edit_color = QColor("black")
-        self.color_picker.currentColorChanged.connect(self.change_color)
-        self.color_picker.hide()
 
         self.pen_size_label = QLabel("画笔大小:3")
         self.pen_size_slider = QSlider(Qt.Horizontal, self)
@@ -164,8 +331,8 @@ class ImageBrowser(QMainWindow):
 
         self.tool_bar.addWidget(self.color_picker_button)
         self.tool_bar.addWidget(self.color_painter_button)
-        self.tool_bar.addWidget(self.color_picker)
-        self.tool_bar.addWidget(self.pen_size_label)
+        # 调色盘第一次使用时才创建,插入到画笔大小的前面
+        self.pen_size_label_action = self.tool_bar.addWidget(self.pen_size_label)
         self.tool_bar.addWidget(self.pen_size_slider)
         self.tool_bar.addWidget(self.save_image_button)
         self.tool_bar.addWidget(self.reset_image_button)
@@ -173,6 +340,13 @@ class ImageBrowser(QMainWindow):
         # 工具栏和调色盘是默认隐藏的
         self.tool_bar.hide()
 
+    def show_color_picker(self):
+        if not hasattr(self, 'color_picker'):
+            self.color_picker = QColorDialog(self.text_edit_color, self)
+            self.color_picker.currentColorChanged.connect(self.change_color)
+            self.tool_bar.insertWidget(self.pen_size_label_action, self.color_picker)
+        self.color_picker.show()
+
     def update_text_edit_font_config(self):
         # 字体选择下拉框
         self.text_edit_font_combo_box = QComboBox()
@@ -217,8 +391,27 @@ class ImageBrowser(QMainWindow):
         self.text_edit_font = QFont(reset_font, reset_font_size)
 
     def show_tool_bar(self):
+        # 工具栏(包括系统字体列表)第一次显示时才创建,加快启动速度
+        if not self.is_tool_bar_ready():
+            self.initToolBar()
         self.tool_bar.show()
 
+    def is_tool_bar_ready(self):
+        return hasattr(self, 'tool_bar')
+
+    def edit_mode(self):
+        """
+        当前的编辑模式
+        :return: "text" 文本编辑, "painter" 画笔, 工具栏还没有创建或者都没有选中时返回 None
+        """
+        if not self.is_tool_bar_ready():
+            return None
+        if self.text_edit_button.isChecked():
+            return "text"
+        if self.color_painter_button.isChecked():
+            return "painter"
+        return None
+
     def show_painter(self, checked):
         self.color_painter_button.setChecked(checked)
         if checked:
@@ -252,32 +445,74 @@ class ImageBrowser(QMainWindow):
 
     def save_preview_image(self):
         """
-        保存预览区的图像
+        保存预览区的图像: 标注按比例回放到原始分辨率的图像上,
+        在后台线程中完成合成以及编码
         :return:
         """
-        image = QImage(self.imagePreviewScene.sceneRect().size().toSize(), QImage.Format_ARGB32)
-        image.fill(Qt.transparent)
-
-        painter = QPainter(image)
-        self.imagePreviewScene.render(painter)
-        painter.end()
+        if not self._is_preview_img_ready() or self.annotation_layer is None:
+            return
+        if hasattr(self, 'export_worker') and self.export_worker.isRunning():
+            return
 
         # 使用文件对话框获取保存的文件名
         file_dialog = QFileDialog()
         file_path, _ = file_dialog.getSaveFileName(self, "保存图像", "",
                                                    "PNG(*.png);;JPEG(*.jpg *.jpeg);;All Files(*.*) ")
+        if not file_path:
+            return
+        quality, compression = -1, -1
+        suffix = QFileInfo(file_path).suffix().lower()
+        if suffix in ("jpg", "jpeg", "webp"):
+            quality, ok = QInputDialog.getInt(self, "保存图像", "图像质量(0-100):", 90, 0, 100)
+            if not ok:
+                return
+        elif suffix in ("png", ""):
+            compression, ok = QInputDialog.getInt(self, "保存图像", "PNG 压缩级别(0-9,越小编码越快):", 6, 0, 9)
+            if not ok:
+                return
+
+        annotations, image_size = self.record_annotations()
+        self.export_worker = ExportWorker(self.currentPreviewImagePath, annotations, image_size, file_path,
+                                          quality, compression,
+                                          adjustments=self.image_adjustments.get(self.currentPreviewImagePath),
+                                          parent=self)
+        self.export_progress = QProgressDialog("正在保存图像...", "取消", 0, 100, self)
+        self.export_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.export_progress.canceled.connect(self.export_worker.cancel)
+        self.export_worker.progress.connect(self.export_progress.setValue)
+        self.export_worker.export_finished.connect(self.onExportFinished)
+        self.export_worker.start()
+
+    @perf.timed("save.record", "export")
+    def record_annotations(self):
+        """
+        在 GUI 线程中只复制当前图像的标注记录,由导出线程绘制到原图上
+        :return: (标注记录列表, 记录坐标对应的原图尺寸 QSize)
+        """
+        document = self.annotation_layer.document
+        return list(document.records), document.size
 
-        if file_path:
-            image.save(file_path)
+    def onExportFinished(self, ok, message):
+        self.export_progress.reset()
+        self.status_bar.showMessage(message)
+        if not ok:
+            print(message)
 
     def reset_all(self):
         """
-        重置所有设置
+        重置所有设置,当前图像的标注被清除(可以撤销)
         :return:
         """
+        if self.annotation_layer is not None and self.annotation_layer.document.records:
+            document = self.annotation_layer.document
+            document.stack.push(ClearAnnotationsCommand(document))
+        if self._is_preview_img_ready():
+            self.image_adjustments.pop(self.currentPreviewImagePath, None)
         self.updatePreviewImage()
         self.zoom_label.setText("100%")
         self.zoom_slider.setValue(100)
+        if not self.is_tool_bar_ready():
+            return
         self.select_text_edit(False)
         self.show_painter(False)
         self.reset_text_edit_font(self.all_fonts[0], self.all_font_sizes[0])
@@ -291,40 +526,290 @@ class ImageBrowser(QMainWindow):
         path = QFileDialog.getOpenFileNames(self, 'Open Image Files', QDir.currentPath(),
                                             get_supported_img_suffix_str())
 
+        if not path[0]:
+            return
+
+        self.stopLoading()
+        self.loadImages(path[0])
+
+    def openFolderDialog(self):
+        """
+        打开文件夹: 后台递归扫描,扫描到的图像分批加入缩略图列表
+        :return:
+        """
+        folder = QFileDialog.getExistingDirectory(self, 'Open Image Folder', QDir.currentPath())
+        if not folder:
+            return
+
+        self.stopLoading()
+        self.loadImages([])
+        # 读取上次保存的搜索索引,扫描到的图像增量更新
+        self.search_index_path = index_path(folder)
+        self.waitSearchIndexWriter()
+        self.search_index = SearchIndex.load(self.search_index_path)
+        suffixes = set(get_supported_img_suffix_list())
+        # 文件夹中的变化增量更新到缩略图列表
+        self.folder_watcher = FolderWatcher(folder, suffixes, parent=self)
+        self.folder_watcher.files_changed.connect(self.onFolderChanged)
+        self.scanner = DirectoryScanner(folder, suffixes, parent=self)
+        self.scanner.paths_found.connect(self.onPathsFound)
+        self.scanner.directories_scanned.connect(self.folder_watcher.watch_directories)
+        self.scanner.scan_finished.connect(self.onScanFinished)
+        self.scanner.start()
+
+    def stopLoading(self):
+        """
+        停止正在进行的目录扫描以及缩略图加载
+        :return:
+        """
+        if hasattr(self, 'scanner'):
+            self.scanner.stop()
+            self.scanner.wait()
+            self.scanner.deleteLater()
+            del self.scanner
+        if hasattr(self, 'folder_watcher'):
+            self.folder_watcher.stop()
+            self.folder_watcher.deleteLater()
+            del self.folder_watcher
         # If a previous worker is running, stop it
-        if hasattr(self, 'worker') and self.worker.isRunning():
+        if hasattr(self, 'worker'):
             self.worker.stop()
-            self.worker.wait()  # Wait for the worker thread to finish
-
-        # 重置滚动区域
-        for i in reversed(range(self.scrollLayout.count())):
-            self.scrollLayout.itemAt(i).widget().deleteLater()
+            self.worker.wait()  # Wait for the worker threads to finish
+            self.worker.deleteLater()
+        if self.search_index_path is not None and self.search_index.dirty:
+            # 在 GUI 线程中复制一份,之后的回调继续修改原索引也不影响后台线程保存
+            snapshot = self.search_index.snapshot()
+            self.search_index.dirty = False
+            self.waitSearchIndexWriter()
+            self.search_index_writer = threading.Thread(target=snapshot.save, args=(self.search_index_path,),
+                                                        name="SearchIndexWriter")
+            self.search_index_writer.start()
+
+    def waitSearchIndexWriter(self):
+        """
+        等待上一次的后台保存完成,避免同时写入/读取同一个索引文件
+        :return:
+        """
+        if self.search_index_writer is not None:
+            self.search_index_writer.join()
+            self.search_index_writer = None
 
-        self.imageList = path[0]
-        self.thumbnailLabels = []
-        self.loadImages(self.imageList)
+    def onPathsFound(self, paths):
+        """
+        目录扫描到一批图像
+        :param paths:
+        :return:
+        """
+        # 已经停止的扫描线程在队列中残留的结果直接丢弃
+        if self.sender() is not getattr(self, 'scanner', None):
+            return
+        self.folder_watcher.add_paths(paths)
+        self.allImages.update(dict.fromkeys(paths))
+        self.search_index.add_paths(paths)
+        self.metadata_extractor.extract(paths)
+        self.thumbnailModel.append_paths(paths)
+        if self.thumbnailModel.selected_row < 0:
+            self.selectRow(0)
+        self.thumbnailView.emit_visible_range()
+        self.worker.resume_background()
+
+    def onScanFinished(self, count, seconds):
+        if self.sender() is not getattr(self, 'scanner', None):
+            return
+        self.folder_watcher.start()
+        self.status_bar.showMessage(f"扫描完成, 共 {count} 张图像, 耗时 {seconds:.2f} 秒")
+
+    def onFolderChanged(self, added, removed, modified):
+        """
+        监视的文件夹中有图像被新增/删除/修改,只更新受影响的行和缓存
+        :param added: 新增的图像路径列表
+        :param removed: 删除的图像路径列表
+        :param modified: 修改的图像路径列表
+        :return:
+        """
+        current = getattr(self, 'currentPreviewImagePath', None)
+        current_row = self.thumbnailModel.selected_row
+        for path in removed + modified:
+            self.img_resize_cache.invalidate(path)
+            self.thumbnail_store.invalidate(path)
+            self.prefetcher.invalidate(path)
+            self.hash_index.remove(path)
+        for path in removed:
+            self.annotations.discard(path)
+            self.image_adjustments.pop(path, None)
+        self.search_index.remove_paths(removed)
+        self.search_index.add_paths(added)
+        self.search_index.invalidate_attributes(modified)
+        if removed:
+            removed_set = set(removed)
+            for path in removed_set:
+                self.allImages.pop(path, None)
+            first = self.thumbnailModel.remove_paths(removed_set)
+            if first >= 0:
+                # 后面的行号已经变化,排队中的任务重新请求
+                self.worker.cancel_from(first)
+        if modified:
+            self.thumbnailModel.refresh_paths(set(modified))
+        self.thumbnailModel.append_paths(added)
+        self.allImages.update(dict.fromkeys(added))
+        # 排序/筛选生效时,新图像的元数据提取完成后重新排序
+        self.metadata_extractor.extract(added + modified)
+        self.worker.resume_background()
+
+        count = self.thumbnailModel.rowCount()
+        if self.thumbnailModel.selected_row < 0 and count:
+            # 当前图像被删除,显示原位置的图像
+            self.selectRow(min(max(current_row, 0), count - 1))
+        elif not count and current is not None:
+            self.clearPreviewScene()
+            del self.currentPreviewImagePath
+        elif current in modified:
+            self.updatePreviewImage()
+        self.thumbnailView.emit_visible_range()
+        self.status_bar.showMessage(f"文件夹已更新: 新增 {len(added)} 张, 删除 {len(removed)} 张, "
+                                    f"修改 {len(modified)} 张")
 
     def loadImages(self, paths):
         """
-        异步加载图片
+        异步加载图片,缩略图由列表视图按需请求
         :param paths:
         :return:
         """
-        self.worker = ImageWorker(paths)
-        self.worker.image_loaded.connect(self.addThumbnail)
+        self.worker = ImageWorker(snap_thumbnail_edge(self.thumbnailView.thumbnail_edge()),
+                                  store=self.thumbnail_store, parent=self)
+        self.worker.images_loaded.connect(self.addThumbnails)
+        self.worker.hashes_computed.connect(self.addHashes)
+        self.worker.finished.connect(self.onImagesLoaded)
         self.worker.start()
-
-    def mk_img_resize_key(self, path, _type, width, height):
+        self.thumbnailModel.set_edge(self.worker.edge)
+        self.thumbnailModel.set_paths(paths)
+        self.hash_index = HashIndex()
+        self.allImages = dict.fromkeys(paths)
+        self.search_index = SearchIndex()
+        self.search_index_path = None
+        self.search_index.add_paths(paths)
+        self.metadata_extractor.extract(paths)
+        # 与模型共用同一个列表,目录扫描追加的图像也会被加载
+        self.imageList = self.thumbnailModel.paths
+        # 可见区域之外的图像在空闲时后台预加载
+        self.worker.set_background_paths(self.imageList)
+        self.thumbnailView.emit_visible_range()
+        if paths:
+            if self.isViewActive():
+                self.applyView()
+            else:
+                self.selectRow(0)
+
+    def isSortOrFilterActive(self):
+        return self.sort_key is not None or self.sort_descending or bool(self.view_filters)
+
+    def isViewActive(self):
+        return self.isSortOrFilterActive() or bool(self.search_query)
+
+    def setSortKey(self, key):
+        self.sort_key = key
+        self.applyView()
+
+    def setSortDescending(self, descending):
+        self.sort_descending = descending
+        self.applyView()
+
+    def setViewFilter(self, name, condition):
+        """
+        设置或者取消一个筛选条件
+        :param name: 条件名称,同名的条件互相替换
+        :param condition: (SQL 条件, 参数),为 None 时取消
+        :return:
         """
-        图像尺寸缩放结果缓存key
-        :param path:
-        :param _type:
-        :param width:
-        :param height:
+        if condition is None:
+            if self.view_filters.pop(name, None) is None:
+                return
+        else:
+            self.view_filters[name] = condition
+        self.applyView()
+
+    def chooseCameraFilter(self):
+        cameras = self.metadata_store.cameras(self.allImages)
+        if not cameras:
+            self.status_bar.showMessage("当前图像中没有相机信息")
+            return
+        labels = [f"{make or ''} {model or ''} ({count})".strip() for make, model, count in cameras]
+        label, ok = QInputDialog.getItem(self, "按相机筛选", "相机:", labels, 0, False)
+        if ok:
+            make, model, _ = cameras[labels.index(label)]
+            self.setViewFilter("camera", ("m.make IS ? AND m.model IS ?", (make, model)))
+
+    def clearViewFilters(self):
+        checked = self.filter_group.checkedAction()
+        if checked is not None:
+            checked.setChecked(False)
+        self.view_filters.clear()
+        self.applyView()
+
+    def focusSearch(self):
+        self.search_edit.setFocus()
+        self.search_edit.selectAll()
+
+    def onSearchEdited(self):
+        self.search_timer.stop()
+        self.setSearchQuery(self.search_edit.text())
+
+    def setSearchQuery(self, query):
+        """
+        :param query: 搜索语句,语法见 search_index 模块,为空时取消搜索
         :return:
         """
-        return f"{path}_{_type}_{width}_{height}"
+        query = query.strip()
+        if query == self.search_query:
+            return
+        self.search_query = query
+        self.applyView()
 
+    def applyView(self):
+        """
+        按当前的排序字段和筛选条件重新排列缩略图列表(一次带索引的查询,不重新扫描文件),
+        再用内存中的搜索索引筛选
+        :return:
+        """
+        start = time.perf_counter()
+        if self.isSortOrFilterActive():
+            paths = self.metadata_store.query(self.allImages, self.sort_key, self.sort_descending,
+                                              list(self.view_filters.values()))
+        else:
+            paths = self.allImages
+        if self.search_query:
+            with perf.span("search.query", "search"):
+                paths = self.search_index.filter(paths, self.search_query)
+        self.thumbnailModel.reorder(paths)
+        if hasattr(self, 'worker'):
+            # 行号已经全部变化,排队中的任务重新请求
+            self.worker.cancel_from(0)
+            self.worker.set_background_paths(self.thumbnailModel.paths)
+        self.thumbnailView.emit_visible_range()
+        if self.thumbnailModel.selected_row >= 0:
+            # 选中的图像没有变化,不重新显示预览图,只按新的顺序预加载前后的图像
+            self.prefetcher.prefetch(self.thumbnailModel.paths, self.thumbnailModel.selected_row)
+        elif self.thumbnailModel.rowCount():
+            self.selectRow(0)
+        self.status_bar.showMessage(f"显示 {len(paths)}/{len(self.allImages)} 张图像, "
+                                    f"耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def onMetadataExtracted(self, count, seconds):
+        """
+        元数据提取完成,排序/筛选生效时按新的元数据重新排列
+        :param count: 实际提取的图像数量
+        :param seconds: 耗时
+        :return:
+        """
+        # 把新的尺寸/文件大小更新到搜索索引
+        pending = self.search_index.pending_paths()
+        if pending:
+            self.search_index.set_attributes(self.metadata_store.attributes(pending))
+        # 搜索生效时,扫描过程中追加的图像也需要重新筛选
+        if (count and self.isSortOrFilterActive()) or (pending and self.search_query):
+            self.applyView()
+
+    @perf.timed("get_resized_img", "scale")
     def get_resized_img(self, _type, path, width, height):
         """
         获取缩放调整尺寸之后的图像,每次优先从缓存中取,
@@ -335,70 +820,419 @@ class ImageBrowser(QMainWindow):
         :param height: 图像高度
         :return:
         """
-        key = self.mk_img_resize_key(path, _type, width, height)
-        if key in self.img_resize_cache:
-            return self.img_resize_cache[key]
-        else:
-            pixmap = QPixmap(path)
-            new_pixmap = pixmap.scaled(width, height, Qt.KeepAspectRatio)
-            self.img_resize_cache[key] = new_pixmap
-            return new_pixmap
+        key = (path, width, height)
+        pixmap = self.img_resize_cache.get(_type, key)
+        if pixmap is None:
+            # 预览图优先使用后台预加载好的结果
+            img = self.prefetcher.take(path, (width, height)) if _type == "preview" else None
+            if img is None and _type == "preview":
+                # 其次使用批处理预生成的预览图
+                img = self.thumbnail_store.get_preview(path, width, height)
+            if img is None:
+                img = load_scaled_image(path, width, height)
+            pixmap = QPixmap.fromImage(img)
+            self.img_resize_cache.put(_type, key, pixmap)
+        return pixmap
+
+    def onThumbnailsRequested(self, rows):
+        """
+        列表视图请求加载缩略图
+        :param rows: 行号列表
+        :return:
+        """
+        if hasattr(self, 'worker'):
+            self.worker.request([(row, self.thumbnailModel.paths[row]) for row in rows])
+
+    def onThumbnailRangeChanged(self, first, last):
+        """
+        可见范围变化时重新调度缩略图加载任务:
+        可见区域优先,预加载可见区域附近一屏的缩略图,
+        取消并释放远离可见范围的缩略图
+        :param first:
+        :param last:
+        :return:
+        """
+        margin = max(last - first + 1, 1)
+        self.thumbnailModel.release_outside(first - margin, last + margin)
+        if hasattr(self, 'worker'):
+            self.worker.reprioritize(first, last, margin)
+            rows = self.thumbnailModel.mark_requested(first - margin, last + margin)
+            self.worker.request([(row, self.thumbnailModel.paths[row]) for row in rows], PRIORITY_NEAR)
+
+    @perf.timed("addThumbnails", "gui")
+    def addThumbnails(self, batch):
+        """
+        批量添加缩略图
+        :param batch: [(序号, 图像路径, QImage), ...]
+        :return:
+        """
+        for index, path, img in batch:
+            self.thumbnailModel.set_thumbnail(index, path, img)
 
-    def addThumbnail(self, path, pixmap):
+    def addHashes(self, batch):
         """
-        滚动区域添加缩略图
-        :param path:
-        :param pixmap:
+        记录计算好的感知哈希
+        :param batch: [(图像路径, 64 位哈希), ...]
         :return:
         """
-        if len(path) > 0 and pixmap:
-            thumbnail = ClickableImgLabel(path)
-            thumbnail.clicked.connect(self.onThumbnailClicked)
-            thumbnail.setPixmap(pixmap.scaled(100, 100, Qt.KeepAspectRatio))
-            self.scrollLayout.addWidget(thumbnail, alignment=Qt.AlignmentFlag.AlignCenter)
-            self.thumbnailLabels.append(thumbnail)
+        for path, image_hash in batch:
+            self.hash_index.add(path, image_hash)
+
+    def findDuplicates(self):
+        """
+        查找相似图像,并在侧边栏中分组显示.
+        只有已经计算过哈希的图像参与分组,其余图像在后台预加载时继续计算
+        :return:
+        """
+        start = time.perf_counter()
+        groups = self.hash_index.find_groups()
+        elapsed = time.perf_counter() - start
+        if not hasattr(self, 'duplicate_dock'):
+            self.initDuplicateDock()
+        self.duplicate_tree.clear()
+        for group in groups:
+            group_item = QTreeWidgetItem([f"{len(group)} 张相似图像"])
+            for path in group:
+                child = QTreeWidgetItem([os.path.basename(path)])
+                child.setToolTip(0, path)
+                child.setData(0, Qt.UserRole, path)
+                group_item.addChild(child)
+            self.duplicate_tree.addTopLevelItem(group_item)
+        self.duplicate_dock.show()
+        self.status_bar.showMessage(f"找到 {len(groups)} 组相似图像 (已计算 {len(self.hash_index)}/"
+                                    f"{self.thumbnailModel.rowCount()} 张), 耗时 {elapsed * 1000:.0f} ms")
+
+    def initDuplicateDock(self):
+        # 右侧的重复图像侧边栏,第一次查找时才创建
+        self.duplicate_dock = QDockWidget("重复图像", self)
+        self.duplicate_tree = QTreeWidget(self.duplicate_dock)
+        self.duplicate_tree.setHeaderHidden(True)
+        self.duplicate_tree.itemClicked.connect(self.onDuplicateItemClicked)
+        self.duplicate_dock.setWidget(self.duplicate_tree)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.duplicate_dock)
+
+    def onDuplicateItemClicked(self, item):
+        path = item.data(0, Qt.UserRole)
+        if path is None:
+            return
+        row = self.thumbnailModel.row_of(path)
+        if row < 0:
+            # 图像已经被删除
+            return
+        self.selectRow(row)
+        self.thumbnailView.scrollTo(self.thumbnailModel.index(row))
+
+    def setPerfEnabled(self, enabled):
+        perf.set_enabled(enabled)
+        self.perf_label.setVisible(enabled)
+        if enabled:
+            self.perf_timer.start()
+            self.updatePerfOverlay()
         else:
-            print("全部图像加载完成!")
-            self.updateThumbnails()
-        if len(self.thumbnailLabels) == 1:
-            self.showPreviewImage(self.imageList[0])
+            self.perf_timer.stop()
+
+    def updatePerfOverlay(self):
+        """
+        刷新状态栏中的性能信息
+        :return:
+        """
+        depth = self.worker.queue_depth() if hasattr(self, 'worker') else 0
+        hits = misses = 0
+        for pool_stats in self.img_resize_cache.stats().values():
+            hits += pool_stats["hits"]
+            misses += pool_stats["misses"]
+        hit_rate = hits / (hits + misses) if hits + misses else 0.0
+        memory = perf.memory_mb()
+        perf.gauge("decode_queue", depth)
+        perf.gauge("memory_mb", round(memory or 0, 1))
+        parts = [f"队列 {depth}", f"缓存命中 {hit_rate:.0%}"]
+        if memory is not None:
+            parts.append(f"内存 {memory:.0f} MB")
+        for name, label in (("preview.paint", "帧"), ("thumbnail.decode", "解码")):
+            stat = perf.stats(name)
+            if stat is not None:
+                parts.append(f"{label} {stat['last_ms']:.1f}/{stat['max_ms']:.1f} ms")
+        self.perf_label.setText(" | ".join(parts))
+
+    def exportPerfTrace(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出性能跟踪", "trace.json", "JSON(*.json)")
+        if not file_path:
+            return
+        count = perf.export_chrome_trace(file_path)
+        self.status_bar.showMessage(f"已导出 {count} 个事件到 {file_path}")
+
+    def onImagesLoaded(self, count, throughput):
+        """
+        请求的缩略图全部加载完成
+        :param count: 加载的图像数量
+        :param throughput: 吞吐量(张/秒)
+        :return:
+        """
+        self.status_bar.showMessage(f"已加载 {count} 张缩略图, {throughput:.1f} 张/秒")
 
-    def onThumbnailClicked(self, path):
+    def onThumbnailClicked(self, index):
         """
         当缩略图被点击时
-        :param path: 图像路径
+        :param index: 缩略图在模型中的索引
+        :return:
+        """
+        self.selectRow(index.row())
+
+    def navigate(self, step):
+        """
+        切换到上一张/下一张图像
+        :param step: -1 上一张, 1 下一张
+        :return:
+        """
+        row = self.thumbnailModel.selected_row + step
+        if 0 <= row < self.thumbnailModel.rowCount():
+            self.selectRow(row)
+            self.thumbnailView.scrollTo(self.thumbnailModel.index(row))
+
+    @perf.timed("selectRow", "gui")
+    def selectRow(self, row):
+        """
+        选中某一行并显示对应的预览图,同时预加载前后的预览图
+        :param row:
         :return:
         """
-        self.showPreviewImage(path)
-        sender = self.sender()
-        if self.current_thumbnail is not None:
-            self.current_thumbnail.is_selected = False
         # 更新当前被选中的缩略图
-        self.current_thumbnail = sender
-        sender.is_selected = True
+        self.thumbnailModel.set_selected_row(row)
+        start = time.perf_counter()
+        self.showPreviewImage(self.thumbnailModel.paths[row])
+        self.nav_count += 1
+        self.nav_total_ms += (time.perf_counter() - start) * 1000
+        self.prefetcher.prefetch(self.thumbnailModel.paths, row)
+        self.status_bar.showMessage(f"预加载命中率 {self.prefetcher.hit_rate():.0%}, "
+                                    f"平均切换耗时 {self.nav_total_ms / self.nav_count:.1f} ms")
 
     def showPreviewImage(self, path):
         self.currentPreviewImagePath = path
         self.updatePreviewImage()
 
+    def closeEvent(self, event):
+        # 退出前停止加载,并把缩略图缓存写入磁盘
+        self.stopLoading()
+        self.releasePreviewItem()
+        self.prefetcher.stop()
+        self.metadata_extractor.stop()
+        if hasattr(self, 'export_worker'):
+            self.export_worker.wait()
+        self.thumbnail_store.close()
+        self.metadata_store.close()
+        self.annotations.save_dirty()
+        self.annotation_store.close()
+        self.waitSearchIndexWriter()
+        super().closeEvent(event)
+
+    @perf.timed("resizeEvent", "gui")
     def resizeEvent(self, event):
-        # 窗口大小变化时，重新显示大图以及小图
+        # 拖动窗口的过程中只对现有的预览图做变换,缩略图由列表视图直接缩放显示,
+        # 窗口大小稳定之后再重新缩放大图以及小图
+        self.transformPreviewImage()
+        self.resize_timer.start()
+
+    def onResizeSettled(self):
         self.updatePreviewImage()
         self.updateThumbnails()
+        # 预览尺寸变化之后按新尺寸重新预加载
+        if self.thumbnailModel.selected_row >= 0:
+            self.prefetcher.prefetch(self.thumbnailModel.paths, self.thumbnailModel.selected_row)
 
     def updateThumbnails(self):
-        if hasattr(self, "thumbnailLabels"):
-            for label in self.thumbnailLabels:
-                pixmap = self.get_resized_img("thumbnail", label.path, self.scrollArea.width(), self.scrollArea.width())
-                label.setPixmap(pixmap)
+        # 缩略图解码边长按档位跟随列表宽度变化,只有可见的缩略图会由视图重新请求
+        edge = snap_thumbnail_edge(self.thumbnailView.thumbnail_edge())
+        if hasattr(self, 'worker'):
+            self.worker.set_edge(edge)
+        self.thumbnailModel.set_edge(edge)
 
+    def _preview_size(self):
+        return snap_preview_size(self.imagePreviewView.size().width(), self.imagePreviewView.size().height())
+
+    def transformPreviewImage(self):
+        """
+        在不重新缩放图像的情况下,通过视图变换让现有预览图适配当前预览区域
+        :return:
+        """
+        if self.preview_box is None:
+            return
+        width, height = self._preview_size()
+        factor = min(width / self.preview_box[0], height / self.preview_box[1])
+        self.imagePreviewView.resetTransform()
+        self.zoomPreviewImage(self.zoom_level / 100 * factor)
+
+    @perf.timed("updatePreviewImage", "gui")
     def updatePreviewImage(self):
         if self._is_preview_img_ready():
-            pixmap = self.get_resized_img("preview", self.currentPreviewImagePath,
-                                          self.imagePreviewView.size().width(), self.imagePreviewView.size().height())
+            width, height = self._preview_size()
+            self.prefetcher.set_size(width, height)
+            path = self.currentPreviewImagePath
+            if should_use_tiles(path):
+                # 超大图像按可见区域分块加载,缩放时再加载更清晰的层级
+                display_size = QImageReader(path).size().scaled(width, height, Qt.KeepAspectRatio)
+                item = TiledImageItem(path, display_size)
+            elif is_multi_frame(path):
+                # 动图/多页图像先显示缓存的第一帧,后续的帧在后台解码
+                item = AnimatedImageItem(path, self.get_resized_img("preview", path, width, height),
+                                         QSize(width, height))
+            else:
+                item = QGraphicsPixmapItem(self.get_resized_img("preview", path, width, height))
+
+            self.clearPreviewScene()
+            self.imagePreviewScene.addItem(item)
+            self.imagePreviewScene.setSceneRect(item.boundingRect())
+            self.previewItem = item
+            if type(item) is QGraphicsPixmapItem:
+                self.preview_source = item.pixmap()
+            self.syncAdjustmentPanel()
+            self.applyPreviewAdjustments()
+            # 标注从记录重新创建,记录使用原图像素坐标,由图层缩放到预览图上
+            image_size = read_display_size(path)
+            if not image_size.isValid() or image_size.isEmpty():
+                image_size = item.boundingRect().size().toSize()
+            document = self.annotations.activate(path, image_size)
+            self.annotation_layer = AnnotationLayer(
+                document, item.boundingRect().width() / max(document.size.width(), 1))
+            self.imagePreviewScene.addItem(self.annotation_layer)
+            self.preview_box = (width, height)
+            self.imagePreviewView.resetTransform()
+            self.zoomPreviewImage(self.zoom_level / 100)
+
+    def showAdjustmentDock(self):
+        if not hasattr(self, 'adjustment_dock'):
+            self.initAdjustmentDock()
+        self.adjustment_dock.show()
+        self.syncAdjustmentPanel()
+        self.applyPreviewAdjustments()
+
+    def initAdjustmentDock(self):
+        # 右侧的色调调整侧边栏,第一次打开时才创建
+        self.adjustment_dock = QDockWidget("调整", self)
+        panel = QWidget(self.adjustment_dock)
+        layout = QFormLayout(panel)
+        self.histogram_widget = HistogramWidget(panel)
+        layout.addRow(self.histogram_widget)
+        self.adjustment_sliders = {}
+        # 伽马的滑块值为实际值的 100 倍
+        for name, label, minimum, maximum in (("brightness", "亮度", -100, 100), ("contrast", "对比度", -100, 100),
+                                              ("gamma", "伽马", 10, 300), ("black", "黑场", 0, 254),
+                                              ("white", "白场", 1, 255)):
+            slider = QSlider(Qt.Horizontal, panel)
+            slider.setRange(minimum, maximum)
+            slider.valueChanged.connect(self.onAdjustmentChanged)
+            layout.addRow(label, slider)
+            self.adjustment_sliders[name] = slider
+        self.grayscale_check = QCheckBox("灰度", panel)
+        self.grayscale_check.toggled.connect(self.onAdjustmentChanged)
+        layout.addRow(self.grayscale_check)
+        self.reset_adjustment_button = QPushButton("重置", panel)
+        self.reset_adjustment_button.clicked.connect(self.resetAdjustments)
+        layout.addRow(self.reset_adjustment_button)
+        self.adjustment_dock.setWidget(panel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.adjustment_dock)
+
+    def syncAdjustmentPanel(self):
+        """
+        把当前图像的调整参数显示到侧边栏中
+        :return:
+        """
+        if not hasattr(self, 'adjustment_dock'):
+            return
+        adjustments = self.image_adjustments.get(getattr(self, 'currentPreviewImagePath', None)) or Adjustments()
+        values = {"brightness": adjustments.brightness, "contrast": adjustments.contrast,
+                  "gamma": round(adjustments.gamma * 100), "black": adjustments.black, "white": adjustments.white}
+        for name, slider in self.adjustment_sliders.items():
+            slider.blockSignals(True)
+            slider.setValue(values[name])
+            slider.blockSignals(False)
+        self.grayscale_check.blockSignals(True)
+        self.grayscale_check.setChecked(adjustments.grayscale)
+        self.grayscale_check.blockSignals(False)
+        self.adjustment_dock.widget().setEnabled(self.preview_source is not None)
+
+    def onAdjustmentChanged(self):
+        if self.preview_source is None:
+            return
+        sliders = self.adjustment_sliders
+        adjustments = Adjustments(sliders["brightness"].value(), sliders["contrast"].value(),
+                                  sliders["gamma"].value() / 100, sliders["black"].value(), sliders["white"].value(),
+                                  self.grayscale_check.isChecked())
+        if adjustments.is_identity():
+            self.image_adjustments.pop(self.currentPreviewImagePath, None)
+        else:
+            self.image_adjustments[self.currentPreviewImagePath] = adjustments
+        self.applyPreviewAdjustments()
 
-            self.imagePreviewScene.clear()
-            self.imagePreviewScene.addItem(QGraphicsPixmapItem(pixmap))
+    def resetAdjustments(self):
+        if self._is_preview_img_ready():
+            self.image_adjustments.pop(self.currentPreviewImagePath, None)
+        self.syncAdjustmentPanel()
+        self.applyPreviewAdjustments()
+
+    @perf.timed("adjust.preview", "gui")
+    def applyPreviewAdjustments(self):
+        """
+        在预览图上应用当前图像的色调调整并更新直方图.
+        预览图已经缩放到预览区域的尺寸,拖动滑块时只计算这张代理图像,原分辨率的图像在保存时调整
+        :return:
+        """
+        if self.preview_source is None:
+            if hasattr(self, 'adjustment_dock'):
+                self.histogram_widget.set_histogram(None)
+            return
+        adjustments = self.image_adjustments.get(self.currentPreviewImagePath)
+        show_histogram = hasattr(self, 'adjustment_dock') and self.adjustment_dock.isVisible()
+        if adjustments is None and not show_histogram and not self.preview_adjusted:
+            return
+        if self.preview_source_image is None:
+            self.preview_source_image = self.preview_source.toImage()
+        image = apply_adjustments(self.preview_source_image, adjustments)
+        self.previewItem.setPixmap(self.preview_source if adjustments is None else QPixmap.fromImage(image))
+        self.preview_adjusted = adjustments is not None
+        if show_histogram:
+            self.histogram_widget.set_histogram(histogram(image))
+
+    def togglePlayback(self):
+        if isinstance(self.previewItem, AnimatedImageItem) and self.previewItem.animated:
+            self.previewItem.set_playing(not self.previewItem.playing)
+
+    def showFrame(self, step):
+        """
+        动图逐帧查看(会暂停播放)/多页图像翻页
+        :param step: -1 上一帧/页, 1 下一帧/页
+        :return:
+        """
+        item = self.previewItem
+        if not isinstance(item, AnimatedImageItem):
+            return
+        item.set_playing(False)
+        index, count = item.index + step, item.frame_count()
+        if not count and index < 0:
+            return
+        item.show_frame(index)
+        self.status_bar.showMessage(f"第 {index % count + 1}/{count} 帧/页" if count else f"第 {index + 1} 帧/页")
+
+    def releasePreviewItem(self):
+        """
+        移除预览图之前取消分块预览的后台任务
+        :return:
+        """
+        if isinstance(self.previewItem, (TiledImageItem, AnimatedImageItem)):
+            self.previewItem.release()
+        self.previewItem = None
+
+    def clearPreviewScene(self):
+        """
+        清除预览区域中的预览图以及标注图形项,标注记录仍然保留
+        :return:
+        """
+        self.releasePreviewItem()
+        self.preview_source = self.preview_source_image = None
+        self.preview_adjusted = False
+        if self.annotation_layer is not None:
+            self.annotation_layer.detach()
+            self.annotation_layer = None
+        self.imagePreviewScene.clear()
 
     def _is_preview_img_ready(self):
         return hasattr(self, 'currentPreviewImagePath')
@@ -0,0 +1,34 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 20:50
+"""
+统一的图像读取入口: 缩略图/预览图/元数据/导出等阶段都通过 open_image_reader 读取源文件.
+文件通过 QFile 打开,解码器直接从文件中按需读取,不在进程内保存文件内容的副本
+(同一个文件的重复读取由操作系统的页缓存负责),也不使用 mmap:
+映射会一直占用文件句柄(Windows 上阻止删除/覆盖文件),监视的文件夹中文件被截断时还可能导致进程崩溃.
+读取完成后立即关闭文件
+"""
+import os
+from contextlib import contextmanager
+
+from PySide6.QtCore import QFile, QIODevice
+from PySide6.QtGui import QImageReader
+
+
+@contextmanager
+def open_image_reader(path):
+    """
+    打开图像读取器,退出时关闭文件
+    用法: with open_image_reader(path) as reader: img = reader.read()
+    :param path: 图像路径
+    :return: QImageReader,文件无法打开时返回按路径读取的 QImageReader(读取时给出错误信息)
+    """
+    device = QFile(path)
+    if not device.open(QIODevice.OpenModeFlag.ReadOnly):
+        yield QImageReader(path)
+        return
+    try:
+        # 设备中没有文件名,用后缀作为格式提示,不匹配时 Qt 会根据内容判断
+        yield QImageReader(device, os.path.splitext(path)[1][1:].lower().encode())
+    finally:
+        device.close()
@@ -1,16 +1,110 @@
 # -*- coding:utf-8 -*-
 # author:lyrichu@foxmail.com
 # @Time: 2023/7/26 17:59
+import time
+
+# 启动计时的起点,尽量放在所有导入之前
+START_TIME = time.perf_counter()
+
+import json
+import os
 import sys
 
+from PySide6.QtCore import QObject, QEvent, QTimer, QDir
 from PySide6.QtWidgets import QApplication
-from qt_material import apply_stylesheet
 from img_browser import ImageBrowser
+from util import get_cache_dir
+
+THEME = 'light_pink.xml'
+
+
+def apply_theme(app, theme=THEME):
+    """
+    应用 qt_material 主题.
+    第一次运行时由 qt_material 生成样式表和图标,并把样式表以及图标搜索路径缓存下来,
+    之后直接加载缓存的样式表,不再重新渲染模板
+    :param app:
+    :param theme: 主题名称
+    :return: 是否使用了缓存
+    """
+    import qt_material
+
+    version = getattr(qt_material, '__version__', '')
+    cache_path = os.path.join(get_cache_dir(), f"theme_{os.path.splitext(theme)[0]}_{version}.qss")
+    meta_path = cache_path + ".json"
+    try:
+        with open(cache_path, "r", encoding="utf-8") as fin:
+            stylesheet = fin.read()
+        with open(meta_path, "r", encoding="utf-8") as fin:
+            search_paths = json.load(fin)
+        # 生成的图标被清理之后需要重新生成
+        if search_paths.get("icon") and all(os.path.isdir(path) for paths in search_paths.values()
+                                             for path in paths):
+            for prefix, paths in search_paths.items():
+                QDir.setSearchPaths(prefix, paths)
+            app.setStyleSheet(stylesheet)
+            # 字体注册放到第一帧之后
+            if hasattr(qt_material, 'add_fonts'):
+                QTimer.singleShot(0, qt_material.add_fonts)
+            return True
+    except (OSError, ValueError):
+        pass
+
+    qt_material.apply_stylesheet(app, theme=theme, save_as=cache_path)
+    with open(meta_path, "w", encoding="utf-8") as fout:
+        json.dump({prefix: QDir.searchPaths(prefix) for prefix in ("icon", "qt_material")}, fout)
+    return False
+
+
+class FirstFrameFilter(QObject):
+    """
+    记录窗口第一次绘制完成的时间
+    """
+
+    def __init__(self, callback, parent=None):
+        super().__init__(parent)
+        self.callback = callback
+        self.done = False
+
+    def eventFilter(self, obj, event):
+        if not self.done and event.type() == QEvent.Type.Paint:
+            self.done = True
+            # 等本轮绘制结束之后再计时
+            QTimer.singleShot(0, self.callback)
+        return False
+
+
+def main():
+    # --startup-time: 输出各阶段耗时以及到第一帧的时间后退出
+    measure = "--startup-time" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--startup-time"]
+    stages = [("import", time.perf_counter())]
+
+    app = QApplication(argv)
+    stages.append(("QApplication", time.perf_counter()))
+    cached = apply_theme(app)
+    stages.append(("theme(cached)" if cached else "theme", time.perf_counter()))
+    imageBrowser = ImageBrowser()
+    # with open("styles/stylesheet.qss", "r", encoding="utf-8") as fin:
+    #     imageBrowser.setStyleSheet(fin.read())
+    stages.append(("ImageBrowser", time.perf_counter()))
+
+    if measure:
+        def report():
+            stages.append(("first frame", time.perf_counter()))
+            last = START_TIME
+            for name, t in stages:
+                print(f"{name:<16} {(t - last) * 1000:8.1f} ms")
+                last = t
+            print(f"{'time to first frame':<16} {(last - START_TIME) * 1000:8.1f} ms")
+            app.quit()
+
+        first_frame_filter = FirstFrameFilter(report, app)
+        app.installEventFilter(first_frame_filter)
+
+    imageBrowser.show()
+    return app.exec()
+
 
-app = QApplication(sys.argv)
-imageBrowser = ImageBrowser()
-# with open("styles/stylesheet.qss", "r", encoding="utf-8") as fin:
-#     imageBrowser.setStyleSheet(fin.read())
-apply_stylesheet(app, theme='light_pink.xml')
-imageBrowser.show()
-sys.exit(app.exec())
+if __name__ == "__main__":
+    sys.exit(main())
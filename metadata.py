@@ -0,0 +1,372 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 19:20
+"""
+图像元数据(尺寸/文件大小/拍摄时间/相机)索引,用于排序和筛选
+"""
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtGui import QImageIOHandler
+
+from ingest import open_image_reader
+from util import get_cache_dir
+
+# EXIF 标签
+_TAG_MAKE = 0x010F
+_TAG_MODEL = 0x0110
+_TAG_DATETIME = 0x0132
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 0x9003
+
+# 可以排序的字段 名称 -> 列名,None 表示按加载顺序
+SORT_KEYS = {
+    "默认顺序": None,
+    "文件名": "name",
+    "拍摄时间": "taken",
+    "修改时间": "mtime",
+    "文件大小": "size",
+    "像素数": "pixels",
+}
+
+
+def _read_ifd(data, endian, offset):
+    """
+    读取一个 IFD 中的整数和字符串标签
+    :return: {标签: 值}
+    """
+    tags = {}
+    count = struct.unpack_from(endian + "H", data, offset)[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(data):
+            break
+        tag, value_type, value_count = struct.unpack_from(endian + "HHI", data, entry)
+        if value_type == 2:
+            # ASCII,不超过 4 个字节时直接保存在条目中
+            start = entry + 8 if value_count <= 4 else struct.unpack_from(endian + "I", data, entry + 8)[0]
+            value = data[start:start + value_count].split(b"\0", 1)[0]
+            tags[tag] = value.decode("ascii", "replace").strip()
+        elif value_type == 3:
+            tags[tag] = struct.unpack_from(endian + "H", data, entry + 8)[0]
+        elif value_type == 4:
+            tags[tag] = struct.unpack_from(endian + "I", data, entry + 8)[0]
+    return tags
+
+
+def read_exif(path, max_bytes=256 * 1024):
+    """
+    只读取 JPEG 文件头中的 APP1 段,解析拍摄时间以及相机型号,不解码像素
+    :param path: 图像路径
+    :param max_bytes: 最多读取的字节数
+    :return: {"taken": ..., "make": ..., "model": ...},没有 EXIF 或者 EXIF 无法解析时返回空字典
+    """
+    try:
+        with open(path, "rb") as f:
+            return _read_exif(f, max_bytes)
+    except (OSError, struct.error, UnicodeError, ValueError, TypeError, KeyError):
+        # 损坏的 EXIF(越界的偏移/错误的标签类型等)当作没有元数据
+        return {}
+
+
+def _read_exif(f, max_bytes):
+    if f.read(2) != b"\xff\xd8":
+        return {}
+    while f.tell() < max_bytes:
+        marker, length = struct.unpack(">2sH", f.read(4))
+        if marker[0] != 0xFF or marker[1] == 0xDA:
+            # 已经到了图像数据
+            return {}
+        if marker[1] == 0xE1:
+            segment = f.read(length - 2)
+            if segment.startswith(b"Exif\0\0"):
+                return _parse_tiff(segment[6:])
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+    return {}
+
+
+def _parse_tiff(data):
+    if data[:2] == b"II":
+        endian = "<"
+    elif data[:2] == b"MM":
+        endian = ">"
+    else:
+        return {}
+    try:
+        tags = _read_ifd(data, endian, struct.unpack_from(endian + "I", data, 4)[0])
+        if _TAG_EXIF_IFD in tags:
+            tags.update(_read_ifd(data, endian, tags[_TAG_EXIF_IFD]))
+    except (struct.error, ValueError, TypeError):
+        return {}
+    taken = tags.get(_TAG_DATETIME_ORIGINAL) or tags.get(_TAG_DATETIME)
+    if taken and len(taken) >= 10:
+        # "YYYY:MM:DD HH:MM:SS" -> "YYYY-MM-DD HH:MM:SS",便于按字符串排序
+        taken = taken[:10].replace(":", "-") + taken[10:]
+    return {"taken": taken or None, "make": tags.get(_TAG_MAKE) or None, "model": tags.get(_TAG_MODEL) or None}
+
+
+def read_metadata(path, st=None):
+    """
+    读取一张图像的元数据,只读取文件头
+    :param path: 图像路径
+    :param st: os.stat 结果,为 None 时重新读取
+    :return: 与 metadata 表的列对应的元组
+    """
+    st = st or os.stat(path)
+    # 只读取文件头,不解码像素
+    with open_image_reader(path) as reader:
+        size = reader.size()
+        image_format = bytes(reader.format()).decode() or None
+        width, height = (size.width(), size.height()) if size.isValid() else (None, None)
+        # 带旋转信息的图像按显示方向记录宽高
+        if width and reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+            width, height = height, width
+    exif = read_exif(path)
+    return (path, os.path.basename(path).lower(), st.st_mtime_ns, st.st_size, width, height,
+            width * height if width else None, image_format,
+            exif.get("taken"), exif.get("make"), exif.get("model"))
+
+
+class MetadataStore:
+    """
+    与缩略图缓存放在同一目录下的元数据索引,
+    排序和筛选都是对当前图像列表的一次带索引的查询
+    """
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: 索引文件路径,默认放在用户缓存目录下
+        """
+        self.db_path = db_path or os.path.join(get_cache_dir(), "metadata.db")
+        # sqlite 连接在多个线程中共享,需要加锁
+        self.lock = threading.Lock()
+        self.conn = self._open()
+
+    def _open(self):
+        """
+        打开索引文件,只有文件损坏时才删除后重建,无法打开时使用内存数据库
+        :return:
+        """
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            return self._connect()
+        except (sqlite3.OperationalError, OSError) as e:
+            # 文件被锁定/磁盘只读等都不是文件损坏,不能删除(可能正被另一个实例使用),
+            # 改用内存数据库,本次运行提取的元数据不保存
+            print(f"元数据索引文件无法打开,不保存索引: {e}")
+            self.db_path = ":memory:"
+            return self._connect()
+        except sqlite3.DatabaseError as e:
+            print(f"元数据索引文件损坏,重新创建: {e}")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            return self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metadata (
+                    path TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    pixels INTEGER,
+                    format TEXT,
+                    taken TEXT,
+                    make TEXT,
+                    model TEXT
+                )""")
+            for column in ("name", "mtime", "size", "pixels", "taken"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_metadata_{column} ON metadata ({column})")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_camera ON metadata (make, model)")
+            # 当前图像列表,排序和筛选时与 metadata 表连接
+            conn.execute("CREATE TEMP TABLE current_paths (ord INTEGER PRIMARY KEY, path TEXT NOT NULL)")
+            conn.execute("SELECT COUNT(*) FROM metadata").fetchone()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def stamps(self, paths):
+        """
+        查询已经索引的图像的修改时间和文件大小
+        :param paths: 图像路径列表(不超过几百个)
+        :return: {图像路径: (mtime, size)}
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT path, mtime, size FROM metadata WHERE path IN ({','.join('?' * len(paths))})",
+                paths).fetchall()
+        return {path: (mtime, size) for path, mtime, size in rows}
+
+    def put_many(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      rows)
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _set_current(self, paths):
+        self.conn.execute("DELETE FROM current_paths")
+        self.conn.executemany("INSERT INTO current_paths VALUES (?, ?)", enumerate(paths))
+
+    def query(self, paths, sort_key=None, descending=False, filters=()):
+        """
+        对图像列表排序和筛选
+        :param paths: 当前的图像列表
+        :param sort_key: SORT_KEYS 中的列名,为 None 时保持原来的顺序
+        :param descending: 是否降序
+        :param filters: [(SQL 条件, 参数元组), ...],条件中用 m 表示 metadata 表
+        :return: 排序和筛选后的图像路径列表,没有元数据的图像排在最后
+        """
+        where = " AND ".join(f"({condition})" for condition, _ in filters) or "1"
+        params = [param for _, condition_params in filters for param in condition_params]
+        order = "c.ord"
+        if sort_key is not None:
+            order = f"m.{sort_key} IS NULL, m.{sort_key} {'DESC' if descending else 'ASC'}, c.ord"
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self._set_current(paths)
+            rows = self.conn.execute(
+                f"SELECT c.path FROM current_paths c LEFT JOIN metadata m ON m.path = c.path "
+                f"WHERE {where} ORDER BY {order}", params).fetchall()
+            self.conn.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def cameras(self, paths):
+        """
+        当前图像列表中出现过的相机
+        :param paths:
+        :return: [(make, model, 图像数量), ...]
+        """
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self._set_current(paths)
+            rows = self.conn.execute(
+                "SELECT m.make, m.model, COUNT(*) FROM current_paths c JOIN metadata m ON m.path = c.path "
+                "WHERE m.make IS NOT NULL OR m.model IS NOT NULL "
+                "GROUP BY m.make, m.model ORDER BY COUNT(*) DESC").fetchall()
+            self.conn.execute("COMMIT")
+        return rows
+
+    def attributes(self, paths):
+        """
+        图像的尺寸和文件大小,用于搜索索引
+        :param paths:
+        :return: [(图像路径, 宽, 高, 文件大小), ...],还没有元数据的图像不返回
+        """
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self._set_current(paths)
+            rows = self.conn.execute(
+                "SELECT m.path, m.width, m.height, m.size FROM current_paths c "
+                "JOIN metadata m ON m.path = c.path").fetchall()
+            self.conn.execute("COMMIT")
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class MetadataTask(QRunnable):
+    """
+    提取一批图像的元数据,已经索引且没有变化的图像直接跳过
+    """
+
+    def __init__(self, extractor, paths):
+        super().__init__()
+        self.extractor = extractor
+        self.paths = paths
+
+    def run(self):
+        store = self.extractor.store
+        rows = []
+        try:
+            stamps = store.stamps(self.paths)
+            for path in self.paths:
+                try:
+                    st = os.stat(path)
+                    if stamps.get(path) != (st.st_mtime_ns, st.st_size):
+                        rows.append(read_metadata(path, st))
+                except OSError:
+                    continue
+            store.put_many(rows)
+        except sqlite3.Error as e:
+            print(f"元数据写入失败: {e}")
+            rows = []
+        finally:
+            # 无论成功与否都要汇报,否则提取器永远等不到全部完成
+            self.extractor.chunk_done.emit(len(self.paths), len(rows))
+
+
+class MetadataExtractor(QObject):
+    """
+    在线程池中并行提取元数据并写入索引
+    """
+    # 一批提取完成 (处理的图像数量, 实际提取的图像数量),由后台线程发送
+    chunk_done = Signal(int, int)
+    # 提交的图像全部处理完成 (实际提取的图像数量, 耗时 秒)
+    finished = Signal(int, float)
+
+    # 每个任务处理的图像数量
+    CHUNK = 256
+
+    def __init__(self, store, max_threads=None, parent=None):
+        """
+        :param store: MetadataStore
+        :param max_threads: 最大线程数,默认为 CPU 核数
+        :param parent:
+        """
+        super().__init__(parent)
+        self.store = store
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads or os.cpu_count() or 1)
+        self._total = 0
+        self._done = 0
+        self._extracted = 0
+        self._start_time = 0.0
+        self.chunk_done.connect(self._on_chunk_done)
+
+    def extract(self, paths):
+        """
+        提交需要提取元数据的图像
+        :param paths:
+        :return:
+        """
+        if not paths:
+            return
+        if self._done == self._total:
+            self._total = self._done = self._extracted = 0
+            self._start_time = time.perf_counter()
+        self._total += len(paths)
+        for i in range(0, len(paths), self.CHUNK):
+            self.pool.start(MetadataTask(self, list(paths[i:i + self.CHUNK])))
+
+    def _on_chunk_done(self, count, extracted):
+        self._done += count
+        self._extracted += extracted
+        if self._done == self._total:
+            self.finished.emit(self._extracted, time.perf_counter() - self._start_time)
+
+    def stop(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.chunk_done.disconnect(self._on_chunk_done)
@@ -0,0 +1,218 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 20:20
+"""
+轻量的性能埋点: 计时区间/计数器,可以导出为 Chrome trace-event JSON
+(在 chrome://tracing 或者 https://ui.perfetto.dev 中打开).
+默认关闭,关闭时每个埋点只多一次全局变量判断;
+设置环境变量 HH_PERF=1 或者在菜单中打开
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块
+    resource = None
+
+# 最多保留的 trace 事件数量,超过后丢弃最早的事件
+MAX_EVENTS = 200000
+
+_enabled = os.environ.get("HH_PERF", "") not in ("", "0")
+# trace 事件,deque.append 是线程安全的
+_events = deque(maxlen=MAX_EVENTS)
+# 区间统计 名称 -> [次数, 总耗时 ms, 最大耗时 ms, 最近一次耗时 ms]
+_stats = {}
+# 计数器 名称 -> 值
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    """
+    打开/关闭埋点,打开时清空之前的记录
+    :param enabled:
+    :return:
+    """
+    global _enabled
+    if enabled and not _enabled:
+        reset()
+    _enabled = enabled
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _stats.clear()
+        _counters.clear()
+
+
+def _record(name, category, start, end):
+    duration_ms = (end - start) * 1000
+    _events.append({"name": name, "cat": category, "ph": "X", "pid": os.getpid(),
+                    "tid": threading.get_ident(), "ts": (start - _origin) * 1e6, "dur": duration_ms * 1000})
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            _stats[name] = [1, duration_ms, duration_ms, duration_ms]
+        else:
+            stat[0] += 1
+            stat[1] += duration_ms
+            stat[2] = max(stat[2], duration_ms)
+            stat[3] = duration_ms
+
+
+class _Span:
+    __slots__ = ("name", "category", "start")
+
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.category, self.start, time.perf_counter())
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, category="app"):
+    """
+    计时区间,用法: with perf.span("decode"): ...
+    :param name: 区间名称
+    :param category: 分类
+    :return:
+    """
+    return _Span(name, category) if _enabled else _NULL_SPAN
+
+
+def timed(name=None, category="app"):
+    """
+    计时装饰器,关闭时直接调用原函数
+    :param name: 区间名称,默认为函数的限定名
+    :param category: 分类
+    :return:
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(span_name, category, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """
+    计数器加 value
+    :param name:
+    :param value:
+    :return:
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    """
+    记录瞬时值,同时写入 trace 中的计数器轨道
+    :param name:
+    :param value:
+    :return:
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = value
+    _events.append({"name": name, "ph": "C", "pid": os.getpid(), "ts": (time.perf_counter() - _origin) * 1e6,
+                    "args": {name: value}})
+
+
+def stats(name):
+    """
+    :param name: 区间名称
+    :return: {"count", "mean_ms", "max_ms", "last_ms"},没有记录时返回 None
+    """
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            return None
+        return {"count": stat[0], "mean_ms": stat[1] / stat[0], "max_ms": stat[2], "last_ms": stat[3]}
+
+
+def counter(name, default=0):
+    with _lock:
+        return _counters.get(name, default)
+
+
+def memory_mb():
+    """
+    当前进程的常驻内存(MB),Linux 上读取 /proc,其它平台使用峰值内存,都不支持时返回 None
+    :return:
+    """
+    try:
+        with open("/proc/self/statm", "r") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上的单位是字节,Linux 上是 KB
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def export_chrome_trace(path):
+    """
+    把记录的事件导出为 Chrome trace-event JSON
+    :param path: 输出文件路径
+    :return: 导出的事件数量
+    """
+    events = list(_events)
+    pid = os.getpid()
+    # 线程名称元数据
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for tid in {event["tid"] for event in events if "tid" in event}:
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": names.get(tid, f"thread-{tid}")}})
+    with open(path, "w", encoding="utf-8") as fout:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fout)
+    return len(events)
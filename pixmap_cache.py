@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 11:05
+"""
+有容量上限的内存图像缓存
+"""
+from collections import OrderedDict
+
+# 缩略图缓存池默认容量
+DEFAULT_THUMBNAIL_BYTES = 64 * 1024 * 1024
+# 预览图缓存池默认容量
+DEFAULT_PREVIEW_BYTES = 256 * 1024 * 1024
+
+
+def pixmap_cost(pixmap):
+    """
+    估算 QPixmap/QImage 占用的内存字节数
+    :param pixmap:
+    :return:
+    """
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class LRUPixmapPool:
+    """
+    按字节数限制容量的 LRU 缓存池
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: 容量上限(字节)
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """
+        :param key: (图像路径, 宽度, 高度)
+        :return: 未命中时返回 None
+        """
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, pixmap):
+        if key in self._items:
+            self.total_bytes -= self._items.pop(key)[1]
+        cost = pixmap_cost(pixmap)
+        # 超过整个缓存池容量的图像不缓存
+        if cost > self.max_bytes:
+            return
+        self._items[key] = (pixmap, cost)
+        self.total_bytes += cost
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_cost) = self._items.popitem(last=False)
+            self.total_bytes -= evicted_cost
+            self.evictions += 1
+
+    def invalidate(self, path):
+        """
+        删除某个图像的全部缓存
+        :param path:
+        :return:
+        """
+        for key in [key for key in self._items if key[0] == path]:
+            self.total_bytes -= self._items.pop(key)[1]
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "items": len(self._items),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class PixmapCache:
+    """
+    缩放后图像的内存缓存,缩略图和预览图分别使用独立的缓存池
+    """
+
+    def __init__(self, thumbnail_bytes=DEFAULT_THUMBNAIL_BYTES, preview_bytes=DEFAULT_PREVIEW_BYTES):
+        """
+        :param thumbnail_bytes: 缩略图缓存池容量(字节)
+        :param preview_bytes: 预览图缓存池容量(字节)
+        """
+        self.pools = {
+            "thumbnail": LRUPixmapPool(thumbnail_bytes),
+            "preview": LRUPixmapPool(preview_bytes),
+        }
+
+    def get(self, _type, key):
+        """
+        :param _type: 图像类型 thumbnail/preview
+        :param key: (图像路径, 宽度, 高度)
+        :return: 未命中时返回 None
+        """
+        return self.pools[_type].get(key)
+
+    def put(self, _type, key, pixmap):
+        self.pools[_type].put(key, pixmap)
+
+    def invalidate(self, path):
+        for pool in self.pools.values():
+            pool.invalidate(path)
+
+    def clear(self):
+        for pool in self.pools.values():
+            pool.clear()
+
+    def stats(self):
+        return {_type: pool.stats() for _type, pool in self.pools.items()}
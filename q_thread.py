@@ -4,42 +4,615 @@
 """
 Qt 多线程 相关
 """
-from PySide6.QtCore import QThread, Signal, QMutex
-from PySide6.QtGui import QPixmap, QImage
+import os
+import time
 
+from PySide6.QtCore import QObject, QRunnable, QThread, QThreadPool, QTimer, Signal, QMutex, QFileInfo
+from PySide6.QtGui import QImage, QImageWriter, QImageIOHandler
 
-class ImageWorker(QThread):
+import perf
+from adjustments import apply_adjustments
+from annotations import render_annotated
+from duplicates import dhash
+from ingest import open_image_reader
+from util import THUMBNAIL_SIZE, iter_image_files, load_scaled_image
+
+# 缩略图任务的优先级: 可见区域 > 可见区域附近 > 后台预加载
+PRIORITY_VISIBLE = 2
+PRIORITY_NEAR = 1
+PRIORITY_BACKGROUND = 0
+
+
+class ThumbnailTask(QRunnable):
     """
-    图像加载工具类
+    单张缩略图的解码任务,在线程池中并发执行
     """
-    # (图像路径,加载完的img_pixel)
-    image_loaded = Signal(str, QPixmap)
 
-    def __init__(self, paths):
+    def __init__(self, worker, index, path, edge, priority):
         """
-        :param paths: 图像路径列表
+        :param worker: 所属的 ImageWorker
+        :param index: 图像在路径列表中的序号
+        :param path: 图像路径
+        :param edge: 缩略图边长
+        :param priority: 任务优先级
         """
         super().__init__()
-        self.paths = paths
+        # 任务对象由 ImageWorker 持有,以便排队期间调整优先级或者取消
+        self.setAutoDelete(False)
+        self.worker = worker
+        self.index = index
+        self.path = path
+        self.edge = edge
+        self.priority = priority
+
+    @perf.timed("thumbnail.decode", "worker")
+    def run(self):
+        # 已经取消的任务直接跳过,不再解码
+        if not self.worker.task_started(self):
+            return
+        store = self.worker.store
+        key = store.make_key(self.path, self.edge) if store else None
+        image_hash = store.get_hash(key) if store else None
+        if self.priority == PRIORITY_BACKGROUND and store and store.contains(key):
+            # 后台预加载只负责填充磁盘缓存,已经缓存的不需要再读取,
+            # 只有还没有计算哈希时才读取缓存中的缩略图
+            if image_hash is None:
+                image_hash = dhash(store.get(key))
+                store.put_hash(key, image_hash)
+            self.worker.task_done(self.index, self.path, None, image_hash)
+            return
+        # 优先从磁盘缓存中读取
+        img = store.get(key) if store else None
+        if img is None:
+            # 直接按缩略图尺寸解码,避免生成完整分辨率的图像
+            img = load_scaled_image(self.path, self.edge, self.edge)
+            if store:
+                store.put(key, img)
+        if image_hash is None:
+            # 在已经解码好的缩略图上计算感知哈希,不需要再次读取文件
+            image_hash = dhash(img)
+            if store:
+                store.put_hash(key, image_hash)
+        self.worker.task_done(self.index, self.path, img, image_hash)
+
+
+class ImageWorker(QObject):
+    """
+    图像加载工具类,使用按 CPU 核数大小的线程池并发解码请求的缩略图,
+    解码结果以 QImage(线程安全)的形式在 GUI 线程中定时批量发送,
+    由 GUI 线程负责转换成 QPixmap.
+    任务按优先级调度: 可见区域优先,其次是可见区域附近,空闲时在后台预加载其余图像
+    """
+    # 一批加载完成的图像 [(序号, 图像路径, QImage), ...]
+    images_loaded = Signal(list)
+    # 一批计算好的感知哈希 [(图像路径, 64 位哈希), ...]
+    hashes_computed = Signal(list)
+    # 当前请求的图像全部加载完成 (加载的图像数量, 吞吐量 张/秒)
+    finished = Signal(int, float)
+
+    # 批量发送结果的时间间隔(毫秒)
+    FLUSH_INTERVAL = 50
+
+    def __init__(self, edge=THUMBNAIL_SIZE, store=None, max_threads=None, parent=None):
+        """
+        :param edge: 缩略图边长
+        :param store: 磁盘缩略图缓存 ThumbnailStore,为 None 时不使用缓存
+        :param max_threads: 最大线程数,默认为 CPU 核数
+        :param parent:
+        """
+        super().__init__(parent)
+        self.edge = edge
+        self.store = store
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads or os.cpu_count() or 1)
         # 确保线程安全
         self.mutex = QMutex()
         # 是否正在加载图片
+        self._isRunning = False
+        # 还在排队的任务 序号 -> ThumbnailTask
+        self._queued = {}
+        # 已解码但还未发送的结果
+        self._pending = []
+        self._pending_hashes = []
+        # 本轮已提交/已完成的任务数
+        self._submitted_count = 0
+        self._done_count = 0
+        self._start_time = 0.0
+        # 后台预加载的图像列表以及当前进度
+        self._background_paths = []
+        self._background_cursor = 0
+        # 定时把解码结果批量发送到 GUI 线程
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(self.FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def start(self):
+        self.mutex.lock()
         self._isRunning = True
+        self.mutex.unlock()
 
-    def run(self):
-        for path in self.paths:
-            self.mutex.lock()
-            if not self._isRunning:
-                self.mutex.unlock()
-                break
-            img = QImage(path)
-            pixmap = QPixmap.fromImage(img)
-            self.image_loaded.emit(path, pixmap)
-            self.mutex.unlock()
-        # 当全部图像加载完成之后,发送一个完成信号
-        self.image_loaded.emit("", None)
+    def request(self, items, priority=PRIORITY_VISIBLE):
+        """
+        提交需要加载的缩略图,已经在排队的任务会提升到更高的优先级
+        :param items: [(序号, 图像路径), ...]
+        :param priority: 任务优先级
+        :return:
+        """
+        if not items or not self.is_running():
+            return
+        self.mutex.lock()
+        if self._submitted_count == self._done_count:
+            # 空闲之后的新一轮加载,重新开始计时
+            self._submitted_count = self._done_count = 0
+            self._start_time = time.perf_counter()
+        for index, path in items:
+            task = self._queued.get(index)
+            if task is not None:
+                if task.priority < priority and self.pool.tryTake(task):
+                    task.priority = priority
+                    self.pool.start(task, priority)
+                continue
+            task = ThumbnailTask(self, index, path, self.edge, priority)
+            self._queued[index] = task
+            self._submitted_count += 1
+            self.pool.start(task, priority)
+        self.mutex.unlock()
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def reprioritize(self, first, last, margin):
+        """
+        根据可见范围重新调度排队中的任务:
+        可见范围内的任务提升为最高优先级,附近的任务降为次优先级,
+        离开附近范围的任务直接取消(后台预加载任务保持不变)
+        :param first: 第一个可见行
+        :param last: 最后一个可见行
+        :param margin: 可见范围附近的行数
+        :return:
+        """
+        self.mutex.lock()
+        for index, task in list(self._queued.items()):
+            if first <= index <= last:
+                priority = PRIORITY_VISIBLE
+            elif first - margin <= index <= last + margin:
+                priority = PRIORITY_NEAR
+            elif task.priority == PRIORITY_BACKGROUND:
+                continue
+            else:
+                # 取消任务,即使已经被线程取走也会在 task_started 中跳过
+                self.pool.tryTake(task)
+                del self._queued[index]
+                self._submitted_count -= 1
+                continue
+            if priority != task.priority and self.pool.tryTake(task):
+                task.priority = priority
+                self.pool.start(task, priority)
+        self.mutex.unlock()
+
+    def cancel_from(self, row):
+        """
+        取消序号不小于 row 的排队任务(删除行之后这些序号已经失效)
+        :param row:
+        :return:
+        """
+        self.mutex.lock()
+        for index, task in list(self._queued.items()):
+            if index >= row:
+                self.pool.tryTake(task)
+                del self._queued[index]
+                self._submitted_count -= 1
+        self.mutex.unlock()
+        self._background_cursor = min(self._background_cursor, row)
+
+    def set_edge(self, edge):
+        """
+        修改缩略图边长,排队中按旧尺寸解码的任务全部取消
+        :param edge:
+        :return:
+        """
+        if edge == self.edge:
+            return
+        self.edge = edge
+        self.mutex.lock()
+        for task in self._queued.values():
+            self.pool.tryTake(task)
+        self._submitted_count -= len(self._queued)
+        self._queued.clear()
+        self.mutex.unlock()
+        # 新尺寸的缩略图需要重新预加载
+        self._background_cursor = 0
+
+    def set_background_paths(self, paths):
+        """
+        设置空闲时需要在后台预加载(填充磁盘缓存)的图像列表
+        :param paths:
+        :return:
+        """
+        self._background_paths = paths
+        self._background_cursor = 0
+        self._feed_background()
+
+    def resume_background(self):
+        """
+        后台预加载列表追加了新图像后调用,继续预加载
+        :return:
+        """
+        self._feed_background()
+
+    def _feed_background(self):
+        """
+        排队的任务很少时才逐批提交后台预加载任务,保证可见区域的任务不会被积压的后台任务拖慢
+        :return:
+        """
+        self.mutex.lock()
+        room = self.pool.maxThreadCount() - len(self._queued) if self._isRunning else 0
+        items = []
+        while room > 0 and self._background_cursor < len(self._background_paths):
+            index = self._background_cursor
+            self._background_cursor += 1
+            if index not in self._queued:
+                items.append((index, self._background_paths[index]))
+                room -= 1
+        self.mutex.unlock()
+        self.request(items, PRIORITY_BACKGROUND)
+
+    def queue_depth(self):
+        """
+        还在排队的任务数量
+        :return:
+        """
+        self.mutex.lock()
+        depth = len(self._queued)
+        self.mutex.unlock()
+        return depth
+
+    def is_running(self):
+        self.mutex.lock()
+        running = self._isRunning
+        self.mutex.unlock()
+        return running
+
+    def isRunning(self):
+        return self.is_running()
+
+    def task_started(self, task):
+        """
+        线程池中的任务开始执行时调用
+        :param task:
+        :return: 任务是否需要继续执行
+        """
+        self.mutex.lock()
+        started = self._isRunning and self._queued.get(task.index) is task
+        if started:
+            del self._queued[task.index]
+        self.mutex.unlock()
+        return started
+
+    def task_done(self, index, path, img, image_hash=None):
+        """
+        线程池中的任务解码完成后调用
+        :param index:
+        :param path:
+        :param img: QImage,为 None 时表示不需要发送结果
+        :param image_hash: 感知哈希,解码失败时为 None
+        :return:
+        """
+        self.mutex.lock()
+        if self._isRunning:
+            if img is not None:
+                self._pending.append((index, path, img))
+            if image_hash is not None:
+                self._pending_hashes.append((path, image_hash))
+            self._done_count += 1
+        self.mutex.unlock()
+
+    def flush(self):
+        """
+        在 GUI 线程中把已解码的结果批量发送出去
+        :return:
+        """
+        self.mutex.lock()
+        batch, self._pending = self._pending, []
+        hashes, self._pending_hashes = self._pending_hashes, []
+        self.mutex.unlock()
+        if batch:
+            self.images_loaded.emit(batch)
+        if hashes:
+            self.hashes_computed.emit(hashes)
+        self._feed_background()
+        self.mutex.lock()
+        all_done = self._isRunning and self._done_count == self._submitted_count
+        done_count = self._done_count
+        self.mutex.unlock()
+        if all_done:
+            self.flush_timer.stop()
+            elapsed = time.perf_counter() - self._start_time
+            self.finished.emit(done_count, done_count / elapsed if elapsed > 0 else 0.0)
 
     def stop(self):
         self.mutex.lock()
         self._isRunning = False
+        self._pending = []
+        self._pending_hashes = []
+        self._queued.clear()
         self.mutex.unlock()
+        # 移除还在排队的任务
+        self.pool.clear()
+        self.flush_timer.stop()
+
+    def wait(self):
+        self.pool.waitForDone()
+
+
+class PreviewTask(QRunnable):
+    """
+    预览图预加载任务
+    """
+
+    def __init__(self, prefetcher, path, size, generation):
+        """
+        :param prefetcher: 所属的 PreviewPrefetcher
+        :param path: 图像路径
+        :param size: 预览图尺寸 (width, height)
+        :param generation: 提交任务时预加载器的代数,尺寸变化后旧任务的结果直接丢弃
+        """
+        super().__init__()
+        self.prefetcher = prefetcher
+        self.path = path
+        self.size = size
+        self.generation = generation
+
+    @perf.timed("preview.prefetch", "worker")
+    def run(self):
+        store = self.prefetcher.store
+        img = store.get_preview(self.path, *self.size) if store else None
+        if img is None:
+            img = load_scaled_image(self.path, *self.size)
+        self.prefetcher.preview_decoded.emit(self.path, self.generation, img)
+
+
+class PreviewPrefetcher(QObject):
+    """
+    预览图预加载器,在后台把当前图像前后各 radius 张按当前预览尺寸解码好,
+    保存在一个有界的环形缓存中,切换上一张/下一张时可以直接使用
+    """
+    # 后台线程解码完成 (图像路径, 代数, QImage)
+    preview_decoded = Signal(str, int, QImage)
+
+    def __init__(self, radius=2, max_threads=2, store=None, parent=None):
+        """
+        :param radius: 当前图像前后各预加载的张数
+        :param max_threads: 预加载使用的线程数
+        :param store: 磁盘缓存 ThumbnailStore,用于读取批处理预生成的预览图
+        :param parent:
+        """
+        super().__init__(parent)
+        self.radius = radius
+        self.store = store
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.size = None
+        # 尺寸每变化一次代数加一
+        self.generation = 0
+        # 已解码的预览图 图像路径 -> QImage
+        self._ring = {}
+        # 正在解码的图像路径
+        self._in_flight = set()
+        # 当前需要保留的图像路径
+        self._wanted = set()
+        self.hits = 0
+        self.misses = 0
+        self.preview_decoded.connect(self._on_preview_decoded)
+
+    def set_size(self, width, height):
+        """
+        预览尺寸变化时清空环形缓存
+        :param width:
+        :param height:
+        :return:
+        """
+        if self.size == (width, height):
+            return
+        self.size = (width, height)
+        self.generation += 1
+        self._ring.clear()
+        self._in_flight.clear()
+
+    def prefetch(self, paths, current):
+        """
+        预加载 paths[current] 前后各 radius 张预览图,并释放范围之外的预览图
+        :param paths: 图像路径列表
+        :param current: 当前图像的序号
+        :return:
+        """
+        if self.size is None:
+            return
+        first, last = max(current - self.radius, 0), min(current + self.radius, len(paths) - 1)
+        # 离当前图像近的优先解码
+        wanted = sorted(range(first, last + 1), key=lambda i: abs(i - current))
+        self._wanted = {paths[i] for i in wanted}
+        for path in [path for path in self._ring if path not in self._wanted]:
+            del self._ring[path]
+        for i in wanted:
+            path = paths[i]
+            if i != current and path not in self._ring and path not in self._in_flight:
+                self._in_flight.add(path)
+                self.pool.start(PreviewTask(self, path, self.size, self.generation))
+
+    def _on_preview_decoded(self, path, generation, img):
+        if generation != self.generation:
+            return
+        self._in_flight.discard(path)
+        if path in self._wanted and not img.isNull():
+            self._ring[path] = img
+
+    def invalidate(self, path):
+        """
+        图像文件变化后丢弃预加载好的预览图
+        :param path:
+        :return:
+        """
+        self._ring.pop(path, None)
+
+    def take(self, path, size):
+        """
+        取出预加载好的预览图
+        :param path:
+        :param size: 需要的预览尺寸
+        :return: QImage,未命中时返回 None
+        """
+        img = self._ring.get(path) if size == self.size else None
+        if img is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return img
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stop(self):
+        self.generation += 1
+        self.pool.clear()
+        self.pool.waitForDone()
+
+
+class ExportWorker(QThread):
+    """
+    导出线程,把标注按比例回放到原始分辨率的图像上,再进行编码保存,
+    整个过程不占用 GUI 线程,支持进度显示以及取消
+    """
+    # 导出进度 0-100
+    progress = Signal(int)
+    # 导出结束 (是否成功, 提示信息)
+    export_finished = Signal(bool, str)
+
+    def __init__(self, source_path, annotations, image_size, output_path, quality=-1, compression=-1,
+                 adjustments=None, parent=None):
+        """
+        :param source_path: 原始图像路径
+        :param annotations: 标注记录列表,坐标为原图像素坐标
+        :param image_size: 标注记录坐标对应的原图尺寸 QSize
+        :param output_path: 保存路径
+        :param quality: JPEG 等有损格式的质量 0-100, -1 表示默认
+        :param compression: PNG 等无损格式的压缩级别 0-9, -1 表示默认
+        :param adjustments: 色调调整 Adjustments,在原分辨率的图像上应用
+        :param parent:
+        """
+        super().__init__(parent)
+        self.source_path = source_path
+        self.annotations = annotations
+        self.image_size = image_size
+        self.output_path = output_path
+        self.quality = quality
+        self.compression = compression
+        self.adjustments = adjustments
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @perf.timed("save.export", "export")
+    def run(self):
+        self.progress.emit(0)
+        with open_image_reader(self.source_path) as reader:
+            reader.setAutoTransform(True)
+            image = reader.read()
+            error = reader.errorString()
+        if image.isNull():
+            self.export_finished.emit(False, f"读取原图失败: {error}")
+            return
+        if self._cancelled:
+            self.export_finished.emit(False, "已取消导出")
+            return
+        self.progress.emit(30)
+
+        # 先调整色调,标注绘制在调整之后的图像上
+        image = apply_adjustments(image, self.adjustments)
+        image = render_annotated(image, self.annotations, self.image_size)
+        if self._cancelled:
+            self.export_finished.emit(False, "已取消导出")
+            return
+        self.progress.emit(60)
+
+        # 先写入临时文件,取消或者失败时不会破坏已有的文件
+        tmp_path = self.output_path + ".part"
+        writer = QImageWriter(tmp_path, (QFileInfo(self.output_path).suffix().lower() or "png").encode())
+        if self.quality >= 0:
+            writer.setQuality(self.quality)
+        if self.compression >= 0:
+            if writer.supportsOption(QImageIOHandler.ImageOption.CompressionRatio):
+                writer.setCompression(self.compression)
+            else:
+                # PNG 的 quality 对应压缩级别, 0 为最大压缩
+                writer.setQuality((9 - self.compression) * 100 // 9)
+        ok = writer.write(image)
+        if not ok or self._cancelled:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.export_finished.emit(False, "已取消导出" if ok else f"保存失败: {writer.errorString()}")
+            return
+        os.replace(tmp_path, self.output_path)
+        self.progress.emit(100)
+        self.export_finished.emit(True, f"已保存到 {self.output_path} ({image.width()}x{image.height()})")
+
+
+class DirectoryScanner(QThread):
+    """
+    目录扫描线程,递归扫描目录中的图像文件,边扫描边分批发送,
+    不需要等待完整的文件列表
+    """
+    # 一批扫描到的图像路径
+    paths_found = Signal(list)
+    # 扫描过的全部目录,扫描结束前发送一次
+    directories_scanned = Signal(list)
+    # 扫描结束 (图像数量, 耗时 秒)
+    scan_finished = Signal(int, float)
+
+    # 第一批尽快发送,之后的批次逐渐变大,减少 GUI 线程的处理次数
+    FIRST_CHUNK = 32
+    MAX_CHUNK = 4096
+    # 距离上一批超过该时间(秒)时,即使数量不够也发送
+    CHUNK_INTERVAL = 0.1
+
+    def __init__(self, root, suffixes, recursive=True, parent=None):
+        """
+        :param root: 需要扫描的目录
+        :param suffixes: 支持的图像后缀集合
+        :param recursive: 是否递归子目录
+        :param parent:
+        """
+        super().__init__(parent)
+        self.root = root
+        self.suffixes = suffixes
+        self.recursive = recursive
+        self._isRunning = True
+
+    def run(self):
+        start = last_emit = time.perf_counter()
+        chunk_size = self.FIRST_CHUNK
+        chunk = []
+        count = 0
+        directories = []
+        for path in iter_image_files(self.root, self.suffixes, self.recursive, directories):
+            if not self._isRunning:
+                return
+            chunk.append(path)
+            now = time.perf_counter()
+            if len(chunk) >= chunk_size or now - last_emit >= self.CHUNK_INTERVAL:
+                self.paths_found.emit(chunk)
+                count += len(chunk)
+                chunk = []
+                last_emit = now
+                chunk_size = min(chunk_size * 2, self.MAX_CHUNK)
+        if not self._isRunning:
+            return
+        if chunk:
+            self.paths_found.emit(chunk)
+            count += len(chunk)
+        self.directories_scanned.emit(directories)
+        self.scan_finished.emit(count, time.perf_counter() - start)
+
+    def stop(self):
+        self._isRunning = False
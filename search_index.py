@@ -0,0 +1,427 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 23:10
+"""
+当前图像集合的内存搜索索引: 文件名(以及所在目录名)的词和三元组子串,
+以及格式/宽高/文件大小等属性.
+扫描到图像时增量添加,删除的图像只做标记;索引保存在缓存目录下,重新打开同一个文件夹时直接读取.
+索引文件由 JSON 文件头和原始数组数据组成,读取时只解析数据
+
+查询语法(空格分隔的条件同时满足):
+    cat             文件名或目录名中包含 cat
+    ext:png         格式
+    w>1920 h<=1080  宽度/高度,也可以写成 width/height
+    px>=12m         像素数
+    size>2mb        文件大小,支持 k/m/g 单位
+"""
+import bisect
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from itertools import compress
+
+import numpy as np
+
+from util import get_cache_dir
+
+INDEX_VERSION = 2
+# 索引文件开头的标识
+INDEX_MAGIC = b"HHSI"
+# 匹配的词超过该数量时,短查询退化为逐个比较文件名
+MAX_PREFIX_TOKENS = 4096
+# 删除标记超过存活图像数量时,保存前重建索引
+COMPACT_RATIO = 1.0
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_ATTRIBUTE_RE = re.compile(r"^(ext|format|type|w|width|h|height|px|pixels|size)(:|>=|<=|>|<|=)(.+)$")
+_NUMBER_RE = re.compile(r"^(\d+(?:\.\d+)?)([kmg]?)b?$")
+_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+# 像素数使用十进制单位(12m 表示 1200 万像素)
+_PIXEL_UNITS = {"": 1, "k": 1000, "m": 1000 ** 2, "g": 1000 ** 3}
+_FORMAT_ALIASES = {"jpeg": "jpg", "tif": "tiff"}
+_COMPARE = {":": np.equal, "=": np.equal, ">": np.greater, ">=": np.greater_equal, "<": np.less,
+            "<=": np.less_equal}
+
+
+def index_path(root):
+    """
+    某个文件夹的索引文件路径
+    :param root: 文件夹
+    :return:
+    """
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_cache_dir(), "search", f"{digest}.index")
+
+
+def _match_text(path):
+    """
+    参与匹配的文本: 小写的 "目录名/文件名"
+    :param path:
+    :return:
+    """
+    directory, name = os.path.split(path)
+    return f"{os.path.basename(directory)}/{name}".lower()
+
+
+def _pack_postings(table):
+    """
+    把倒排表拼接成一个数组
+    :param table: key -> array('I')
+    :return: (key 列表, 每个 key 的起始位置 array('Q'), 拼接后的编号 array('I'))
+    """
+    keys = list(table)
+    offsets = array("Q", [0])
+    postings = array("I")
+    for key in keys:
+        postings.extend(table[key])
+        offsets.append(len(postings))
+    return keys, offsets, postings
+
+
+def _unpack_postings(keys, offsets, postings):
+    if len(offsets) != len(keys) + 1 or offsets[-1] != len(postings):
+        raise ValueError("倒排表长度不一致")
+    return {key: postings[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+
+
+def _normalize_format(value):
+    value = value.lstrip(".").lower()
+    return _FORMAT_ALIASES.get(value, value)
+
+
+def _parse_number(value, units):
+    match = _NUMBER_RE.match(value)
+    if match is None:
+        return None
+    return float(match.group(1)) * units[match.group(2)]
+
+
+class SearchIndex:
+    """
+    图像编号按添加顺序分配,倒排表(array('I'))中的编号天然有序,
+    查询时通过 numpy 求交集,属性条件在整列上向量化比较
+    """
+
+    def __init__(self):
+        # 编号 -> 图像路径/参与匹配的文本(小写的 "目录名/文件名")
+        self.paths = []
+        self.texts = []
+        # 图像路径 -> 编号
+        self.ids = {}
+        # 每个编号是否仍然存在
+        self.alive = array("b")
+        # 属性列,未知时为 -1
+        self.formats = array("H")
+        self.format_codes = {}
+        self.width = array("i")
+        self.height = array("i")
+        self.size = array("q")
+        # 三元组/词 -> 编号列表
+        self.trigrams = {}
+        self.tokens = {}
+        # 按字典序排列的词,用于前缀匹配,添加新词后重新生成
+        self._vocabulary = None
+        # 还没有属性的编号
+        self.pending = set()
+        self.dirty = False
+        # 添加/删除图像的次数,用于判断缓存的图像列表编号是否失效
+        self._version = 0
+        # 上一次筛选的图像列表以及其中每张图像的编号
+        self._positions_key = None
+        self._positions_paths = None
+        self._positions = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add_paths(self, paths):
+        """
+        添加图像,已经存在的图像直接恢复
+        :param paths:
+        :return:
+        """
+        for path in paths:
+            doc_id = self.ids.get(path)
+            if doc_id is not None:
+                self.alive[doc_id] = 1
+                continue
+            doc_id = len(self.paths)
+            text = _match_text(path)
+            self.paths.append(path)
+            self.texts.append(text)
+            self.ids[path] = doc_id
+            self.alive.append(1)
+            ext = _normalize_format(os.path.splitext(path)[1])
+            self.formats.append(self.format_codes.setdefault(ext, len(self.format_codes)))
+            self.width.append(-1)
+            self.height.append(-1)
+            self.size.append(-1)
+            self.pending.add(doc_id)
+            for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                postings = self.trigrams.get(trigram)
+                if postings is None:
+                    postings = self.trigrams[trigram] = array("I")
+                postings.append(doc_id)
+            for token in set(_TOKEN_RE.findall(text)):
+                postings = self.tokens.get(token)
+                if postings is None:
+                    postings = self.tokens[token] = array("I")
+                    self._vocabulary = None
+                postings.append(doc_id)
+        self._version += 1
+        self.dirty = True
+
+    def remove_paths(self, paths):
+        for path in paths:
+            doc_id = self.ids.get(path)
+            if doc_id is not None:
+                self.alive[doc_id] = 0
+        self._version += 1
+        self.dirty = True
+
+    def retain(self, paths):
+        """
+        只保留给定的图像(例如读取已保存的索引后,重新扫描发现已经删除的图像)
+        :param paths: 图像路径集合
+        :return:
+        """
+        self.remove_paths([path for path in self.paths if path not in paths])
+
+    def pending_paths(self):
+        """
+        :return: 还没有属性的图像路径
+        """
+        return [self.paths[doc_id] for doc_id in self.pending if self.alive[doc_id]]
+
+    def invalidate_attributes(self, paths):
+        """
+        图像被修改,下次元数据更新时重新读取属性
+        :param paths:
+        :return:
+        """
+        self.pending.update(self.ids[path] for path in paths if path in self.ids)
+
+    def set_attributes(self, rows):
+        """
+        :param rows: [(图像路径, 宽, 高, 文件大小), ...],未知的值为 None
+        :return:
+        """
+        for path, width, height, size in rows:
+            doc_id = self.ids.get(path)
+            if doc_id is None:
+                continue
+            self.width[doc_id] = -1 if width is None else width
+            self.height[doc_id] = -1 if height is None else height
+            self.size[doc_id] = -1 if size is None else size
+            self.pending.discard(doc_id)
+        self.dirty = True
+
+    def search(self, query):
+        """
+        :param query: 查询语句
+        :return: 按编号的匹配结果 bool 数组
+        """
+        mask = np.frombuffer(self.alive, np.int8).astype(bool)
+        for term in query.lower().split():
+            match = _ATTRIBUTE_RE.match(term)
+            mask &= self._attribute_mask(*match.groups()) if match else self._text_mask(term)
+        return mask
+
+    def filter(self, paths, query):
+        """
+        按查询条件筛选图像列表,保持原来的顺序
+        :param paths: 图像路径列表
+        :param query: 查询语句
+        :return:
+        """
+        # 同一个图像列表重复搜索时(输入搜索语句的过程中)不需要重新查找每张图像的编号
+        if self._positions_key != (id(paths), len(paths), self._version):
+            ids = self.ids
+            # 不在索引中的图像指向末尾追加的 False
+            self._positions = np.fromiter((ids.get(path, -1) for path in paths), np.int64, len(paths))
+            # 同时保留列表的引用,避免列表释放后 id 被新的列表复用
+            self._positions_key = (id(paths), len(paths), self._version)
+            self._positions_paths = paths
+        hits = np.append(self.search(query), False)[self._positions]
+        return list(compress(paths, hits.tolist()))
+
+    def _postings(self, key, table):
+        return np.frombuffer(table[key], np.uint32)
+
+    def _text_mask(self, term):
+        hits = np.zeros(len(self.paths), bool)
+        if len(term) >= 3:
+            # 所有三元组的倒排表求交集,超过 3 个字符时再确认是连续的子串
+            trigrams = {term[i:i + 3] for i in range(len(term) - 2)}
+            if any(trigram not in self.trigrams for trigram in trigrams):
+                return hits
+            trigrams = sorted(trigrams, key=lambda trigram: len(self.trigrams[trigram]))
+            ids = self._postings(trigrams[0], self.trigrams)
+            for trigram in trigrams[1:]:
+                ids = np.intersect1d(ids, self._postings(trigram, self.trigrams), assume_unique=True)
+            if len(term) > 3:
+                texts = self.texts
+                ids = [doc_id for doc_id in ids.tolist() if term in texts[doc_id]]
+            hits[ids] = True
+            return hits
+        # 短查询按词的前缀匹配
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.tokens)
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, term)
+        end = bisect.bisect_left(vocabulary, term + "\U0010ffff", start)
+        if end - start > MAX_PREFIX_TOKENS:
+            return np.fromiter((term in text for text in self.texts), bool, len(self.texts))
+        for token in vocabulary[start:end]:
+            hits[self._postings(token, self.tokens)] = True
+        return hits
+
+    def _attribute_mask(self, key, op, value):
+        count = len(self.paths)
+        if key in ("ext", "format", "type"):
+            code = self.format_codes.get(_normalize_format(value))
+            if code is None or op not in (":", "="):
+                return np.zeros(count, bool)
+            return np.frombuffer(self.formats, np.uint16) == code
+        number = _parse_number(value, _PIXEL_UNITS if key in ("px", "pixels") else _UNITS)
+        if number is None:
+            return np.zeros(count, bool)
+        if key in ("w", "width"):
+            column = np.frombuffer(self.width, np.int32)
+        elif key in ("h", "height"):
+            column = np.frombuffer(self.height, np.int32)
+        elif key == "size":
+            column = np.frombuffer(self.size, np.int64)
+        else:
+            width = np.frombuffer(self.width, np.int32)
+            column = np.where(width >= 0, width.astype(np.int64) * np.frombuffer(self.height, np.int32), -1)
+        return (column >= 0) & _COMPARE[op](column, number)
+
+    def compacted(self):
+        """
+        去掉删除标记,重新编号
+        :return: 新的 SearchIndex
+        """
+        index = SearchIndex()
+        alive = [doc_id for doc_id in range(len(self.paths)) if self.alive[doc_id]]
+        index.add_paths([self.paths[doc_id] for doc_id in alive])
+        index.set_attributes([(self.paths[doc_id], self.width[doc_id], self.height[doc_id], self.size[doc_id])
+                              for doc_id in alive])
+        index.pending = {new_id for new_id, doc_id in enumerate(alive) if doc_id in self.pending}
+        return index
+
+    def snapshot(self):
+        """
+        复制一份独立的索引,交给后台线程保存,之后对原索引的修改不影响副本
+        :return: SearchIndex
+        """
+        index = SearchIndex()
+        index.paths = list(self.paths)
+        index.texts = list(self.texts)
+        index.ids = dict(self.ids)
+        index.format_codes = dict(self.format_codes)
+        for name in ("alive", "formats", "width", "height", "size"):
+            setattr(index, name, getattr(self, name)[:])
+        index.trigrams = {key: postings[:] for key, postings in self.trigrams.items()}
+        index.tokens = {key: postings[:] for key, postings in self.tokens.items()}
+        index.pending = set(self.pending)
+        return index
+
+    def save(self, path):
+        """
+        保存索引,删除标记过多时先重建.
+        文件格式: 标识 + 文件头长度(uint32) + JSON 文件头 + 各个数组的原始数据
+        :param path: 索引文件路径
+        :return:
+        """
+        index = self
+        dead = len(self.paths) - sum(self.alive)
+        if dead > sum(self.alive) * COMPACT_RATIO:
+            index = self.compacted()
+        trigram_keys, trigram_offsets, trigram_postings = _pack_postings(index.trigrams)
+        token_keys, token_offsets, token_postings = _pack_postings(index.tokens)
+        arrays = {"alive": index.alive, "formats": index.formats, "width": index.width, "height": index.height,
+                  "size": index.size, "trigram_offsets": trigram_offsets, "trigram_postings": trigram_postings,
+                  "token_offsets": token_offsets, "token_postings": token_postings}
+        layout = {}
+        offset = 0
+        for name, data in arrays.items():
+            layout[name] = [data.typecode, data.itemsize, len(data), offset]
+            offset += len(data) * data.itemsize
+        header = json.dumps({"version": INDEX_VERSION, "byteorder": sys.byteorder, "paths": index.paths,
+                             "format_codes": index.format_codes, "trigrams": trigram_keys, "tokens": token_keys,
+                             "arrays": layout}, ensure_ascii=False).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as fout:
+            fout.write(INDEX_MAGIC + struct.pack("<I", len(header)) + header)
+            for data in arrays.values():
+                data.tofile(fout)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        """
+        读取保存的索引,文件不存在/损坏/版本不一致时返回空索引.
+        读取后所有图像先标记为删除,重新扫描到时恢复;保存的属性在元数据更新之前继续使用
+        :param path: 索引文件路径
+        :return: SearchIndex
+        """
+        index = cls()
+        try:
+            with open(path, "rb") as fin:
+                data = fin.read()
+        except FileNotFoundError:
+            return index
+        except OSError as e:
+            print(f"搜索索引文件无法读取,重新创建: {e}")
+            return index
+        try:
+            return cls._decode(data)
+        except (ValueError, KeyError, TypeError, IndexError, struct.error) as e:
+            # json.JSONDecodeError/UnicodeDecodeError 都是 ValueError 的子类
+            print(f"搜索索引文件损坏,重新创建: {e}")
+            return index
+
+    @classmethod
+    def _decode(cls, data):
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("不是搜索索引文件")
+        start = len(INDEX_MAGIC) + 4
+        header_size = struct.unpack_from("<I", data, len(INDEX_MAGIC))[0]
+        header = json.loads(data[start:start + header_size].decode("utf-8"))
+        if header.get("version") != INDEX_VERSION:
+            return cls()
+        body = memoryview(data)[start + header_size:]
+        arrays = {}
+        for name, (typecode, itemsize, count, offset) in header["arrays"].items():
+            values = array(typecode)
+            if values.itemsize != itemsize or offset < 0 or offset + count * itemsize > len(body):
+                raise ValueError(f"数组 {name} 的长度不一致")
+            values.frombytes(body[offset:offset + count * itemsize])
+            if header["byteorder"] != sys.byteorder:
+                values.byteswap()
+            arrays[name] = values
+        index = cls()
+        index.paths = [str(path) for path in header["paths"]]
+        count = len(index.paths)
+        for name in ("alive", "formats", "width", "height", "size"):
+            if len(arrays[name]) != count:
+                raise ValueError(f"数组 {name} 的长度不一致")
+            setattr(index, name, arrays[name])
+        index.format_codes = {str(ext): int(code) for ext, code in header["format_codes"].items()}
+        index.trigrams = _unpack_postings(header["trigrams"], arrays["trigram_offsets"], arrays["trigram_postings"])
+        index.tokens = _unpack_postings(header["tokens"], arrays["token_offsets"], arrays["token_postings"])
+        if any(postings and postings[-1] >= count
+               for table in (index.trigrams, index.tokens) for postings in table.values()):
+            raise ValueError("倒排表中的编号超出范围")
+        index.texts = [_match_text(path) for path in index.paths]
+        index.alive = array("b", bytes(count))
+        index.pending = set(range(count))
+        index.ids = {path: doc_id for doc_id, path in enumerate(index.paths)}
+        return index
@@ -0,0 +1,270 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 13:20
+"""
+缩略图列表的数据模型
+"""
+import bisect
+import os
+
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer, Signal
+from PySide6.QtGui import QPixmap
+
+from util import THUMBNAIL_SIZE
+
+
+class ThumbnailListModel(QAbstractListModel):
+    """
+    缩略图列表模型,只有视图实际绘制到的行才会请求加载缩略图,
+    选中状态也保存在模型中
+    """
+    PathRole = Qt.ItemDataRole.UserRole + 1
+    SelectedRole = Qt.ItemDataRole.UserRole + 2
+
+    # 请求加载缩略图 [行号, ...]
+    thumbnails_requested = Signal(list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.paths = []
+        # 图像路径 -> 行号,文件夹变化时按路径查找行不需要遍历整个列表
+        self._rows = {}
+        # 缩略图边长
+        self.edge = THUMBNAIL_SIZE
+        # 已加载的缩略图 行号 -> QPixmap
+        self._pixmaps = {}
+        # 按旧边长加载的缩略图,显示时先缩放旧图,同时重新请求
+        self._stale = set()
+        # 已经请求但还没有加载完成的行
+        self._requested = set()
+        # 本轮事件循环中新请求的行,合并后一次性发送
+        self._new_requests = []
+        self.selected_row = -1
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self._pixmaps.get(row)
+            if pixmap is None or row in self._stale:
+                self._request(row)
+            return pixmap
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return os.path.basename(self.paths[row])
+        if role == self.PathRole:
+            return self.paths[row]
+        if role == self.SelectedRole:
+            return row == self.selected_row
+        return None
+
+    def row_of(self, path):
+        """
+        :param path:
+        :return: 图像所在的行号,不在列表中时返回 -1
+        """
+        return self._rows.get(path, -1)
+
+    def _reindex(self, first=0):
+        """
+        重新记录 first 之后每一行的行号
+        :param first:
+        :return:
+        """
+        self._rows.update(zip(self.paths[first:], range(first, len(self.paths))))
+
+    def _request(self, row):
+        if row in self._requested:
+            return
+        self._requested.add(row)
+        if not self._new_requests:
+            QTimer.singleShot(0, self._emit_requests)
+        self._new_requests.append(row)
+
+    def _emit_requests(self):
+        rows, self._new_requests = self._new_requests, []
+        # 发送之前已经被释放的行不再加载
+        rows = [row for row in rows if row in self._requested]
+        if rows:
+            self.thumbnails_requested.emit(rows)
+
+    def set_paths(self, paths):
+        """
+        重置图像列表
+        :param paths:
+        :return:
+        """
+        self.beginResetModel()
+        self.paths = list(paths)
+        self._rows = {}
+        self._reindex()
+        self._pixmaps.clear()
+        self._stale.clear()
+        self._requested.clear()
+        self._new_requests = []
+        self.selected_row = -1
+        self.endResetModel()
+
+    def reorder(self, paths):
+        """
+        按新的顺序显示图像(排序/筛选),在原列表上修改,保持选中的图像不变,
+        已加载的缩略图按路径移动到新的行,不需要重新加载
+        :param paths:
+        :return:
+        """
+        selected = self.paths[self.selected_row] if 0 <= self.selected_row < len(self.paths) else None
+        pixmaps = {self.paths[row]: pixmap for row, pixmap in self._pixmaps.items()}
+        stale = {self.paths[row] for row in self._stale}
+        self.beginResetModel()
+        self.paths[:] = paths
+        self._rows = {}
+        self._reindex()
+        self._pixmaps = {self._rows[path]: pixmap for path, pixmap in pixmaps.items() if path in self._rows}
+        self._stale = {self._rows[path] for path in stale if path in self._rows}
+        self._requested.clear()
+        self._new_requests = []
+        self.selected_row = self.row_of(selected) if selected is not None else -1
+        self.endResetModel()
+
+    def append_paths(self, paths):
+        """
+        在末尾追加图像(目录扫描时分批追加)
+        :param paths:
+        :return:
+        """
+        if not paths:
+            return
+        first = len(self.paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(paths) - 1)
+        self.paths.extend(paths)
+        self._reindex(first)
+        self.endInsertRows()
+
+    def remove_paths(self, paths):
+        """
+        删除图像(监视的目录中文件被删除),后面的行依次前移,
+        已加载的缩略图跟随移动,排队中的请求需要重新发起
+        :param paths: 需要删除的图像路径集合
+        :return: 被删除的第一行的行号,没有删除任何行时返回 -1
+        """
+        rows = sorted({self._rows[path] for path in paths if path in self._rows})
+        if not rows:
+            return -1
+        # 从后往前按连续区间删除
+        end = len(rows) - 1
+        while end >= 0:
+            start = end
+            while start > 0 and rows[start - 1] == rows[start] - 1:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), rows[start], rows[end])
+            del self.paths[rows[start]:rows[end] + 1]
+            self.endRemoveRows()
+            end = start - 1
+
+        first = rows[0]
+        removed = set(rows)
+        for path in paths:
+            self._rows.pop(path, None)
+        # 只有被删除的第一行之后的行号需要更新
+        self._reindex(first)
+
+        def shift(row):
+            return row - bisect.bisect_left(rows, row)
+
+        self._pixmaps = {shift(row): pixmap for row, pixmap in self._pixmaps.items() if row not in removed}
+        self._stale = {shift(row) for row in self._stale if row not in removed}
+        self._requested = {row for row in self._requested if row < first}
+        self._new_requests = [row for row in self._new_requests if row < first]
+        if self.selected_row in removed:
+            self.selected_row = -1
+        elif self.selected_row > first:
+            self.selected_row = shift(self.selected_row)
+        return first
+
+    def refresh_paths(self, paths):
+        """
+        图像文件被修改后重新加载缩略图,新缩略图加载完成前继续显示旧图
+        :param paths: 被修改的图像路径集合
+        :return:
+        """
+        for path in paths:
+            row = self._rows.get(path, -1)
+            if row < 0:
+                continue
+            self._requested.discard(row)
+            if row in self._pixmaps:
+                self._stale.add(row)
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def set_edge(self, edge):
+        """
+        修改缩略图边长,已加载的缩略图标记为过期,
+        过期的缩略图继续缩放显示,直到视图重新请求的新尺寸缩略图加载完成
+        :param edge:
+        :return:
+        """
+        if edge == self.edge:
+            return
+        self.edge = edge
+        self._stale = set(self._pixmaps)
+        self._requested.clear()
+        if self.paths:
+            self.dataChanged.emit(self.index(0), self.index(len(self.paths) - 1),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+    def set_thumbnail(self, row, path, img):
+        """
+        设置加载完成的缩略图
+        :param row: 行号
+        :param path: 请求时该行的图像路径
+        :param img: QImage
+        :return:
+        """
+        # 已经被释放的行直接丢弃;排序/筛选/删除之后行号已经对应其他图像,
+        # 正在解码中的任务仍然会按旧的行号返回结果,同样丢弃,等待新的请求
+        if row not in self._requested or row >= len(self.paths) or self.paths[row] != path:
+            return
+        self._requested.discard(row)
+        self._stale.discard(row)
+        if img.isNull():
+            # 解码失败的图像使用空图占位,避免反复请求
+            self._pixmaps[row] = QPixmap()
+        else:
+            self._pixmaps[row] = QPixmap.fromImage(img)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def mark_requested(self, first, last):
+        """
+        把 [first, last] 范围内还没有加载也没有请求的行标记为已请求
+        :param first:
+        :param last:
+        :return: 新标记的行号列表
+        """
+        rows = [row for row in range(max(first, 0), min(last, len(self.paths) - 1) + 1)
+                if (row not in self._pixmaps or row in self._stale) and row not in self._requested]
+        self._requested.update(rows)
+        return rows
+
+    def release_outside(self, first, last):
+        """
+        释放 [first, last] 范围之外的缩略图
+        :param first:
+        :param last:
+        :return:
+        """
+        for row in [row for row in self._pixmaps if row < first or row > last]:
+            del self._pixmaps[row]
+            self._stale.discard(row)
+        self._requested = {row for row in self._requested if first <= row <= last}
+
+    def set_selected_row(self, row):
+        old_row, self.selected_row = self.selected_row, row
+        for changed in (old_row, row):
+            if 0 <= changed < len(self.paths):
+                index = self.index(changed)
+                self.dataChanged.emit(index, index, [self.SelectedRole])
@@ -0,0 +1,356 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 10:12
+"""
+持久化的磁盘缩略图缓存
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PySide6.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from PySide6.QtGui import QImage
+
+from util import PREVIEW_EDGES, get_cache_dir
+
+# 磁盘缓存默认的容量上限
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ThumbnailStore:
+    """
+    基于单个 SQLite 文件的缩略图缓存,
+    key 为 (图像路径, 修改时间, 文件大小, 缩略图边长),
+    写入在后台线程中批量进行,超过容量上限时按照最近访问时间淘汰
+    """
+    # 批量写入时每批最多处理的条目数
+    WRITE_BATCH = 64
+    # 淘汰时降到容量上限的比例,避免频繁淘汰
+    EVICT_RATIO = 0.9
+
+    def __init__(self, db_path=None, max_bytes=None, image_format="PNG"):
+        """
+        :param db_path: 缓存文件路径,默认放在用户缓存目录下
+        :param max_bytes: 缓存容量上限(字节),为 0 时不淘汰,
+            为 None 时使用 set_max_bytes 保存在缓存文件中的上限,没有保存过时为 DEFAULT_MAX_BYTES
+        :param image_format: 缩略图编码格式
+        """
+        self.db_path = db_path or os.path.join(get_cache_dir(), "thumbnails.db")
+        self.image_format = image_format
+        # sqlite 连接在多个线程中共享,需要加锁
+        self.lock = threading.Lock()
+        self.conn = self._open()
+        self.max_bytes = self._query_max_bytes() if max_bytes is None else max_bytes
+        self.total_bytes = self._query_total_bytes()
+        self.hits = 0
+        self.misses = 0
+        # 因为超出容量上限被淘汰的条目数
+        self.evicted = 0
+        # 后台写入队列
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="ThumbnailStoreWriter", daemon=True)
+        self._writer.start()
+
+    def _open(self):
+        """
+        打开缓存文件,只有文件损坏时才删除后重建,无法打开时使用内存数据库
+        :return:
+        """
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            return self._connect()
+        except (sqlite3.OperationalError, OSError) as e:
+            # 文件被锁定/磁盘只读等都不是文件损坏,不能删除(可能正被另一个实例使用),
+            # 改用内存数据库,本次运行不使用磁盘缓存
+            print(f"缩略图缓存文件无法打开,不使用磁盘缓存: {e}")
+            self.db_path = ":memory:"
+            return self._connect()
+        except sqlite3.DatabaseError as e:
+            print(f"缩略图缓存文件损坏,重新创建: {e}")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            return self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS thumbnails (
+                    path TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    edge INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    nbytes INTEGER NOT NULL,
+                    atime REAL NOT NULL,
+                    PRIMARY KEY (path, mtime, size, edge)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_thumbnails_atime ON thumbnails (atime)")
+            # 图像的感知哈希,与缩略图尺寸无关
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS hashes (
+                    path TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    hash INTEGER NOT NULL,
+                    PRIMARY KEY (path, mtime, size)
+                )""")
+            # 缓存的设置(容量上限),批处理工具修改后 GUI 也使用相同的上限
+            conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # 读一次表,尽早发现损坏的文件
+            conn.execute("SELECT COUNT(*) FROM thumbnails").fetchone()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def _query_max_bytes(self):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM settings WHERE key='max_bytes'").fetchone()
+        return DEFAULT_MAX_BYTES if row is None else row[0]
+
+    def set_max_bytes(self, max_bytes):
+        """
+        修改容量上限并保存到缓存文件中,之后打开缓存(包括 GUI)都使用这个上限
+        :param max_bytes: 字节数,为 0 时不淘汰
+        :return:
+        """
+        self.max_bytes = max_bytes
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO settings VALUES ('max_bytes', ?)", (max_bytes,))
+
+    def _query_total_bytes(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM thumbnails").fetchone()[0]
+
+    @staticmethod
+    def make_key(path, edge):
+        """
+        生成缓存 key
+        :param path: 图像路径
+        :param edge: 缩略图边长
+        :return: (path, mtime, size, edge),文件不存在时返回 None
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return os.path.abspath(path), st.st_mtime_ns, st.st_size, edge
+
+    def contains(self, key):
+        """
+        查询缓存中是否存在某个 key,不读取图像数据
+        :param key: make_key 生成的 key
+        :return:
+        """
+        if key is None:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM thumbnails WHERE path=? AND mtime=? AND size=? AND edge=?", key).fetchone()
+        return row is not None
+
+    def get(self, key):
+        """
+        查询缓存
+        :param key: make_key 生成的 key
+        :return: QImage,未命中时返回 None
+        """
+        if key is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM thumbnails WHERE path=? AND mtime=? AND size=? AND edge=?", key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        img = QImage.fromData(row[0])
+        if img.isNull():
+            # 损坏的条目直接删除
+            self._queue.put(("delete", key))
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._queue.put(("touch", key))
+        return img
+
+    def put(self, key, img):
+        """
+        异步写入缓存
+        :param key: make_key 生成的 key
+        :param img: QImage
+        :return:
+        """
+        if key is None or img.isNull():
+            return
+        self._queue.put(("put", key, img))
+
+    def put_encoded(self, key, data):
+        """
+        异步写入已经编码好的缩略图(批处理进程中编码)
+        :param key: make_key 生成的 key
+        :param data: 编码后的图像数据 bytes
+        :return:
+        """
+        if key is None or not data:
+            return
+        self._queue.put(("put", key, data))
+
+    def get_hash(self, key):
+        """
+        查询图像的感知哈希
+        :param key: make_key 生成的 key,忽略其中的边长
+        :return: 64 位无符号整数,未缓存时返回 None
+        """
+        if key is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM hashes WHERE path=? AND mtime=? AND size=?", key[:3]).fetchone()
+        if row is None:
+            return None
+        # sqlite 的整数是有符号的
+        return row[0] & 0xFFFFFFFFFFFFFFFF
+
+    def put_hash(self, key, value):
+        """
+        异步写入图像的感知哈希
+        :param key: make_key 生成的 key,忽略其中的边长
+        :param value: 64 位无符号整数
+        :return:
+        """
+        if key is None or value is None:
+            return
+        self._queue.put(("hash", key[:3], value - (1 << 64) if value >= 1 << 63 else value))
+
+    def get_preview(self, path, width, height):
+        """
+        从缓存中查找批处理生成的预览图,取能覆盖目标尺寸的最小边长,再缩放到目标尺寸
+        :param path: 图像路径
+        :param width: 目标宽度
+        :param height: 目标高度
+        :return: QImage,未命中时返回 None
+        """
+        for edge in PREVIEW_EDGES:
+            if edge < max(width, height):
+                continue
+            img = self.get(self.make_key(path, edge))
+            if img is not None:
+                return img.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio,
+                                  Qt.TransformationMode.SmoothTransformation)
+        return None
+
+    def invalidate(self, path):
+        """
+        删除某个图像的全部缓存条目
+        :param path:
+        :return:
+        """
+        self._queue.put(("invalidate", os.path.abspath(path)))
+
+    def _encode(self, img):
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        img.save(buffer, self.image_format)
+        buffer.close()
+        return data.data()
+
+    def _write_loop(self):
+        while True:
+            ops = [self._queue.get()]
+            # 尽量把积压的操作合并到一个事务中
+            while len(ops) < self.WRITE_BATCH:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(op is None for op in ops)
+            try:
+                self._apply([op for op in ops if op is not None])
+            except sqlite3.Error as e:
+                print(f"缩略图缓存写入失败: {e}")
+            for _ in ops:
+                self._queue.task_done()
+            if stop:
+                break
+
+    def _apply(self, ops):
+        if not ops:
+            return
+        now = time.time()
+        # 编码放在锁外面进行
+        rows = [(op[1], op[2] if isinstance(op[2], bytes) else self._encode(op[2])) if op[0] == "put" else None
+                for op in ops]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for op, row in zip(ops, rows):
+                    if op[0] == "put":
+                        key, data = row
+                        old = self.conn.execute(
+                            "SELECT nbytes FROM thumbnails WHERE path=? AND mtime=? AND size=? AND edge=?",
+                            key).fetchone()
+                        self.conn.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                          (*key, data, len(data), now))
+                        self.total_bytes += len(data) - (old[0] if old else 0)
+                    elif op[0] == "touch":
+                        self.conn.execute(
+                            "UPDATE thumbnails SET atime=? WHERE path=? AND mtime=? AND size=? AND edge=?",
+                            (now, *op[1]))
+                    elif op[0] == "delete":
+                        self.conn.execute(
+                            "DELETE FROM thumbnails WHERE path=? AND mtime=? AND size=? AND edge=?", op[1])
+                    elif op[0] == "hash":
+                        self.conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", (*op[1], op[2]))
+                    elif op[0] == "invalidate":
+                        self.conn.execute("DELETE FROM thumbnails WHERE path=?", (op[1],))
+                        self.conn.execute("DELETE FROM hashes WHERE path=?", (op[1],))
+                if any(op[0] in ("delete", "invalidate") for op in ops):
+                    self.total_bytes = self.conn.execute(
+                        "SELECT COALESCE(SUM(nbytes), 0) FROM thumbnails").fetchone()[0]
+                if self.max_bytes and self.total_bytes > self.max_bytes:
+                    self._evict()
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        """
+        按照最近访问时间淘汰,直到低于容量上限
+        需要在持有锁的事务中调用
+        :return:
+        """
+        target = self.max_bytes * self.EVICT_RATIO
+        freed = 0
+        cutoff = None
+        for atime, nbytes in self.conn.execute("SELECT atime, nbytes FROM thumbnails ORDER BY atime"):
+            freed += nbytes
+            cutoff = atime
+            if self.total_bytes - freed <= target:
+                break
+        if cutoff is not None:
+            freed = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM thumbnails WHERE atime<=?",
+                                      (cutoff,)).fetchone()[0]
+            self.evicted += self.conn.execute("DELETE FROM thumbnails WHERE atime<=?", (cutoff,)).rowcount
+            self.total_bytes -= freed
+
+    def flush(self):
+        """
+        等待所有排队的写入完成
+        :return:
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,330 @@
+# -*- coding:utf-8 -*-
+# author:lyrichu@foxmail.com
+# @Time: 2026/10/18 15:40
+"""
+超大图像的分块多分辨率预览
+"""
+import math
+from collections import OrderedDict
+
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, QRect, QRectF, QSize, Signal, QMutex
+from PySide6.QtGui import QImage, QImageReader, QImageIOHandler, QPixmap, QColor, QPainter
+from PySide6.QtWidgets import QGraphicsObject, QGraphicsItem
+
+# 像素数超过该值的图像使用分块预览
+TILED_PREVIEW_MIN_PIXELS = 40 * 1000 * 1000
+# 分块边长
+TILE_SIZE = 256
+# 分块缓存默认容量
+DEFAULT_TILE_CACHE_BYTES = 128 * 1024 * 1024
+
+
+def should_use_tiles(path):
+    """
+    判断图像是否需要使用分块预览(只读取文件头)
+    :param path:
+    :return:
+    """
+    reader = QImageReader(path)
+    size = reader.size()
+    if not size.isValid():
+        return False
+    # 带旋转信息的图像分块坐标和显示坐标不一致,使用普通预览
+    if reader.transformation() != QImageIOHandler.Transformation.TransformationNone:
+        return False
+    return size.width() * size.height() >= TILED_PREVIEW_MIN_PIXELS
+
+
+class TileTask(QRunnable):
+    """
+    解码单个分块(或者整层图像)的任务
+    """
+
+    def __init__(self, loader, key, path, clip_rect, scaled_size):
+        """
+        :param loader: TileLoader
+        :param key: 分块 key (层级, 列, 行),整层图像的列和行为 -1
+        :param path: 图像路径
+        :param clip_rect: 原图中的裁剪区域,为 None 时解码整幅图像
+        :param scaled_size: 解码后的尺寸
+        """
+        super().__init__()
+        self.setAutoDelete(False)
+        self.loader = loader
+        self.key = key
+        self.path = path
+        self.clip_rect = clip_rect
+        self.scaled_size = scaled_size
+
+    def run(self):
+        if not self.loader.task_started(self):
+            return
+        reader = QImageReader(self.path)
+        if self.clip_rect is not None:
+            reader.setClipRect(self.clip_rect)
+        reader.setScaledSize(self.scaled_size)
+        img = reader.read()
+        if img.isNull():
+            # 不支持缩放解码的格式仍然按原图尺寸解码,超大图像会超出 QImageReader 的内存分配上限
+            self.loader.tile_failed.emit(self.key, reader.errorString())
+            return
+        self.loader.tile_decoded.emit(self.key, img)
+
+
+class TileLoader(QObject):
+    """
+    分块解码任务的调度器,不挂在图形项上,避免图形项被场景删除后后台线程访问失效的对象
+    """
+    # 分块解码完成 (分块 key, QImage)
+    tile_decoded = Signal(object, QImage)
+    # 分块解码失败 (分块 key, 错误信息)
+    tile_failed = Signal(object, str)
+
+    # 所有分块预览共享的线程池
+    _pool = None
+
+    def __init__(self):
+        super().__init__()
+        if TileLoader._pool is None:
+            TileLoader._pool = QThreadPool()
+            TileLoader._pool.setMaxThreadCount(4)
+        self.pool = TileLoader._pool
+        # 排队中的任务 key -> TileTask,线程池中的任务开始执行时也会修改,需要加锁
+        self.mutex = QMutex()
+        self._queued = {}
+
+    def request(self, task):
+        self.mutex.lock()
+        if task.key not in self._queued:
+            self._queued[task.key] = task
+            # 层级越低(越清晰)越晚需要,先解码粗糙的层级
+            self.pool.start(task, task.key[0])
+        self.mutex.unlock()
+
+    def task_started(self, task):
+        self.mutex.lock()
+        started = self._queued.pop(task.key, None) is task
+        self.mutex.unlock()
+        return started
+
+    def is_pending(self, key):
+        self.mutex.lock()
+        pending = key in self._queued
+        self.mutex.unlock()
+        return pending
+
+    def cancel(self, keep):
+        """
+        取消排队中不满足条件的任务
+        :param keep: 判断是否保留任务的函数 key -> bool
+        :return: 被取消的 key 列表
+        """
+        cancelled = []
+        self.mutex.lock()
+        for key, task in list(self._queued.items()):
+            if not keep(key) and self.pool.tryTake(task):
+                del self._queued[key]
+                cancelled.append(key)
+        self.mutex.unlock()
+        return cancelled
+
+    def stop(self):
+        self.mutex.lock()
+        for task in self._queued.values():
+            self.pool.tryTake(task)
+        self._queued.clear()
+        self.mutex.unlock()
+
+
+class TiledImageItem(QGraphicsObject):
+    """
+    分块多分辨率预览图形项.
+    图形项在场景中的尺寸与普通预览图一致(适配预览区域),
+    绘制时根据当前缩放比例选择分辨率层级,只解码与可见区域相交的分块,
+    分块按照 LRU 缓存,在后台线程中加载
+    """
+
+    def __init__(self, path, display_size, tile_size=TILE_SIZE, max_bytes=DEFAULT_TILE_CACHE_BYTES, parent=None):
+        """
+        :param path: 图像路径
+        :param display_size: 图形项在场景中的尺寸 QSize
+        :param tile_size: 分块边长
+        :param max_bytes: 分块缓存容量(字节)
+        :param parent:
+        """
+        super().__init__(parent)
+        self.path = path
+        self.display_size = display_size
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        reader = QImageReader(path)
+        self.source_size = reader.size()
+        # 不支持裁剪解码的格式只能整层解码后再切分
+        self.supports_clip = reader.supportsOption(QImageIOHandler.ImageOption.ClipRect)
+        # 原图像素 / 场景单位
+        self.source_scale = self.source_size.width() / max(display_size.width(), 1)
+        # 最粗糙的层级不超过一个分块
+        longest = max(self.source_size.width(), self.source_size.height())
+        self.max_level = max(math.ceil(math.log2(max(longest / tile_size, 1))), 0)
+        self.min_level = 0 if self.supports_clip else self._min_whole_level()
+        self.level = self.max_level
+        # 分块缓存 key -> (QPixmap 或者 QImage, 字节数)
+        self._cache = OrderedDict()
+        self.total_bytes = 0
+        self.base_pixmap = None
+        # 解码失败的分块,不再重复请求
+        self._failed = set()
+        # 整层图像解码失败时的错误信息,显示在预览区域中
+        self.error = None
+        self.loader = TileLoader()
+        self.loader.tile_decoded.connect(self._on_tile_decoded)
+        self.loader.tile_failed.connect(self._on_tile_failed)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        # 先加载最粗糙的一层,作为其它分块还没有加载时的底图
+        self.loader.request(TileTask(self.loader, (self.max_level, -1, -1), path, None,
+                                     self._level_size(self.max_level)))
+
+    def _level_size(self, level):
+        factor = 2 ** level
+        return QSize(max(math.ceil(self.source_size.width() / factor), 1),
+                     max(math.ceil(self.source_size.height() / factor), 1))
+
+    def _min_whole_level(self):
+        """
+        整层解码时,单层图像不能超过缓存容量的一半
+        :return:
+        """
+        level = 0
+        while level < self.max_level:
+            size = self._level_size(level)
+            if size.width() * size.height() * 4 <= self.max_bytes // 2:
+                break
+            level += 1
+        return level
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.display_size.width(), self.display_size.height())
+
+    def _choose_level(self, painter):
+        transform = painter.worldTransform()
+        device_scale = math.hypot(transform.m11(), transform.m12())
+        # 每个屏幕像素对应的原图像素
+        source_per_pixel = self.source_scale / max(device_scale, 1e-6)
+        level = int(math.floor(math.log2(source_per_pixel))) if source_per_pixel > 1 else 0
+        return min(max(level, self.min_level), self.max_level)
+
+    def paint(self, painter, option, widget=None):
+        bounds = self.boundingRect()
+        if self.base_pixmap is None:
+            painter.fillRect(bounds, QColor(200, 200, 200))
+            if self.error is not None:
+                painter.drawText(bounds, Qt.AlignmentFlag.AlignCenter,
+                                 f"图像过大,无法解码\n{self.error}")
+                return
+        else:
+            painter.drawPixmap(bounds, self.base_pixmap, QRectF(self.base_pixmap.rect()))
+        level = self._choose_level(painter)
+        if level != self.level:
+            self.level = level
+            # 层级变化后,其它层级还在排队的分块不再需要
+            self.loader.cancel(lambda key: key[0] == level or key[1] < 0)
+        if level == self.max_level:
+            return
+        exposed = option.exposedRect.intersected(bounds)
+        # 场景单位 -> 当前层级像素
+        to_level = self.source_scale / 2 ** level
+        level_size = self._level_size(level)
+        first_col = max(int(exposed.left() * to_level) // self.tile_size, 0)
+        last_col = min(int(exposed.right() * to_level) // self.tile_size, (level_size.width() - 1) // self.tile_size)
+        first_row = max(int(exposed.top() * to_level) // self.tile_size, 0)
+        last_row = min(int(exposed.bottom() * to_level) // self.tile_size,
+                       (level_size.height() - 1) // self.tile_size)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                tile_rect = QRect(col * self.tile_size, row * self.tile_size, self.tile_size, self.tile_size) \
+                    .intersected(QRect(0, 0, level_size.width(), level_size.height()))
+                pixmap = self._get_tile(level, col, row, tile_rect)
+                if pixmap is not None:
+                    target = QRectF(tile_rect.x() / to_level, tile_rect.y() / to_level,
+                                    tile_rect.width() / to_level, tile_rect.height() / to_level)
+                    painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.restore()
+
+    def _get_tile(self, level, col, row, tile_rect):
+        """
+        获取分块,没有缓存时提交后台任务
+        :return: QPixmap,还没有加载完成时返回 None
+        """
+        key = (level, col, row)
+        item = self._cache.get(key)
+        if item is not None:
+            self._cache.move_to_end(key)
+            return item[0]
+        if key in self._failed:
+            return None
+        if self.supports_clip:
+            if not self.loader.is_pending(key):
+                factor = 2 ** level
+                clip = QRect(tile_rect.x() * factor, tile_rect.y() * factor,
+                             tile_rect.width() * factor, tile_rect.height() * factor) \
+                    .intersected(QRect(0, 0, self.source_size.width(), self.source_size.height()))
+                self.loader.request(TileTask(self.loader, key, self.path, clip, tile_rect.size()))
+            return None
+        # 不支持裁剪解码时,从整层图像中切出分块
+        whole_key = (level, -1, -1)
+        whole = self._cache.get(whole_key)
+        if whole is None:
+            if whole_key not in self._failed and not self.loader.is_pending(whole_key):
+                self.loader.request(TileTask(self.loader, whole_key, self.path, None, self._level_size(level)))
+            return None
+        self._cache.move_to_end(whole_key)
+        pixmap = QPixmap.fromImage(whole[0].copy(tile_rect))
+        self._put(key, pixmap)
+        return pixmap
+
+    def _put(self, key, image):
+        cost = image.width() * image.height() * 4
+        if key in self._cache:
+            self.total_bytes -= self._cache.pop(key)[1]
+        self._cache[key] = (image, cost)
+        self.total_bytes += cost
+        while self.total_bytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, evicted_cost) = self._cache.popitem(last=False)
+            self.total_bytes -= evicted_cost
+
+    def _on_tile_decoded(self, key, img):
+        level, col, row = key
+        if level == self.max_level and col < 0:
+            self.base_pixmap = QPixmap.fromImage(img)
+        elif col < 0:
+            # 整层图像保留为 QImage,用于切分
+            self._put(key, img)
+        else:
+            self._put(key, QPixmap.fromImage(img))
+        self.update()
+
+    def _on_tile_failed(self, key, message):
+        level, col, row = key
+        self._failed.add(key)
+        if col >= 0:
+            # 单个分块失败时继续显示底图
+            return
+        if level < self.max_level:
+            # 整层解码失败,更清晰的层级只会更大,之后停留在更粗糙的层级
+            self.min_level = min(level + 1, self.max_level)
+        elif self.base_pixmap is None:
+            self.error = message or "解码失败"
+        self.update()
+
+    def release(self):
+        """
+        图形项从场景中移除前调用,取消所有后台任务
+        :return:
+        """
+        self.loader.stop()
+        self.loader.tile_decoded.disconnect(self._on_tile_decoded)
+        self.loader.tile_failed.disconnect(self._on_tile_failed)
+        self._cache.clear()
+        self.total_bytes = 0
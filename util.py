@@ -4,7 +4,22 @@
 """
 通用工具类
 """
-from PySide6.QtGui import QImageReader
+import math
+import os
+
+from PySide6.QtCore import Qt, QSize, QStandardPaths
+from PySide6.QtGui import QImageReader, QImageIOHandler
+
+from ingest import open_image_reader
+
+# 缩略图解码的默认边长
+THUMBNAIL_SIZE = 100
+# 缩略图解码边长的档位,列表宽度变化时取不小于显示尺寸的档位,便于复用缓存
+THUMBNAIL_EDGE_BUCKETS = (64, 96, 128, 160, 192, 256, 320, 384, 512, 768, 1024)
+# 预览图尺寸的步长
+PREVIEW_SIZE_STEP = 64
+# 批处理预生成的预览图边长,预览时取能覆盖预览区域的最小边长
+PREVIEW_EDGES = (1024, 2048)
 
 
 def get_supported_img_suffix_list():
@@ -17,3 +32,166 @@ def get_supported_img_suffix_list():
 
 def get_supported_img_suffix_str():
     return f"Images ({' '.join(['*.' + suffix for suffix in get_supported_img_suffix_list()])})"
+
+
+def iter_image_files(root, suffixes, recursive=True, directories=None):
+    """
+    使用 os.scandir 逐个产出目录下的图像文件,不需要先构建完整的文件列表
+    :param root: 目录
+    :param suffixes: 支持的图像后缀集合(小写,不带点)
+    :param recursive: 是否递归子目录
+    :param directories: 不为 None 时,遍历到的目录会追加到该列表中
+    :return: 图像路径生成器
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        if directories is not None:
+            directories.append(directory)
+        sub_dirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1][1:].lower() in suffixes:
+                    yield entry.path
+            except OSError:
+                continue
+        if recursive:
+            # 保持子目录按名称顺序遍历
+            stack.extend(reversed(sub_dirs))
+
+
+def get_cache_dir():
+    """
+    获取程序的缓存目录(缩略图缓存等)
+    :return:
+    """
+    cache_dir = os.path.join(
+        QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation), "hh_img_browser")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_data_dir():
+    """
+    获取程序的数据目录(标注等用户数据,不能像缓存一样随时清除)
+    :return:
+    """
+    data_dir = os.path.join(
+        QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericDataLocation), "hh_img_browser")
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def snap_thumbnail_edge(edge):
+    """
+    把缩略图边长对齐到档位
+    :param edge: 显示边长
+    :return: 不小于 edge 的最小档位
+    """
+    for bucket in THUMBNAIL_EDGE_BUCKETS:
+        if bucket >= edge:
+            return bucket
+    return THUMBNAIL_EDGE_BUCKETS[-1]
+
+
+def snap_preview_size(width, height):
+    """
+    把预览图尺寸向下对齐到 PREVIEW_SIZE_STEP 的整数倍,保证缩放结果不超出预览区域
+    :param width:
+    :param height:
+    :return: (width, height)
+    """
+    return (max(width // PREVIEW_SIZE_STEP, 1) * PREVIEW_SIZE_STEP,
+            max(height // PREVIEW_SIZE_STEP, 1) * PREVIEW_SIZE_STEP)
+
+
+def read_scaled_image(reader, width, height):
+    """
+    从 QImageReader 中按目标尺寸直接解码图像(保持宽高比),
+    JPEG 等格式会在解码阶段做 DCT 缩放,内存和耗时只与目标尺寸相关
+    :param reader: QImageReader
+    :param width: 目标宽度
+    :param height: 目标高度
+    :return: QImage,失败时返回空 QImage
+    """
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and not size.isEmpty():
+        # 缩放作用在旋转之前,需要按照存储方向计算目标尺寸
+        if reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+            width, height = height, width
+        reader.setScaledSize(size.scaled(QSize(width, height), Qt.AspectRatioMode.KeepAspectRatio))
+        return reader.read()
+    # 无法提前获取尺寸的格式,退化为完整解码后缩放
+    img = reader.read()
+    if img.isNull():
+        return img
+    return img.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+
+def read_display_size(path):
+    """
+    读取图像按显示方向(应用 EXIF 旋转之后)的尺寸,只读取文件头
+    :param path:
+    :return: QSize,无法读取时返回无效的 QSize
+    """
+    with open_image_reader(path) as reader:
+        size = reader.size()
+        if size.isValid() and reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+            size.transpose()
+        return size
+
+
+def load_scaled_image(path, width, height):
+    """
+    按目标尺寸解码图像文件
+    :param path: 图像路径
+    :param width: 目标宽度
+    :param height: 目标高度
+    :return: QImage
+    """
+    with open_image_reader(path) as reader:
+        return read_scaled_image(reader, width, height)
+
+
+def simplify_points(points, epsilon):
+    """
+    使用 Ramer–Douglas–Peucker 算法简化折线
+    :param points: 折线上的点 [(x, y), ...]
+    :param epsilon: 容差,距离简化后折线不超过该值的点会被去掉
+    :return: 简化后的点列表
+    """
+    n = len(points)
+    if n < 3:
+        return list(points)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    # 使用栈代替递归,避免长轨迹超出递归深度
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        x1, y1 = points[start]
+        x2, y2 = points[end]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        max_dist, max_index = -1.0, -1
+        for i in range(start + 1, end):
+            px, py = points[i]
+            if norm == 0:
+                dist = math.hypot(px - x1, py - y1)
+            else:
+                dist = abs(dy * px - dx * py + x2 * y1 - y2 * x1) / norm
+            if dist > max_dist:
+                max_dist, max_index = dist, i
+        if max_dist > epsilon:
+            keep[max_index] = True
+            stack.append((start, max_index))
+            stack.append((max_index, end))
+    return [point for point, kept in zip(points, keep) if kept]